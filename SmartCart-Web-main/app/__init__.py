@@ -0,0 +1,11 @@
+"""SmartCart app modules.
+
+The modules use flat imports (``from data_loader import ...``) because
+Streamlit runs ``app/streamlit_app.py`` as a script. For ``python -m app.batch``
+the ``app/`` folder is put on ``sys.path`` here.
+"""
+import os, sys
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+if APP_DIR not in sys.path:
+    sys.path.insert(0, APP_DIR)
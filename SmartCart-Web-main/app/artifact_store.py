@@ -0,0 +1,372 @@
+from __future__ import annotations
+import hashlib, json, os, shutil, uuid
+from collections import defaultdict
+from typing import Dict, List, Optional
+import numpy as np
+import pandas as pd
+
+from data_loader import (
+    ART_DIR, ensure_dirs, csv_paths, load_artifact, OrderCounts, count_parsed, items_and_tags_from_counts,
+    order_segments, parse_orders, segment_comatrix, pair_context_index
+)
+from customer_history import HISTORY_KEYS, CustomerHistory, merge_history
+from data_cache import file_fingerprint
+from instrument import stage
+from item_catalog import TYPE_NAMES, TAG_NAMES, ItemCatalog, decode_tags
+from item_matcher import ItemMatcher, build_char_index
+
+MODEL_DIR_NAME = "model"
+FORMAT_VERSION = 1
+# artifacts/<name>/versions/<key>/ holds every build; artifacts/<name>/current names the published one
+VERSIONS_DIR = "versions"
+CURRENT_POINTER = "current"
+# published versions kept per artifact name (the current one is never removed)
+KEEP_VERSIONS = 3
+# modules whose source shapes the artifact: editing one changes every build key
+BUILD_MODULES = ("data_loader", "artifact_store", "item_tables", "item_catalog", "item_matcher", "store_models")
+
+def code_version() -> str:
+    h = hashlib.sha1(str(FORMAT_VERSION).encode())
+    here = os.path.dirname(os.path.abspath(__file__))
+    for mod in BUILD_MODULES:
+        with open(os.path.join(here, f"{mod}.py"), "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()[:16]
+
+def build_key(sample_n: Optional[int] = None, **options) -> str:
+    """Hash of the order CSV fingerprint, ``sample_n``, build ``options`` and ``code_version()``.
+
+    With ``customers`` set the customer CSV (its guest types shape the
+    history) is fingerprinted too. Equal keys mean an identical build, so
+    ``find_version`` can reuse it.
+    """
+    paths = csv_paths()
+    spec = {"order": file_fingerprint(paths["order"]), "sample_n": sample_n,
+            "options": options, "code": code_version()}
+    if options.get("customers"):
+        spec["customer"] = file_fingerprint(paths["customer"]) if os.path.exists(paths["customer"]) else None
+    return hashlib.sha1(json.dumps(spec, sort_keys=True).encode()).hexdigest()[:16]
+
+def version_dir(key: str, name: str = MODEL_DIR_NAME) -> str:
+    return os.path.join(ART_DIR, name, VERSIONS_DIR, key)
+
+def current_key(name: str = MODEL_DIR_NAME) -> Optional[str]:
+    """Build key the ``current`` pointer names (None for the flat layout or no build)."""
+    try:
+        with open(os.path.join(ART_DIR, name, CURRENT_POINTER)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def model_dir(name: str = MODEL_DIR_NAME) -> str:
+    """Directory of the published version of ``name`` (the flat pre-versioning layout if none)."""
+    key = current_key(name)
+    return version_dir(key, name) if key else os.path.join(ART_DIR, name)
+
+def find_version(key: str, name: str = MODEL_DIR_NAME) -> Optional[str]:
+    """Directory of a finished build with this key, or None."""
+    d = version_dir(key, name)
+    return d if os.path.exists(os.path.join(d, "meta.json")) else None
+
+def publish_version(key: str, name: str = MODEL_DIR_NAME, keep: int = KEEP_VERSIONS) -> str:
+    """Point ``current`` at version ``key`` with one atomic rename, then prune old versions."""
+    d = find_version(key, name)
+    if d is None:
+        raise FileNotFoundError(f"No finished build {key} under {os.path.join(ART_DIR, name)}")
+    root = os.path.join(ART_DIR, name)
+    tmp = os.path.join(root, f"{CURRENT_POINTER}.{os.getpid()}.tmp")
+    with open(tmp, "w") as f:
+        f.write(key)
+    os.replace(tmp, os.path.join(root, CURRENT_POINTER))
+    os.utime(d)  # retention is by publish time
+    prune_versions(name, keep)
+    return d
+
+def prune_versions(name: str = MODEL_DIR_NAME, keep: int = KEEP_VERSIONS) -> List[str]:
+    """Delete all but the ``keep`` most recently published versions; returns the removed keys.
+
+    Readers that still memory-map a removed version keep their open files.
+    """
+    root = os.path.join(ART_DIR, name, VERSIONS_DIR)
+    if not os.path.isdir(root):
+        return []
+    current = os.path.basename(model_dir(name))
+    done = [e for e in os.scandir(root) if e.is_dir() and not e.name.startswith(".")]  # skip staging dirs
+    done.sort(key=lambda e: e.stat().st_mtime, reverse=True)
+    removed = []
+    for e in done[keep:]:
+        if e.name != current:
+            shutil.rmtree(e.path, ignore_errors=True)
+            removed.append(e.name)
+    return removed
+
+def save_model_artifact(art: dict, name: str = MODEL_DIR_NAME, dtype=np.float32,
+                        counts: Optional[OrderCounts] = None, key: Optional[str] = None,
+                        publish: bool = True, customers: Optional[Dict[str, np.ndarray]] = None) -> str:
+    """Write a legacy-shaped artifact dict as ``.npy`` arrays plus ``meta.json``.
+
+    Layout of ``artifacts/<name>/versions/<key>/``:
+      - ``co.npy``        dense ``n x n`` P(j|i) matrix (0 = pair never seen)
+      - ``type_code.npy`` int8 index into ``TYPE_NAMES``
+      - ``tag_mask.npy``  uint8 bitmask over ``TAG_NAMES``
+      - ``name_chars.npy`` ItemMatcher character index over lowercased names
+      - ``meta.json``     item vocabulary, matcher alphabet, ``top_by_type`` and
+                          a content hash ``version`` (cache key for the model)
+      - ``counts.npz``    raw ``OrderCounts`` of a full build, when given;
+                          ``update_artifacts`` folds new orders into it
+      - ``seg_co.npy``    ``S x n x n`` per-segment P(j|i), shrunk toward ``co``,
+                          when the counts carry context segments (keys in
+                          ``meta["segments"]``)
+      - ``pair_*.npy``    CSR (i, k) -> j index of frequent pairs (``pair_keys``
+                          R x 2, ``pair_offsets``, ``pair_targets``,
+                          ``pair_probs``) when the counts carry triples
+      - ``cust_*.npy``    CSR per-customer purchase history from
+                          ``build_customer_history``, when ``customers`` is given
+
+    ``key`` defaults to the content ``version``; see ``write_model_arrays``.
+    """
+    items = sorted(art["item_type"])
+    pos = {it: i for i, it in enumerate(items)}
+    n = len(items)
+
+    co = np.zeros((n, n), dtype=dtype)
+    for a, row in art["co_norm"].items():
+        for b, p in row.items():
+            co[pos[a], pos[b]] = p
+    return write_model_arrays(name, items, co, art["item_type"], art["item_feat"], art["top_by_type"], counts,
+                              key=key, publish=publish, customers=customers)
+
+@stage("save_artifact")
+def write_model_arrays(name: str, items: List[str], co: np.ndarray,
+                       item_type: Dict[str, str], item_feat: Dict[str, set], top_by_type: dict,
+                       counts: Optional[OrderCounts] = None, key: Optional[str] = None,
+                       publish: bool = True, customers: Optional[Dict[str, np.ndarray]] = None) -> str:
+    """Write the artifact files for a sorted vocabulary and its P(j|i) matrix.
+
+    Files go to a staging directory that is renamed to ``versions/<key>``
+    once complete (``key`` defaults to the content ``version``); an existing
+    build with the same key is kept and the new copy dropped. ``publish``
+    then points ``current`` at it. Returns the version directory.
+    """
+    ensure_dirs()
+    out_dir = os.path.join(ART_DIR, name, VERSIONS_DIR, f".staging-{os.getpid()}-{uuid.uuid4().hex[:8]}")
+    os.makedirs(out_dir)
+
+    catalog = ItemCatalog.from_tags(items, item_type, item_feat)
+    type_code, tag_mask = catalog.type_code, catalog.tag_mask
+
+    np.save(os.path.join(out_dir, "co.npy"), co)
+    np.save(os.path.join(out_dir, "type_code.npy"), type_code)
+    np.save(os.path.join(out_dir, "tag_mask.npy"), tag_mask)
+    alphabet, name_chars = build_char_index(list({it.lower(): it for it in items}))
+    np.save(os.path.join(out_dir, "name_chars.npy"), name_chars)
+    if counts is not None:
+        save_counts(counts, os.path.join(out_dir, "counts.npz"))
+    segments, seg_co = [], np.zeros((0, len(items), len(items)), dtype=co.dtype)
+    if counts is not None and counts.segments:
+        segments, seg = segment_comatrix(counts)
+        idx = np.array([counts.items.index(it) for it in items], dtype=np.int64)
+        seg_co = seg[np.ix_(np.arange(len(segments)), idx, idx)].astype(co.dtype)
+    if segments:
+        np.save(os.path.join(out_dir, "seg_co.npy"), seg_co)
+    pair_arrays = {}
+    if counts is not None and counts.triple_keys is not None:
+        pairs, offsets, targets, probs = pair_context_index(counts)
+        idx = np.array([items.index(it) for it in counts.items], dtype=np.int64)  # counts -> artifact IDs
+        pair_arrays = {"pair_keys": idx[pairs].astype(np.int32), "pair_offsets": offsets,
+                       "pair_targets": idx[targets].astype(np.int32), "pair_probs": probs.astype(co.dtype)}
+    customers = customers or {}
+    for arr_name, arr in {**pair_arrays, **customers}.items():
+        np.save(os.path.join(out_dir, f"{arr_name}.npy"), arr)
+    meta = {
+        "format": FORMAT_VERSION,
+        "items": items,
+        "type_names": TYPE_NAMES,
+        "tag_names": TAG_NAMES,
+        "name_alphabet": alphabet,
+        "top_by_type": {t: [[it, int(c)] for it, c in lst] for t, lst in top_by_type.items()},
+        "segments": segments,
+        "pair_context": bool(pair_arrays),
+        "customers": len(customers["cust_ids"]) if customers else 0,
+    }
+    h = hashlib.sha1(json.dumps(meta, sort_keys=True).encode())
+    for arr in (co, type_code, tag_mask, seg_co, *pair_arrays.values(), *customers.values()):
+        h.update(arr.tobytes())
+    meta["version"] = h.hexdigest()[:16]
+    meta["key"] = key = key or meta["version"]
+    with open(os.path.join(out_dir, "meta.json"), "w") as f:
+        json.dump(meta, f)
+    final = version_dir(key, name)
+    if find_version(key, name) is None:
+        try:
+            os.replace(out_dir, final)
+        except OSError:  # a concurrent identical build got there first
+            shutil.rmtree(out_dir, ignore_errors=True)
+    else:
+        shutil.rmtree(out_dir, ignore_errors=True)
+    if publish:
+        publish_version(key, name)
+    return final
+
+def save_counts(counts: OrderCounts, path: str) -> None:
+    np.savez(path, items=np.array(counts.items, dtype=str), freq=counts.freq,
+             item_count=counts.item_count, pair_count=counts.pair_count, first_seen=counts.first_seen,
+             totals=np.array([counts.n_orders, counts.n_occurrences], dtype=np.int64),
+             segments=np.array(counts.segments, dtype=str), seg_orders=counts.seg_orders,
+             seg_item_count=counts.seg_item_count, seg_pair_count=counts.seg_pair_count,
+             **({} if counts.triple_keys is None else
+                {"triple_keys": counts.triple_keys, "triple_counts": counts.triple_counts}))
+
+def load_counts(path: str) -> Optional[OrderCounts]:
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as z:
+        n_orders, n_occ = z["totals"].tolist()
+        opt = [z[k] if k in z else None for k in ("seg_orders", "seg_item_count", "seg_pair_count",
+                                                  "triple_keys", "triple_counts")]
+        return OrderCounts(z["items"].tolist(), z["freq"], z["item_count"], z["pair_count"],
+                           z["first_seen"], n_orders, n_occ,
+                           z["segments"].tolist() if "segments" in z else [], *opt)
+
+def update_artifacts(new_orders_df: pd.DataFrame, name: str = MODEL_DIR_NAME) -> str:
+    """Fold a delta of new orders into a full-build artifact without a rebuild.
+
+    The delta is counted on its own and merged into the stored
+    ``counts.npz`` (growing the vocabulary for new menu items). Only P(j|i)
+    rows of items that occur in the delta change; every other row is copied
+    from the current ``co.npy``. The result equals a from-scratch build over
+    history + delta. When the state carries context segments the delta's
+    context columns are counted too and ``seg_co.npy`` is recomputed; the
+    same holds for pair-context triples, and a stored customer history is
+    re-keyed and gets the delta's customers. The result is published as a new
+    version; the previous one stays available until pruned. A store build of
+    the previous version is carried forward to the new one
+    (``store_models.update_store_models``).
+    """
+    arrs = open_model_artifact(name, mmap_mode=None)
+    counts = load_counts(os.path.join(arrs["dir"], "counts.npz")) if arrs is not None else None
+    if counts is None:
+        raise FileNotFoundError(f"No count state under {model_dir(name)}; run a full build first")
+
+    pair_context = counts.triple_keys is not None
+    # segments only when the state has them: a delta's context columns alone must not add any
+    delta = count_parsed(parse_orders(new_orders_df),
+                         order_segments(new_orders_df) if counts.segments else None, pair_context)
+    total = counts.merge(delta)
+    item_type, item_feat, top_by_type, items = items_and_tags_from_counts(total)
+
+    pos = {it: i for i, it in enumerate(items)}
+    old_idx = np.array([pos[it] for it in arrs["items"]], dtype=np.int64)
+    co = np.zeros((len(items), len(items)), dtype=arrs["co"].dtype)
+    co[np.ix_(old_idx, old_idx)] = arrs["co"]
+    changed = np.array([pos[it] for it in delta.items], dtype=np.int64)
+    denom = np.maximum(total.item_count[changed], 1)
+    co[changed] = total.pair_count[changed] / denom[:, None]
+    customers = None
+    if arrs["cust_ids"] is not None:
+        customers = merge_history({k: arrs[k] for k in HISTORY_KEYS}, arrs["items"], items, new_orders_df)
+    out = write_model_arrays(name, items, co, item_type, item_feat, top_by_type, total, customers=customers)
+    from store_models import update_store_models  # store_models imports this module
+    update_store_models(arrs["key"], os.path.basename(out), items, new_orders_df)
+    return out
+
+def open_model_artifact(name: str = MODEL_DIR_NAME, mmap_mode: Optional[str] = "r",
+                        version: Optional[str] = None) -> Optional[dict]:
+    """Open the published (or the given ``version`` key) array artifact.
+
+    Arrays are memory-mapped read-only by default.
+    """
+    d = model_dir(name) if version is None else version_dir(version, name)
+    meta_path = os.path.join(d, "meta.json")
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path) as f:
+        meta = json.load(f)
+    arrs = {"dir": d, "items": meta["items"], "top_by_type": meta["top_by_type"],
+            "name_alphabet": meta["name_alphabet"], "version": meta["version"], "key": meta.get("key"),
+            "segments": meta.get("segments", [])}
+    for key in ("co", "type_code", "tag_mask", "name_chars"):
+        arrs[key] = np.load(os.path.join(d, f"{key}.npy"), mmap_mode=mmap_mode)
+    arrs["seg_co"] = np.load(os.path.join(d, "seg_co.npy"), mmap_mode=mmap_mode) if arrs["segments"] else None
+    for key in ("pair_keys", "pair_offsets", "pair_targets", "pair_probs"):
+        arrs[key] = np.load(os.path.join(d, f"{key}.npy"), mmap_mode=mmap_mode) if meta.get("pair_context") else None
+    for key in HISTORY_KEYS:
+        arrs[key] = np.load(os.path.join(d, f"{key}.npy"), mmap_mode=mmap_mode) if meta.get("customers") else None
+    return arrs
+
+def _co_dict(items: List[str], co: np.ndarray) -> Dict[str, Dict[str, float]]:
+    co_norm: Dict[str, Dict[str, float]] = defaultdict(dict)
+    for a in np.flatnonzero(np.any(co != 0, axis=1)):
+        cols = np.flatnonzero(co[a])
+        co_norm[items[a]] = dict(zip([items[b] for b in cols], co[a, cols].astype(float).tolist()))
+    return co_norm
+
+def _pair_dict(items: List[str], arrs: dict) -> Dict[tuple, Dict[str, float]]:
+    """``{(item_i, item_k): {item_j: P(j | i, k)}}`` from the CSR pair index."""
+    if arrs.get("pair_keys") is None:
+        return {}
+    off = arrs["pair_offsets"].tolist()
+    targets, probs = arrs["pair_targets"].tolist(), arrs["pair_probs"].astype(float).tolist()
+    return {(items[i], items[k]): {items[t]: p for t, p in zip(targets[off[r]:off[r + 1]], probs[off[r]:off[r + 1]])}
+            for r, (i, k) in enumerate(arrs["pair_keys"].tolist())}
+
+class LegacyArtifact(dict):
+    """The dict-of-dicts artifact; ``co_norm``, ``segment_co`` and ``pair_co`` are built on first access.
+
+    Pages and ``SmartCartModel`` read the arrays, so only ``enhanced_recommend``
+    callers pay for the per-item dicts. Lazy keys do not show up in ``keys()``
+    until they are built.
+    """
+    LAZY = {
+        "co_norm": lambda arrs: _co_dict(arrs["items"], arrs["co"]),
+        "segment_co": lambda arrs: {sg: _co_dict(arrs["items"], m) for sg, m in zip(arrs["segments"], arrs["seg_co"])}
+                                   if arrs["segments"] else {},
+        "pair_co": lambda arrs: _pair_dict(arrs["items"], arrs),
+    }
+
+    def __missing__(self, key):
+        if key not in self.LAZY:
+            raise KeyError(key)
+        value = self[key] = self.LAZY[key](self["arrays"])
+        return value
+
+    def __contains__(self, key) -> bool:
+        return key in self.LAZY or dict.__contains__(self, key)
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+def to_legacy_artifact(arrs: dict) -> dict:
+    """Wrap the arrays in the artifact dict the pages and ``enhanced_recommend`` use."""
+    items: List[str] = arrs["items"]
+    lower_to_orig = {it.lower(): it for it in items}
+    return LegacyArtifact({
+        "item_type": {it: TYPE_NAMES[c] for it, c in zip(items, arrs["type_code"].tolist())},
+        "item_feat": {it: decode_tags(m) for it, m in zip(items, arrs["tag_mask"].tolist())},
+        "top_by_type": {t: [(it, c) for it, c in lst] for t, lst in arrs["top_by_type"].items()},
+        "segments": list(arrs["segments"]),
+        "customer_history": CustomerHistory(arrs, items) if arrs["cust_ids"] is not None else None,
+        "catalog": ItemCatalog.from_arrays(arrs),
+        "known_items_lower": list(lower_to_orig.keys()),
+        "lower_to_orig": lower_to_orig,
+        "matcher": ItemMatcher(lower_to_orig, alphabet=arrs["name_alphabet"], char_counts=arrs["name_chars"]),
+        "arrays": arrs,
+        "version": arrs["version"],
+    })
+
+def load_model_artifact(name: str = MODEL_DIR_NAME, legacy_pickle: str = "artifacts.pkl",
+                        version: Optional[str] = None) -> Optional[dict]:
+    """Load the array artifact, falling back to the old ``artifacts.pkl``."""
+    arrs = open_model_artifact(name, version=version)
+    if arrs is not None:
+        return to_legacy_artifact(arrs)
+    if version is not None:
+        return None
+    art = load_artifact(legacy_pickle)
+    if art is not None:
+        art["matcher"] = ItemMatcher(art["lower_to_orig"])
+        art["catalog"] = ItemCatalog.from_tags(sorted(art["item_type"]), art["item_type"], art["item_feat"])
+        art["segments"] = list(art.get("segment_co", {}))
+        with open(os.path.join(ART_DIR, legacy_pickle), "rb") as f:
+            art["version"] = hashlib.sha1(f.read()).hexdigest()[:16]
+    return art
@@ -0,0 +1,222 @@
+"""Streaming batch predictor for schedulers (no browser needed).
+
+Run from the ``SmartCart-Web-main`` folder::
+
+    python -m app.batch --input data/test_data_question.csv --output out.csv --workers 4
+
+The input is read ``--chunksize`` rows at a time. Each chunk goes through
+``batch_predict`` (in a process pool when ``--workers`` > 1, with at most
+two chunks per worker in flight) and is appended to the output CSV in
+input order, so memory stays flat however long the file is. After every
+chunk ``<output>.progress.json`` records the rows done, the output size and
+the input byte offset; a rerun seeks there and resumes after the last
+completed chunk unless ``--restart`` is given.
+With ``--per-store`` rows are scored on their store's model (see
+``store_models``); stores without one use the global model. ``--pair-context``
+scores carts holding an indexed item pair on P(j | i, k) (off by default, so
+results match the Batch page).
+"""
+from __future__ import annotations
+import argparse, io, json, os, sys, time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, Optional, TextIO
+
+import numpy as np
+import pandas as pd
+
+from artifact_store import load_model_artifact
+from data_cache import file_fingerprint
+from data_loader import SCAN_BLOCK
+from paths import ART_DIR, csv_paths
+from recommender import DEFAULT_BLACKLIST, SmartCartModel, batch_predict
+from store_models import StoreModelRegistry, store_version
+
+BATCH_CHUNK = 100_000
+OUTPUT_NAME = "SmartCart_Recommendation_Output.csv"
+PROGRESS_SUFFIX = ".progress.json"
+
+_ART: Optional[dict] = None
+_MODEL: Optional[SmartCartModel] = None
+_STORES: Optional[StoreModelRegistry] = None
+
+def _load(version: Optional[str], per_store: bool = False, pair_context: bool = False) -> None:
+    """Load (once per process) the artifact version the run started with."""
+    global _ART, _MODEL, _STORES
+    _ART = load_model_artifact(version=version)
+    _MODEL = SmartCartModel.from_artifact(_ART, pair_context=pair_context)
+    _STORES = StoreModelRegistry.open(_ART, _MODEL) if per_store else None
+
+def predict_chunk(chunk: pd.DataFrame, header: bool, top_n: int = 3, use_context: bool = False,
+                  use_customer: bool = False, per_store: bool = False) -> str:
+    """Recommendations for one chunk as CSV text (with the header row if ``header``)."""
+    out = batch_predict(chunk, None, _ART["item_type"], _ART["top_by_type"], _ART["item_feat"],
+                        _ART["known_items_lower"], _ART["lower_to_orig"], DEFAULT_BLACKLIST, top_n=top_n,
+                        model=_MODEL, matcher=_ART.get("matcher"), use_context=use_context,
+                        use_customer=use_customer, stores=_STORES if per_store else None)
+    return out.to_csv(index=False, header=header)
+
+def iter_csv_chunks(path: str, chunksize: int, start: Optional[int] = None,
+                    skip: int = 0) -> Iterator[tuple[pd.DataFrame, int]]:
+    """Chunks of ``chunksize`` rows of ``path`` (as strings), each with the byte offset just past it.
+
+    Cells are parsed as ``pd.read_csv`` does by default, the Batch page's
+    reading: empty, ``NA``, ``null``, ``N/A`` and the like come back as NaN.
+
+    Reading starts at byte ``start`` (a record boundary from an earlier
+    chunk; default the first data row) after passing over ``skip`` rows.
+    Records are cut at newlines outside quotes, tracking quote parity as
+    ``shard_offsets`` does; blank lines are not rows, as in ``read_csv``.
+    """
+    with open(path, "rb") as f:
+        header = f.readline()
+        if start is not None:
+            f.seek(start)
+        pos = f.tell()  # file offset of buf[0]
+        buf, done, last, quotes, eof = b"", 0, 0, 0, False  # buf[done:] is not emitted yet
+        ends, e = np.zeros(0, dtype=np.int64), 0  # row ends in buf; ends[e:] are not emitted yet
+        while not eof:
+            block = f.read(SCAN_BLOCK)
+            eof = not block
+            buf, ends, last, pos = buf[done:] + block, ends[e:] - done, last - done, pos + done
+            done, e = 0, 0
+            if block:
+                blk = np.frombuffer(block, dtype=np.uint8)
+                nl, q = np.flatnonzero(blk == ord("\n")), np.flatnonzero(blk == ord('"'))
+                nl = nl[(quotes + np.searchsorted(q, nl)) % 2 == 0] + (len(buf) - len(block) + 1)
+                quotes += len(q)
+            else:
+                nl = np.array([len(buf)] if len(buf) > last else [], dtype=np.int64)
+            if len(nl):
+                starts = np.concatenate([[last], nl[:-1]])
+                size = nl - starts
+                blank = (size <= 1) | ((size == 2) & (np.frombuffer(buf, dtype=np.uint8)[starts] == ord("\r")))
+                ends, last = np.concatenate([ends, nl[~blank]]), int(nl[-1])
+            while e < len(ends) and (skip or len(ends) - e >= chunksize or eof):
+                k = min(skip or chunksize, len(ends) - e)
+                cut = len(buf) if eof and not skip and e + k == len(ends) else int(ends[e + k - 1])
+                data, done, e = buf[done:cut], cut, e + k
+                if skip:
+                    skip -= k
+                    continue
+                yield pd.read_csv(io.BytesIO(header + data), dtype=str), pos + cut
+
+def _read_progress(path: str) -> Optional[dict]:
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def _write_progress(path: str, progress: dict) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(progress, f)
+    os.replace(tmp, path)
+
+def run_batch(input_path: Optional[str] = None, output_path: Optional[str] = None,
+              chunksize: int = BATCH_CHUNK, workers: int = 1, top_n: int = 3,
+              use_context: bool = False, restart: bool = False, log: TextIO = sys.stderr,
+              use_customer: bool = False, per_store: bool = False, pair_context: bool = False) -> dict:
+    """Stream ``input_path`` through the published model into ``output_path``; returns a summary."""
+    input_path = input_path or csv_paths()["test"]
+    output_path = output_path or os.path.join(ART_DIR, OUTPUT_NAME)
+    progress_path = output_path + PROGRESS_SUFFIX
+    art = load_model_artifact()
+    if art is None:
+        raise FileNotFoundError("No model artifact found; build one first")
+    version = art["arrays"].get("key") if art.get("arrays") else None
+    if per_store and store_version(art) is None:
+        raise FileNotFoundError("No store models for the published artifact; run a full build first")
+    spec = {"input": os.path.abspath(input_path), "fingerprint": file_fingerprint(input_path),
+            "version": art["version"], "chunksize": chunksize, "top_n": top_n, "use_context": use_context,
+            "use_customer": use_customer, "per_store": per_store,
+            **({"pair_context": True} if pair_context else {})}  # records from before the option stay valid
+
+    progress = None if restart else _read_progress(progress_path)
+    if progress is not None:
+        if progress["spec"] != spec:
+            raise ValueError(f"{progress_path} belongs to a different input, model or options; "
+                             "pass --restart to start over")
+        if not os.path.exists(output_path) or os.path.getsize(output_path) < progress["bytes"]:
+            raise ValueError(f"{output_path} is shorter than its progress record; pass --restart")
+    rows_done = progress["rows"] if progress else 0
+    chunks_done = progress["chunks"] if progress else 0
+    if progress and progress["done"]:
+        print(f"already complete: {rows_done:,} rows in {output_path}", file=log)
+        return {"output": output_path, "rows": 0, "total_rows": rows_done, "chunks": chunks_done,
+                "seconds": 0.0, "rows_per_s": None, "workers": workers}
+
+    # resume at the recorded input offset; records written before offsets were kept pass over the rows
+    start = progress.get("input_bytes") if progress else None
+    input_bytes = start
+    reader = iter_csv_chunks(input_path, chunksize, start=start, skip=rows_done if start is None else 0)
+    t0 = time.perf_counter()
+    new_rows = 0
+    with open(output_path, "ab" if progress else "wb") as out:
+        if progress:
+            out.truncate(progress["bytes"])  # drop a chunk that was written but not recorded
+
+        def commit(text: str, rows: int, end: int) -> None:
+            nonlocal rows_done, chunks_done, new_rows, input_bytes
+            out.write(text.encode())
+            out.flush()
+            os.fsync(out.fileno())  # the progress record never points past durable bytes
+            rows_done, chunks_done, new_rows = rows_done + rows, chunks_done + 1, new_rows + rows
+            input_bytes = end
+            _write_progress(progress_path, {"spec": spec, "rows": rows_done, "chunks": chunks_done,
+                                            "bytes": out.tell(), "input_bytes": end, "done": False})
+            dt = time.perf_counter() - t0
+            print(f"chunk {chunks_done}: {rows_done:,} rows, {new_rows / dt if dt else 0:,.0f} rows/s",
+                  file=log, flush=True)
+
+        first = chunks_done == 0
+        if workers <= 1:
+            _load(version, per_store, pair_context)
+            for chunk, end in reader:
+                commit(predict_chunk(chunk, first, top_n, use_context, use_customer, per_store), len(chunk), end)
+                first = False
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_load,
+                                     initargs=(version, per_store, pair_context)) as pool:
+                pending: deque = deque()
+                for chunk, end in reader:
+                    pending.append((pool.submit(predict_chunk, chunk, first, top_n, use_context, use_customer,
+                                                per_store), len(chunk), end))
+                    first = False
+                    while len(pending) >= 2 * workers:
+                        fut, rows, end = pending.popleft()
+                        commit(fut.result(), rows, end)
+                while pending:
+                    fut, rows, end = pending.popleft()
+                    commit(fut.result(), rows, end)
+        _write_progress(progress_path, {"spec": spec, "rows": rows_done, "chunks": chunks_done,
+                                        "bytes": out.tell(), "input_bytes": input_bytes, "done": True})
+    seconds = round(time.perf_counter() - t0, 3)
+    return {"output": output_path, "rows": new_rows, "total_rows": rows_done, "chunks": chunks_done,
+            "seconds": seconds, "rows_per_s": round(new_rows / seconds, 1) if seconds else None,
+            "workers": workers}
+
+def main(argv=None) -> None:
+    ap = argparse.ArgumentParser(description="Streaming SmartCart batch prediction")
+    ap.add_argument("--input", help="cart CSV with item1..item3 (default: data/test_data_question.csv)")
+    ap.add_argument("--output", help=f"output CSV (default: artifacts/{OUTPUT_NAME})")
+    ap.add_argument("--chunksize", type=int, default=BATCH_CHUNK)
+    ap.add_argument("--workers", type=int, default=1, help="process pool size (0 = all cores)")
+    ap.add_argument("--top-n", type=int, default=3)
+    ap.add_argument("--use-context", action="store_true", help="score rows on their occasion/channel/date segment")
+    ap.add_argument("--personalize", action="store_true", help="re-rank rows by their CUSTOMER_ID's purchase history")
+    ap.add_argument("--per-store", action="store_true", help="score rows on their STORE_NUMBER's own model")
+    ap.add_argument("--pair-context", action="store_true",
+                    help="score carts holding an indexed item pair on P(j | i, k)")
+    ap.add_argument("--restart", action="store_true", help="ignore the progress record and start over")
+    args = ap.parse_args(argv)
+    try:
+        summary = run_batch(args.input, args.output, args.chunksize, args.workers or os.cpu_count(),
+                            args.top_n, args.use_context, args.restart, use_customer=args.personalize,
+                            per_store=args.per_store, pair_context=args.pair_context)
+    except (FileNotFoundError, ValueError) as e:
+        ap.error(str(e))
+    print(json.dumps(summary, indent=2))
+
+if __name__ == "__main__":
+    main()
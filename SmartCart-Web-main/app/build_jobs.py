@@ -0,0 +1,130 @@
+"""Background model builds: one job per artifact name, with progress and cancellation.
+
+    job = build_jobs.submit("model", prepare_artifacts, sample_n, precompute)
+    job.snapshot()   # state, step, orders parsed / counted, elapsed seconds
+    job.cancel()
+
+A job runs on a daemon thread of the serving process, so it outlives the
+script run that started it (reruns, page switches). Inside the job,
+``step(label)`` names the coarse build step and every ``instrument.stage``
+record feeds the counters; both check the cancel flag and raise
+``BuildCancelled``, so a cancelled build stops at its next chunk. Artifacts
+are published only when the build function returns, so pages keep serving
+the previous version meanwhile.
+"""
+from __future__ import annotations
+import threading, time, traceback, uuid
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional
+
+import instrument
+
+# finished jobs kept for display
+JOB_HISTORY = 20
+# stage name -> progress counter its rows add to
+PROGRESS_STAGES = {"parse_json": "orders_parsed", "pair_counting": "orders_counted"}
+
+_lock = threading.Lock()
+_latest: Dict[str, "BuildJob"] = {}
+_history: Deque["BuildJob"] = deque(maxlen=JOB_HISTORY)
+_local = threading.local()
+
+class BuildCancelled(Exception):
+    """Raised on a job's thread once its cancellation was requested."""
+
+class BuildJob:
+    """One background run of a build function; read its state with ``snapshot``."""
+
+    def __init__(self, name: str, fn: Callable, args: tuple, kwargs: dict, total_rows: Optional[int] = None):
+        self.id = uuid.uuid4().hex[:8]
+        self.name = name
+        self.state = "queued"
+        self.step = None
+        self.last_stage = None
+        self.counters = dict.fromkeys(PROGRESS_STAGES.values(), 0)
+        self.total_rows = total_rows
+        self.result = None
+        self.error: Optional[str] = None
+        self.traceback: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._cancel = threading.Event()
+        self._call = (fn, args, kwargs)
+        self._thread = threading.Thread(target=self._run, name=f"build-{name}-{self.id}", daemon=True)
+
+    @property
+    def active(self) -> bool:
+        return self.state in ("queued", "running")
+
+    def cancel(self) -> None:
+        """Ask the build to stop at its next step or stage record."""
+        self._cancel.set()
+
+    def _check(self) -> None:
+        if self._cancel.is_set():
+            raise BuildCancelled(f"build {self.id} of {self.name!r} cancelled")
+
+    def _set_step(self, label: str) -> None:
+        self._check()
+        self.step = label
+        self.counters = dict.fromkeys(PROGRESS_STAGES.values(), 0)
+
+    def _on_stage(self, rec: dict) -> None:
+        key = PROGRESS_STAGES.get(rec["stage"])
+        if key is not None:
+            self.counters[key] += rec.get("rows") or 0
+        self.last_stage = rec["stage"]
+        self._check()
+
+    def _run(self) -> None:
+        fn, args, kwargs = self._call
+        _local.job = self
+        self.state, self.started_at = "running", time.time()
+        try:
+            with instrument.listen(self._on_stage):
+                self._check()
+                self.result = fn(*args, **kwargs)
+            self.state = "done"
+        except BuildCancelled:
+            self.state = "cancelled"
+        except Exception as e:
+            self.state, self.error = "failed", f"{type(e).__name__}: {e}"
+            self.traceback = traceback.format_exc()
+        finally:
+            self.finished_at = time.time()
+            _local.job = None
+
+    def snapshot(self) -> dict:
+        end = self.finished_at or time.time()
+        parsed = self.counters.get("orders_parsed", 0)
+        return {"id": self.id, "name": self.name, "state": self.state, "step": self.step,
+                "last_stage": self.last_stage, **self.counters, "total_rows": self.total_rows,
+                "fraction": min(parsed / self.total_rows, 1.0) if self.total_rows else None,
+                "elapsed_s": round(end - self.started_at, 1) if self.started_at else 0.0,
+                "cancel_requested": self._cancel.is_set(), "error": self.error}
+
+def submit(name: str, fn: Callable, *args, total_rows: Optional[int] = None, **kwargs) -> BuildJob:
+    """Start ``fn(*args, **kwargs)`` as the build of ``name``; returns the running one if any."""
+    with _lock:
+        job = _latest.get(name)
+        if job is not None and job.active:
+            return job
+        job = BuildJob(name, fn, args, kwargs, total_rows)
+        _latest[name] = job
+        _history.append(job)
+    job._thread.start()
+    return job
+
+def current(name: str) -> Optional[BuildJob]:
+    """The running or most recent job of ``name``."""
+    return _latest.get(name)
+
+def jobs() -> List[BuildJob]:
+    return list(_history)
+
+def step(label: str) -> None:
+    """Name the current build step (no-op outside a job); raises ``BuildCancelled`` if cancelled."""
+    job = getattr(_local, "job", None)
+    if job is not None:
+        job._set_step(label)
@@ -0,0 +1,222 @@
+"""Per-customer purchase history as a memory-mapped CSR index.
+
+``build_customer_history`` streams ``CUSTOMER_ID`` / ``ORDERS`` once and
+counts, per customer, the orders that contain each artifact item. The index
+is four arrays stored with the model artifact:
+
+  - ``cust_ids``     sorted customer IDs (int64)
+  - ``cust_offsets`` row starts into the next two arrays (len + 1)
+  - ``cust_items``   artifact item IDs bought by each customer, ascending
+  - ``cust_counts``  orders of that customer containing the item
+
+Guests (``CUSTOMER_TYPE`` in ``GUEST_TYPES`` in ``customer_data.csv``) are
+left out. ``CustomerHistory`` finds a customer with one binary search and
+turns their counts into score multipliers ``1 + AFFINITY_WEIGHT * count /
+max_count``, which ``enhanced_recommend`` and ``SmartCartModel`` apply to
+candidate scores before the per-type top-N pick.
+
+A full build counts the history in its sharded order pass instead:
+``CustomerCounts`` is a ``stream_order_counts`` tally, and ``history``
+re-keys the merged tally to the artifact items.
+"""
+from __future__ import annotations
+import math, os
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+
+from data_loader import ORDER_CHUNK, OrderParser, ParsedOrders, csv_paths, iter_order_chunks
+from instrument import stage
+
+AFFINITY_WEIGHT = 0.5
+GUEST_TYPES = ("Guest",)
+HISTORY_KEYS = ("cust_ids", "cust_offsets", "cust_items", "cust_counts")
+
+def guest_ids(path: Optional[str] = None) -> np.ndarray:
+    """Sorted IDs of guest customers (empty when the customer file has no types)."""
+    path = path or csv_paths()["customer"]
+    if not os.path.exists(path):
+        return np.zeros(0, dtype=np.int64)
+    cols = pd.read_csv(path, nrows=0).columns
+    if "CUSTOMER_ID" not in cols or "CUSTOMER_TYPE" not in cols:
+        return np.zeros(0, dtype=np.int64)
+    df = pd.read_csv(path, usecols=["CUSTOMER_ID", "CUSTOMER_TYPE"], dtype=str)
+    ids = pd.to_numeric(df.loc[df["CUSTOMER_TYPE"].isin(GUEST_TYPES), "CUSTOMER_ID"], errors="coerce").dropna()
+    return np.unique(ids.to_numpy(dtype=np.int64))
+
+def customer_keys(customers: pd.Series, parsed: ParsedOrders, item_id: Dict[str, int],
+                  exclude: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Unique ``customer * n_items + item`` keys of ``parsed`` and their order counts.
+
+    ``customers`` holds the customer ID of each parsed order.
+    """
+    n = max(len(item_id), 1)
+    cust = pd.to_numeric(customers, errors="coerce").to_numpy(dtype=np.float64)
+    order_idx, ids = parsed.encode(item_id)
+    c = cust[order_idx]
+    keep = (c >= 0) & (c == np.floor(c))  # drops NaN and non-integer IDs
+    c, ids = c[keep].astype(np.int64), ids[keep]
+    keep = ~np.isin(c, exclude)
+    return np.unique(c[keep] * n + ids[keep], return_counts=True)
+
+def count_customer_chunk(chunk: pd.DataFrame, item_id: Dict[str, int], exclude: np.ndarray,
+                         parser: Optional[OrderParser] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Unique ``customer * n_items + item`` keys of one order chunk and their order counts."""
+    return customer_keys(chunk["CUSTOMER_ID"], (parser or OrderParser()).parse(chunk["ORDERS"]), item_id, exclude)
+
+def history_arrays(keys: List[np.ndarray], counts: List[np.ndarray], n_items: int) -> Dict[str, np.ndarray]:
+    """CSR arrays from (possibly repeated) ``customer * n_items + item`` keys."""
+    n = max(n_items, 1)
+    key = np.concatenate(keys) if keys else np.zeros(0, dtype=np.int64)
+    cnt = np.concatenate(counts) if counts else np.zeros(0, dtype=np.int64)
+    uniq, inv = np.unique(key, return_inverse=True)
+    total = np.bincount(inv.reshape(-1), weights=cnt, minlength=len(uniq)).astype(np.int64)
+    cust, item = uniq // n, uniq % n
+    ids, starts = np.unique(cust, return_index=True)
+    offsets = np.append(starts, len(uniq))
+    return {"cust_ids": ids.astype(np.int64),
+            "cust_offsets": offsets.astype(np.min_scalar_type(len(uniq))),
+            "cust_items": item.astype(np.min_scalar_type(n - 1)),
+            "cust_counts": total.astype(np.min_scalar_type(int(total.max()) if len(total) else 0))}
+
+@stage("customer_history")
+def build_customer_history(items: List[str], path: Optional[str] = None,
+                           chunksize: int = ORDER_CHUNK) -> Dict[str, np.ndarray]:
+    """Stream the order file into CSR history arrays over the sorted artifact ``items``."""
+    item_id = {it: i for i, it in enumerate(items)}
+    exclude = guest_ids()
+    keys, counts, parser = [], [], OrderParser()
+    for chunk in iter_order_chunks(path or csv_paths()["order"], chunksize, ("CUSTOMER_ID", "ORDERS")):
+        if "CUSTOMER_ID" not in chunk:
+            break
+        k, c = count_customer_chunk(chunk, item_id, exclude, parser)
+        keys.append(k)
+        counts.append(c)
+    return history_arrays(keys, counts, len(items))
+
+@dataclass
+class CustomerCounts:
+    """Mergeable customer history counts over their own vocabulary ``items``.
+
+    ``keys`` are the sorted ``customer * len(items) + item`` codes and
+    ``counts`` the orders behind each. Customers in ``exclude`` (guests)
+    are not counted. Pass ``CustomerCounts(guest_ids())`` as a
+    ``stream_order_counts`` tally, then call ``history`` on the merged one.
+    """
+    exclude: np.ndarray
+    items: List[str] = field(default_factory=list)
+    keys: np.ndarray = field(default_factory=lambda: np.zeros(0, dtype=np.int64))
+    counts: np.ndarray = field(default_factory=lambda: np.zeros(0, dtype=np.int64))
+
+    columns = ("CUSTOMER_ID", "ORDERS")
+
+    def count(self, chunk: pd.DataFrame, parsed: ParsedOrders) -> "CustomerCounts":
+        """The tally of one parsed chunk (empty when it has no ``CUSTOMER_ID``)."""
+        if "CUSTOMER_ID" not in chunk:
+            return CustomerCounts(self.exclude, list(parsed.items))
+        k, c = customer_keys(chunk["CUSTOMER_ID"], parsed, {it: i for i, it in enumerate(parsed.items)},
+                             self.exclude)
+        return CustomerCounts(self.exclude, list(parsed.items), k, c)
+
+    def rekeyed(self, items: List[str]) -> np.ndarray:
+        """``keys`` under ``items``, a superset of ``self.items``."""
+        pos = {it: i for i, it in enumerate(items)}
+        remap = np.array([pos[it] for it in self.items], dtype=np.int64)
+        cust, item = np.divmod(self.keys, max(len(self.items), 1))
+        return cust * max(len(items), 1) + remap[item]
+
+    def merge(self, later: "CustomerCounts") -> "CustomerCounts":
+        known = set(self.items)
+        items = self.items + [it for it in later.items if it not in known]
+        keys, inv = np.unique(np.concatenate([self.rekeyed(items), later.rekeyed(items)]), return_inverse=True)
+        counts = np.bincount(inv.reshape(-1), weights=np.concatenate([self.counts, later.counts]),
+                             minlength=len(keys)).astype(np.int64)
+        return CustomerCounts(self.exclude, items, keys, counts)
+
+    def history(self, items: List[str]) -> Dict[str, np.ndarray]:
+        """CSR history arrays over the sorted artifact ``items`` (as ``build_customer_history``)."""
+        return history_arrays([self.rekeyed(items)], [self.counts], len(items))
+
+def merge_history(old: Dict[str, np.ndarray], old_items: List[str], items: List[str],
+                  delta: Optional[pd.DataFrame] = None) -> Dict[str, np.ndarray]:
+    """Re-key ``old`` arrays to the (grown) ``items`` vocabulary and add a delta of orders."""
+    pos = {it: i for i, it in enumerate(items)}
+    remap = np.array([pos[it] for it in old_items], dtype=np.int64)
+    n = max(len(items), 1)
+    offsets = np.asarray(old["cust_offsets"], dtype=np.int64)
+    cust = np.repeat(np.asarray(old["cust_ids"], dtype=np.int64), np.diff(offsets))
+    keys = [cust * n + remap[np.asarray(old["cust_items"], dtype=np.int64)]]
+    counts = [np.asarray(old["cust_counts"], dtype=np.int64)]
+    if delta is not None and "CUSTOMER_ID" in delta and "ORDERS" in delta:
+        k, c = count_customer_chunk(delta, pos, guest_ids())
+        keys.append(k)
+        counts.append(c)
+    return history_arrays(keys, counts, len(items))
+
+class CustomerHistory:
+    """Read side of the index: binary-search lookup and affinity multipliers."""
+
+    def __init__(self, arrays: Dict[str, np.ndarray], items: List[str], weight: float = AFFINITY_WEIGHT):
+        self.ids = arrays["cust_ids"]
+        self.offsets = arrays["cust_offsets"]
+        self.item_ids = arrays["cust_items"]
+        self.counts = arrays["cust_counts"]
+        self.items = list(items)
+        self.weight = weight
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def rows(self, customer_ids: Iterable) -> np.ndarray:
+        """Index of each customer in the history (-1 = unknown, guest or missing)."""
+        cid = pd.to_numeric(pd.Series(list(customer_ids), dtype=object), errors="coerce").to_numpy(dtype=np.float64)
+        ok = np.isfinite(cid) & (cid >= 0) & (cid == np.floor(cid))
+        cid = np.where(ok, cid, -1).astype(np.int64)
+        pos = np.searchsorted(self.ids, cid)
+        found = ok & (pos < len(self.ids)) & (self.ids[np.minimum(pos, len(self.ids) - 1)] == cid) \
+            if len(self.ids) else np.zeros(len(cid), dtype=bool)
+        return np.where(found, pos, -1)
+
+    def row(self, customer_id) -> int:
+        """Index of one customer (-1 if absent); a single ``searchsorted``."""
+        try:
+            f = float(customer_id)
+        except (TypeError, ValueError):
+            return -1
+        if not (math.isfinite(f) and f >= 0 and f == math.floor(f)):
+            return -1
+        cid = int(f)
+        i = int(np.searchsorted(self.ids, cid))
+        return i if i < len(self.ids) and int(self.ids[i]) == cid else -1
+
+    def lookup(self, customer_id) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """``(item_ids, counts)`` of one customer, or None."""
+        row = self.row(customer_id)
+        if row < 0:
+            return None
+        a, b = int(self.offsets[row]), int(self.offsets[row + 1])
+        return np.asarray(self.item_ids[a:b], dtype=np.int64), np.asarray(self.counts[a:b], dtype=np.int64)
+
+    def multiplier_rows(self, rows: np.ndarray) -> np.ndarray:
+        """``len(rows) x n_items`` score multipliers (1.0 where a row is -1 or an item unbought)."""
+        out = np.ones((len(rows), len(self.items)))
+        for r, row in enumerate(np.asarray(rows).tolist()):
+            if row >= 0:
+                a, b = int(self.offsets[row]), int(self.offsets[row + 1])
+                cnt = np.asarray(self.counts[a:b], dtype=np.float64)
+                out[r, np.asarray(self.item_ids[a:b], dtype=np.int64)] = 1.0 + self.weight * cnt / cnt.max()
+        return out
+
+    def multipliers(self, customer_id) -> Optional[np.ndarray]:
+        row = self.row(customer_id)
+        return None if row < 0 else self.multiplier_rows(np.array([row]))[0]
+
+    def affinity(self, customer_id) -> Dict[str, float]:
+        """``{item: multiplier}`` for the items a customer bought (empty if unknown)."""
+        row = self.row(customer_id)
+        if row < 0:
+            return {}
+        m = self.multiplier_rows(np.array([row]))[0]
+        a, b = int(self.offsets[row]), int(self.offsets[row + 1])
+        return {self.items[i]: float(m[i]) for i in np.asarray(self.item_ids[a:b]).tolist()}
@@ -0,0 +1,249 @@
+"""Columnar on-disk cache of the input CSVs.
+
+``build_data_cache`` converts each CSV once into
+``artifacts/data_cache/<table>/``: one ``.npy`` per column, downcast
+(integers and floats to the smallest lossless dtype, ``*DATE*`` columns to
+``datetime64[s]``, low-cardinality strings to category codes, free text
+such as ``ORDERS`` to a UTF-8 byte buffer plus offsets) and a
+``meta.json`` sidecar with row counts, column encodings and a fingerprint
+of every source file. ``row_counts`` answers from the sidecar alone and
+``load_columns`` memory-maps only the columns a page asks for.
+
+numpy and pandas are imported inside the functions that need them, so the
+app can render its start page without loading either.
+"""
+from __future__ import annotations
+import hashlib, json, os, shutil
+from typing import Dict, Iterable, List, Optional
+
+from paths import ART_DIR, csv_paths
+
+CACHE_DIR_NAME = "data_cache"
+CACHE_FORMAT = 1
+CONVERT_CHUNK = 200_000
+# string columns with at most this many distinct values become category codes
+CATEGORY_MAX = 4_096
+# bytes hashed from each end of a source file for its fingerprint
+FINGERPRINT_BYTES = 1 << 20
+
+def cache_dir() -> str:
+    return os.path.join(ART_DIR, CACHE_DIR_NAME)
+
+def file_fingerprint(path: str) -> str:
+    """Size, mtime and the first/last ``FINGERPRINT_BYTES`` of ``path``."""
+    st = os.stat(path)
+    h = hashlib.sha1(f"{st.st_size}:{st.st_mtime_ns}".encode())
+    with open(path, "rb") as f:
+        h.update(f.read(FINGERPRINT_BYTES))
+        if st.st_size > FINGERPRINT_BYTES:
+            f.seek(max(st.st_size - FINGERPRINT_BYTES, FINGERPRINT_BYTES))
+            h.update(f.read())
+    return h.hexdigest()[:16]
+
+def read_meta() -> Optional[dict]:
+    p = os.path.join(cache_dir(), "meta.json")
+    if not os.path.exists(p):
+        return None
+    with open(p) as f:
+        meta = json.load(f)
+    return meta if meta.get("format") == CACHE_FORMAT else None
+
+def stale_tables(meta: Optional[dict] = None) -> List[str]:
+    """Tables whose cached copy is missing or no longer matches its CSV."""
+    meta = meta if meta is not None else read_meta()
+    tables = (meta or {}).get("tables", {})
+    stale = []
+    for table, path in csv_paths().items():
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Missing required CSV: {path}")
+        if table not in tables or tables[table]["fingerprint"] != file_fingerprint(path):
+            stale.append(table)
+    return stale
+
+def row_counts() -> Optional[Dict[str, int]]:
+    """Rows per table from the sidecar, or None while the cache is missing or stale."""
+    meta = read_meta()
+    if meta is None or stale_tables(meta):
+        return None
+    return {t: info["rows"] for t, info in meta["tables"].items()}
+
+class _KindChanged(Exception):
+    """A later chunk does not fit the encoding the first chunk chose for a column."""
+
+    def __init__(self, column: str):
+        super().__init__(column)
+        self.column = column
+
+class _ColumnWriter:
+    """Accumulates one column across CSV chunks and writes it with the tightest encoding.
+
+    The first chunk picks the encoding. A later chunk that does not fit it
+    (text in a numeric column, or numbers in a string column, which pandas
+    would have re-spelled) raises ``_KindChanged`` instead of coercing.
+    """
+
+    def __init__(self, name: str, sample):
+        self.name = name
+        if "DATE" in name.upper():
+            self.kind = "datetime"
+        elif sample.dtype.kind in "biuf":
+            self.kind = "numeric"
+        else:
+            self.kind = "category"
+        self.parts: list = []
+        self.categories: Dict[str, int] = {}
+        self.text: List[bytes] = []
+        self.nulls: list = []
+
+    def add(self, values) -> None:
+        import numpy as np
+        import pandas as pd
+        numbers = values.dtype.kind in "biuf"
+        if self.kind == "numeric" and not numbers or self.kind in ("category", "text") and numbers \
+                and values.notna().any():  # an all-empty chunk reads as float and fits any kind
+            raise _KindChanged(self.name)
+        if self.kind == "datetime":
+            self.parts.append(pd.to_datetime(values, errors="coerce").to_numpy(dtype="datetime64[s]"))
+        elif self.kind == "numeric":
+            self.parts.append(pd.to_numeric(values, errors="coerce").to_numpy(dtype=np.float64))
+        else:
+            null = values.isna().to_numpy()
+            strs = values.astype(str).where(~null, "").tolist()
+            self.nulls.append(null)
+            if self.kind == "category":
+                cats = self.categories
+                codes = np.array([-1 if n else cats.setdefault(s, len(cats)) for s, n in zip(strs, null)],
+                                 dtype=np.int64)
+                self.parts.append(codes)
+                if len(cats) > CATEGORY_MAX:
+                    self._to_text()
+            else:
+                self.text.extend(s.encode() for s in strs)
+
+    def _to_text(self) -> None:
+        """Too many distinct values: re-encode what we have as free text."""
+        names = list(self.categories)
+        self.text = [b"" if c < 0 else names[c].encode() for part in self.parts for c in part.tolist()]
+        self.kind, self.parts, self.categories = "text", [], {}
+
+    def write(self, out_dir: str) -> dict:
+        import numpy as np
+        path = os.path.join(out_dir, self.name)
+        info = {"kind": self.kind}
+        if self.kind == "datetime":
+            np.save(path + ".npy", np.concatenate(self.parts) if self.parts else np.zeros(0, "datetime64[s]"))
+        elif self.kind == "numeric":
+            arr = np.concatenate(self.parts) if self.parts else np.zeros(0)
+            arr = _downcast(arr)
+            np.save(path + ".npy", arr)
+        elif self.kind == "category":
+            codes = np.concatenate(self.parts) if self.parts else np.zeros(0, dtype=np.int64)
+            dtype = np.int8 if len(self.categories) < 127 else np.int16
+            np.save(path + ".npy", codes.astype(dtype))
+            info["categories"] = list(self.categories)
+        else:
+            lengths = np.fromiter((len(b) for b in self.text), dtype=np.int64, count=len(self.text))
+            offsets = np.concatenate([[0], np.cumsum(lengths)])
+            np.save(path + ".offsets.npy", offsets)
+            np.save(path + ".npy", np.frombuffer(b"".join(self.text), dtype=np.uint8))
+            null = np.concatenate(self.nulls) if self.nulls else np.zeros(0, dtype=bool)
+            if null.any():
+                np.save(path + ".null.npy", null)
+                info["nulls"] = True
+        info["dtype"] = str(np.load(path + ".npy", mmap_mode="r").dtype)
+        return info
+
+def _downcast(arr):
+    """Smallest integer dtype holding ``arr`` exactly, else float32 when lossless."""
+    import numpy as np
+    finite = arr[~np.isnan(arr)]
+    if len(finite) == len(arr) and np.array_equal(finite, np.round(finite)):
+        lo, hi = (finite.min(), finite.max()) if len(finite) else (0, 0)
+        for dtype in (np.int8, np.int16, np.int32, np.int64):
+            if np.iinfo(dtype).min <= lo and hi <= np.iinfo(dtype).max:
+                return arr.astype(dtype)
+    small = arr.astype(np.float32)
+    return small if np.array_equal(small.astype(np.float64), arr, equal_nan=True) else arr
+
+def convert_csv(path: str, out_dir: str, chunksize: Optional[int] = None) -> dict:
+    """Write every column of ``path`` under ``out_dir``; returns the table's sidecar entry.
+
+    A column whose chunks disagree on numeric vs string (``_KindChanged``) is
+    read again as strings, so no value is coerced to NaN or re-spelled.
+    """
+    import pandas as pd
+    as_text: Dict[str, type] = {}
+    while True:
+        writers: Dict[str, _ColumnWriter] = {}
+        rows = 0
+        try:
+            for chunk in pd.read_csv(path, chunksize=chunksize or CONVERT_CHUNK, dtype=as_text or None):
+                for col in chunk.columns:
+                    if col not in writers:
+                        writers[col] = _ColumnWriter(col, chunk[col])
+                    writers[col].add(chunk[col])
+                rows += len(chunk)
+        except _KindChanged as e:
+            as_text[e.column] = str
+            continue
+        return {"rows": rows, "columns": {col: w.write(out_dir) for col, w in writers.items()}}
+
+def build_data_cache(force: bool = False, tables: Optional[Iterable[str]] = None) -> dict:
+    """Convert stale (or all, with ``force``) CSVs; untouched tables are reused."""
+    meta = (None if force else read_meta()) or {"format": CACHE_FORMAT, "tables": {}}
+    todo = list(tables) if tables is not None else (list(csv_paths()) if force else stale_tables(meta))
+    root = cache_dir()
+    os.makedirs(root, exist_ok=True)
+    for table in todo:
+        src = csv_paths()[table]
+        fingerprint = file_fingerprint(src)
+        tmp, final = os.path.join(root, table + ".tmp"), os.path.join(root, table)
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        info = convert_csv(src, tmp)
+        shutil.rmtree(final, ignore_errors=True)
+        os.replace(tmp, final)
+        meta["tables"][table] = {"fingerprint": fingerprint, **info}
+    tmp_meta = os.path.join(root, "meta.json.tmp")
+    with open(tmp_meta, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp_meta, os.path.join(root, "meta.json"))
+    return meta
+
+def ensure_data_cache() -> dict:
+    """Sidecar of an up-to-date cache, converting stale CSVs first."""
+    meta = read_meta()
+    if meta is None or stale_tables(meta):
+        meta = build_data_cache()
+    return meta
+
+def load_columns(table: str, columns: Optional[Iterable[str]] = None):
+    """DataFrame of ``columns`` (default: all) of ``table`` from the cache.
+
+    Numeric and date columns are memory-mapped, category columns come back
+    as ``pd.Categorical`` and text columns as Python strings.
+    """
+    import numpy as np
+    import pandas as pd
+    info = ensure_data_cache()["tables"][table]
+    d = os.path.join(cache_dir(), table)
+    cols = list(columns) if columns is not None else list(info["columns"])
+    data = {}
+    for col in cols:
+        if col not in info["columns"]:
+            raise KeyError(f"{table} has no column {col!r}")
+        c = info["columns"][col]
+        arr = np.load(os.path.join(d, f"{col}.npy"), mmap_mode="r")
+        if c["kind"] == "category":
+            data[col] = pd.Categorical.from_codes(np.asarray(arr), c["categories"])
+        elif c["kind"] == "text":
+            offsets = np.load(os.path.join(d, f"{col}.offsets.npy")).tolist()
+            raw = arr.tobytes()
+            vals = [raw[a:b].decode() for a, b in zip(offsets[:-1], offsets[1:])]
+            if c.get("nulls"):
+                null = np.load(os.path.join(d, f"{col}.null.npy"))
+                vals = [None if n else v for v, n in zip(vals, null.tolist())]
+            data[col] = vals
+        else:
+            data[col] = arr
+    return pd.DataFrame(data, index=pd.RangeIndex(info["rows"]))
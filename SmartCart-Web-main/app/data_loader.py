@@ -1,22 +1,17 @@
 from __future__ import annotations
-import json, os, pickle
-from collections import Counter, defaultdict
-from typing import Dict, List, Tuple, Iterable, Optional
+import hashlib, io, json, os, pickle
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Optional
+import numpy as np
 import pandas as pd
 
-DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
-ART_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "artifacts")
-
-def ensure_dirs():
-    os.makedirs(ART_DIR, exist_ok=True)
+from paths import ART_DIR, ensure_dirs, csv_paths
+from instrument import stage, capture, absorb
 
 def load_csvs() -> dict:
-    paths = {
-        "order": os.path.join(DATA_DIR, "/home/sanjay/PycharmProjects/SmartCart_Web/data/order_data.csv"),
-        "customer": os.path.join(DATA_DIR, "/home/sanjay/PycharmProjects/SmartCart_Web/data/customer_data.csv"),
-        "store": os.path.join(DATA_DIR, "/home/sanjay/PycharmProjects/SmartCart_Web/data/store_data.csv"),
-        "test": os.path.join(DATA_DIR, "/home/sanjay/PycharmProjects/SmartCart_Web/data/test_data_question.csv"),
-    }
+    paths = csv_paths()
     dfs = {}
     for key, p in paths.items():
         if not os.path.exists(p):
@@ -42,6 +37,117 @@ def extract_item_names(order_str: str) -> list[str]:
 def clean_item_list(item_list: list[str]) -> list[str]:
     return [it for it in item_list if not any(sw in it.lower() for sw in NON_ITEMS)]
 
+# ===== Parse-once extraction =====
+# distinct payload digests an OrderParser remembers across chunks
+PAYLOAD_CACHE = 1_000_000
+
+@dataclass
+class ParsedOrders:
+    """Orders as flat occurrence arrays: item ``item_ids[k]`` is in order ``order_idx[k]``.
+
+    ``items`` maps the integer IDs back to names. Occurrences keep file
+    order (repeats within an order included), so ``order_idx`` is sorted.
+    """
+    items: list[str]
+    order_idx: np.ndarray
+    item_ids: np.ndarray
+    n_orders: int
+
+    def encode(self, item_id: Dict[str, int], distinct: bool = True) -> tuple[np.ndarray, np.ndarray]:
+        """Distinct (order_idx, item_id) pairs under the ``item_id`` vocabulary.
+
+        Each item appears once per order, pairs come back sorted by order
+        then item, and names missing from ``item_id`` are dropped. With
+        ``distinct=False`` every occurrence is kept, in file order.
+        """
+        lut = np.array([item_id.get(it, -1) for it in self.items], dtype=np.int64)
+        ids = lut[self.item_ids]
+        keep = ids >= 0
+        if not distinct:
+            return self.order_idx[keep], ids[keep]
+        n = max(len(item_id), 1)
+        codes = np.unique(self.order_idx[keep] * n + ids[keep])
+        return codes // n, codes % n
+
+    def take(self, rows: np.ndarray) -> "ParsedOrders":
+        """The orders at positions ``rows``, renumbered in file order."""
+        rows = np.unique(np.asarray(rows, dtype=np.int64))
+        keep = np.isin(self.order_idx, rows)
+        return ParsedOrders(self.items, np.searchsorted(rows, self.order_idx[keep]),
+                            self.item_ids[keep], len(rows))
+
+class OrderParser:
+    """Turn raw ``ORDERS`` JSON into ``ParsedOrders``, parsing each distinct payload once.
+
+    Duplicate payloads of a chunk are found with ``pd.factorize``; across
+    chunks a BLAKE2 digest of each payload keys a cache of its item IDs (up
+    to ``PAYLOAD_CACHE`` entries). Names are interned to integer IDs as they
+    are parsed and the ``NON_ITEMS`` test runs once per distinct name. Reuse
+    one parser for all chunks of a file so the caches carry over.
+    """
+
+    def __init__(self, cache_size: int = PAYLOAD_CACHE):
+        self.items: list[str] = []
+        self.cache_size = cache_size
+        self.parsed = self.reused = 0
+        self._name_id: dict = {}  # raw name -> ID, -1 = filtered out
+        self._payloads: Dict[bytes, tuple] = {}
+
+    def _intern(self, name) -> int:
+        i = self._name_id.get(name)
+        if i is None:
+            i = -1 if any(sw in name.lower() for sw in NON_ITEMS) else len(self.items)
+            if i >= 0:
+                self.items.append(name)
+            self._name_id[name] = i
+        return i
+
+    def item_ids(self, payload) -> tuple:
+        """Kept item IDs of one payload, in payload order."""
+        if not isinstance(payload, str):
+            return ()
+        key = hashlib.blake2b(payload.encode(), digest_size=16).digest()
+        ids = self._payloads.get(key)
+        if ids is not None:
+            self.reused += 1
+            return ids
+        ids = tuple(i for i in map(self._intern, extract_item_names(payload)) if i >= 0)
+        self.parsed += 1
+        if len(self._payloads) < self.cache_size:
+            self._payloads[key] = ids
+        return ids
+
+    def parse(self, payloads: Iterable[str]) -> ParsedOrders:
+        """``ParsedOrders`` of a run of payloads (missing ones count as empty orders)."""
+        payloads = payloads if isinstance(payloads, pd.Series) else pd.Series(list(payloads), dtype=object)
+        with stage("parse_json", rows=len(payloads)):
+            codes, uniques = pd.factorize(payloads)
+            rows = [self.item_ids(p) for p in uniques]
+            lens_u = np.array([len(r) for r in rows] + [0], dtype=np.int64)  # last slot: missing payload
+            flat = np.fromiter((i for r in rows for i in r), dtype=np.int64, count=int(lens_u.sum()))
+            codes = np.where(codes < 0, len(rows), codes)
+            lens = lens_u[codes]
+            starts = (np.cumsum(lens_u) - lens_u)[codes]
+            order_idx = np.repeat(np.arange(len(codes), dtype=np.int64), lens)
+            pos = np.repeat(starts - (np.cumsum(lens) - lens), lens) + np.arange(int(lens.sum()))
+            return ParsedOrders(list(self.items), order_idx, flat[pos], len(codes))
+
+def intern_item_lists(lists: Iterable[list[str]]) -> ParsedOrders:
+    """``ParsedOrders`` of already-cleaned item lists."""
+    item_id: dict = {}
+    ids, lens = [], []
+    for row in lists:
+        ids.extend([item_id.setdefault(it, len(item_id)) for it in row])
+        lens.append(len(row))
+    return ParsedOrders(list(item_id), np.repeat(np.arange(len(lens), dtype=np.int64), lens),
+                        np.asarray(ids, dtype=np.int64), len(lens))
+
+def parse_orders(order_df: pd.DataFrame) -> ParsedOrders:
+    """An order frame as ``ParsedOrders``: its ``ITEM_LIST`` if present, else ``ORDERS`` parsed once."""
+    if "ITEM_LIST" in order_df:
+        return intern_item_lists(order_df["ITEM_LIST"])
+    return OrderParser().parse(order_df["ORDERS"])
+
 def tag_item_type(name: str) -> str:
     n = name.lower()
     if any(k in n for k in ["combo","feast","meal","wings","strips","flavor platter","sub","box","lunch","crispy"]):
@@ -73,59 +179,599 @@ def extract_item_features(item_name: str) -> set[str]:
         tags.add("cold_drink")
     return tags
 
-def build_items_and_tags(order_df: pd.DataFrame) -> tuple[dict, dict, dict, list[str]]:
-    order_df = order_df.copy()
-    order_df["ITEM_LIST"] = order_df["ORDERS"].apply(extract_item_names).apply(clean_item_list)
+def build_items_and_tags(orders: pd.DataFrame | ParsedOrders) -> tuple[dict, dict, dict, list[str]]:
+    """Item types, features, top items per type and the sorted vocabulary.
 
-    # all unique items
-    all_items = sorted({it for row in order_df["ITEM_LIST"] for it in row})
-    item_type_dict = {it: tag_item_type(it) for it in all_items}
-    item_feature_dict = {it: extract_item_features(it) for it in all_items}
+    ``orders`` is an order frame (parsed once, see ``parse_orders``) or the
+    ``ParsedOrders`` a caller already holds.
+    """
+    parsed = orders if isinstance(orders, ParsedOrders) else parse_orders(orders)
+    with stage("tagging", rows=parsed.n_orders):
+        freq = np.bincount(parsed.item_ids, minlength=len(parsed.items))
+        present, first = np.unique(parsed.item_ids, return_index=True)
+        all_items = sorted(parsed.items[i] for i in present.tolist())
+        item_type_dict = {it: tag_item_type(it) for it in all_items}
+        item_feature_dict = {it: extract_item_features(it) for it in all_items}
 
-    # frequencies per item & top by type
-    cnt = Counter([it for row in order_df["ITEM_LIST"] for it in row])
+        # frequencies per item (first-seen order) & top by type
+        by_first = present[np.argsort(first, kind="stable")].tolist()
+        top_items_by_type = rank_items_by_type([(parsed.items[i], int(freq[i])) for i in by_first], item_type_dict)
+
+    return item_type_dict, item_feature_dict, top_items_by_type, all_items
+
+def rank_items_by_type(freq: Iterable[tuple[str, int]], item_type_dict: Dict[str, str]) -> dict:
+    """Group (item, count) pairs, given in first-seen order, by type, most frequent first."""
     top_items_by_type = defaultdict(list)
-    for item, c in cnt.items():
+    for item, c in freq:
         t = item_type_dict.get(item, "other")
         if t in ["main","side","dip","drink"]:
             top_items_by_type[t].append((item, c))
     for t in top_items_by_type:
         top_items_by_type[t].sort(key=lambda x: -x[1])
+    return top_items_by_type
 
-    return item_type_dict, item_feature_dict, top_items_by_type, all_items
+# orders per dense block in count_items_and_pairs (block x n_items float64)
+PAIR_BLOCK = 50_000
 
-def build_normalized_comatrix(order_df: pd.DataFrame, sample_n: Optional[int] = None) -> dict:
-    """Build normalized co-occurrence: P(j|i) ~ count(i->j)/count(i)."""
-    if sample_n:
-        order_df = order_df.sample(n=min(sample_n, len(order_df)), random_state=42)
-
-    lists = order_df["ITEM_LIST"]
-    from collections import defaultdict
-    item_count = defaultdict(int)
-    pair_count = defaultdict(lambda: defaultdict(int))
-
-    for items in lists:
-        uniq = list(set(items))
-        for i in uniq:
-            item_count[i] += 1
-        for i in range(len(uniq)):
-            for j in range(len(uniq)):
-                if i == j:
-                    continue
-                a, b = uniq[i], uniq[j]
-                pair_count[a][b] += 1
+def count_items_and_pairs(order_idx: np.ndarray, item_ids: np.ndarray,
+                          n_orders: int, n_items: int,
+                          block: int = PAIR_BLOCK) -> tuple[np.ndarray, np.ndarray]:
+    """Per-item order counts and the (i, j) pair-count matrix (zero diagonal).
+
+    Orders are one-hot encoded ``block`` at a time and pair counts come from
+    ``X.T @ X``; sums of 0/1 values stay exact in float64.
+    """
+    item_count = np.bincount(item_ids, minlength=n_items).astype(np.int64)
+    pair_count = np.zeros((n_items, n_items), dtype=np.int64)
+    for start in range(0, n_orders, block):
+        lo, hi = np.searchsorted(order_idx, [start, start + block])
+        if lo == hi:
+            continue
+        x = np.zeros((min(block, n_orders - start), n_items), dtype=np.float64)
+        x[order_idx[lo:hi] - start, item_ids[lo:hi]] = 1.0
+        pair_count += (x.T @ x).astype(np.int64)
+    np.fill_diagonal(pair_count, 0)
+    return item_count, pair_count
 
+def normalize_pair_counts(items: list[str], item_count: np.ndarray, pair_count: np.ndarray) -> dict:
+    """Turn count tables into the nested ``{i: {j: P(j|i)}}`` dict."""
     norm = defaultdict(dict)
-    for a in pair_count:
-        denom = item_count[a] or 1
-        for b, c in pair_count[a].items():
-            norm[a][b] = c / denom
+    denom = np.maximum(item_count, 1)
+    for a in np.flatnonzero(pair_count.any(axis=1)):
+        cols = np.flatnonzero(pair_count[a])
+        probs = (pair_count[a, cols] / denom[a]).tolist()
+        norm[items[a]] = dict(zip([items[b] for b in cols], probs))
     return norm
 
+def sample_rows(n_orders: int, sample_n: int) -> np.ndarray:
+    """Row positions ``DataFrame.sample(n=sample_n, random_state=42)`` picks from ``n_orders`` rows."""
+    return pd.RangeIndex(n_orders).to_series().sample(n=min(sample_n, n_orders), random_state=42).to_numpy()
+
+def build_normalized_comatrix(orders: pd.DataFrame | ParsedOrders, sample_n: Optional[int] = None) -> dict:
+    """Build normalized co-occurrence: P(j|i) ~ count(i->j)/count(i)."""
+    if isinstance(orders, ParsedOrders):
+        parsed = orders.take(sample_rows(orders.n_orders, sample_n)) if sample_n else orders
+    else:
+        if sample_n:
+            orders = orders.sample(n=min(sample_n, len(orders)), random_state=42)
+        parsed = parse_orders(orders)
+
+    with stage("pair_counting", rows=parsed.n_orders):
+        items = sorted(parsed.items[i] for i in np.unique(parsed.item_ids).tolist())
+        order_idx, item_ids = parsed.encode({it: i for i, it in enumerate(items)})
+        item_count, pair_count = count_items_and_pairs(order_idx, item_ids, parsed.n_orders, len(items))
+    with stage("normalization", rows=len(items)):
+        return normalize_pair_counts(items, item_count, pair_count)
+
+# ===== Streaming ingestion =====
+ORDER_CHUNK = 100_000
+
+@dataclass
+class OrderCounts:
+    """Mergeable item/pair count tables for a contiguous run of orders.
+
+    ``items`` is the sorted vocabulary indexing every array. ``freq`` counts
+    every occurrence (what ``top_by_type`` ranks on), ``item_count`` counts
+    orders containing the item and ``first_seen`` is the item's first
+    occurrence offset, which keeps frequency ties in file order.
+
+    Context builds also fill the ``seg_*`` tables, indexed by the sorted
+    ``segments`` keys (``"occasion=ToGo"``, ``"daypart=weekend"``, ...):
+    orders per segment, segment x item counts and segment x item x item
+    pair counts.
+
+    Pair-context builds also fill ``triple_keys`` / ``triple_counts``: sorted
+    ``(i * n + k) * n + j`` codes (``i < k``, ``j`` a third item of the same
+    order) and the number of orders holding all three. They stay None when
+    not counted.
+
+    ``extras`` holds the side tallies of a ``stream_order_counts`` pass
+    (customer history, store partitions), merged by name.
+    """
+    items: list[str]
+    freq: np.ndarray
+    item_count: np.ndarray
+    pair_count: np.ndarray
+    first_seen: np.ndarray
+    n_orders: int
+    n_occurrences: int
+    segments: list[str] = field(default_factory=list)
+    seg_orders: Optional[np.ndarray] = None
+    seg_item_count: Optional[np.ndarray] = None
+    seg_pair_count: Optional[np.ndarray] = None
+    triple_keys: Optional[np.ndarray] = None
+    triple_counts: Optional[np.ndarray] = None
+    extras: dict = field(default_factory=dict)
+
+    def __post_init__(self):
+        n, S = len(self.items), len(self.segments)
+        if self.seg_orders is None:
+            self.seg_orders = np.zeros(S, dtype=np.int64)
+        if self.seg_item_count is None:
+            self.seg_item_count = np.zeros((S, n), dtype=np.int64)
+        if self.seg_pair_count is None:
+            self.seg_pair_count = np.zeros((S, n, n), dtype=np.int64)
+
+    @classmethod
+    def empty(cls) -> "OrderCounts":
+        z = np.zeros(0, dtype=np.int64)
+        return cls([], z, z.copy(), np.zeros((0, 0), dtype=np.int64), z.copy(), 0, 0)
+
+    def merge(self, later: "OrderCounts") -> "OrderCounts":
+        """Combine with the counts of the orders that directly follow these."""
+        items = sorted(set(self.items) | set(later.items))
+        pos = {it: i for i, it in enumerate(items)}
+        n = len(items)
+        freq = np.zeros(n, dtype=np.int64)
+        item_count = np.zeros(n, dtype=np.int64)
+        pair_count = np.zeros((n, n), dtype=np.int64)
+        first_seen = np.full(n, np.iinfo(np.int64).max, dtype=np.int64)
+        segments = sorted(set(self.segments) | set(later.segments))
+        seg_pos = {sg: i for i, sg in enumerate(segments)}
+        S = len(segments)
+        seg_orders = np.zeros(S, dtype=np.int64)
+        seg_item_count = np.zeros((S, n), dtype=np.int64)
+        seg_pair_count = np.zeros((S, n, n), dtype=np.int64)
+        for part, offset in ((self, 0), (later, self.n_occurrences)):
+            idx = np.array([pos[it] for it in part.items], dtype=np.int64)
+            freq[idx] += part.freq
+            item_count[idx] += part.item_count
+            pair_count[np.ix_(idx, idx)] += part.pair_count
+            first_seen[idx] = np.minimum(first_seen[idx], part.first_seen + offset)
+            sidx = np.array([seg_pos[sg] for sg in part.segments], dtype=np.int64)
+            seg_orders[sidx] += part.seg_orders
+            seg_item_count[np.ix_(sidx, idx)] += part.seg_item_count
+            seg_pair_count[np.ix_(sidx, idx, idx)] += part.seg_pair_count
+        triple_keys = triple_counts = None
+        if self.triple_keys is not None or later.triple_keys is not None:
+            keys, cnts = [], []
+            for part in (self, later):
+                if part.triple_keys is None or not len(part.triple_keys):
+                    continue
+                m = len(part.items)
+                idx = np.array([pos[it] for it in part.items], dtype=np.int64)
+                i, rest = np.divmod(part.triple_keys, m * m)
+                k, j = np.divmod(rest, m)
+                keys.append((idx[i] * n + idx[k]) * n + idx[j])  # idx is monotonic, so i < k holds
+                cnts.append(part.triple_counts)
+            triple_keys, triple_counts = _sum_by_key(keys, cnts)
+        extras = {k: self.extras[k].merge(later.extras[k]) if k in self.extras and k in later.extras
+                  else self.extras.get(k, later.extras.get(k)) for k in {**self.extras, **later.extras}}
+        return OrderCounts(items, freq, item_count, pair_count, first_seen,
+                           self.n_orders + later.n_orders,
+                           self.n_occurrences + later.n_occurrences,
+                           segments, seg_orders, seg_item_count, seg_pair_count,
+                           triple_keys, triple_counts, extras)
+
+def _sum_by_key(keys: list[np.ndarray], counts: list[np.ndarray]) -> tuple[np.ndarray, np.ndarray]:
+    """Sorted unique keys with their summed counts."""
+    if not keys:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    uniq, inv = np.unique(np.concatenate(keys), return_inverse=True)
+    return uniq, np.bincount(inv.reshape(-1), weights=np.concatenate(counts), minlength=len(uniq)).astype(np.int64)
+
+# ===== Context segments =====
+# segment dimension -> source column; daypart is weekday/weekend of the order date
+SEGMENT_DIMS = {"occasion": "ORDER_OCCASION_NAME", "channel": "ORDER_CHANNEL_NAME",
+                "daypart": "ORDER_CREATED_DATE"}
+# pseudo-orders of the global P(j|i) blended into every segment row
+SEGMENT_PRIOR = 50.0
+# segments with fewer orders are dropped and served by the global matrix
+SEGMENT_MIN_ORDERS = 1_000
+
+def daypart(dates) -> pd.Series:
+    d = pd.to_datetime(pd.Series(dates), errors="coerce")
+    return pd.Series(np.where(d.dt.dayofweek >= 5, "weekend", "weekday"), index=d.index).where(d.notna())
+
+def order_segments(df: pd.DataFrame) -> list[list[str]]:
+    """Segment keys (one per available dimension) for every order row."""
+    cols = []
+    for dim, col in SEGMENT_DIMS.items():
+        if col not in df:
+            continue
+        vals = daypart(df[col]) if dim == "daypart" else df[col]
+        cols.append([f"{dim}={v}" if isinstance(v, str) and v else None for v in vals.tolist()])
+    return [[k for k in keys if k] for keys in zip(*cols)] if cols else [[] for _ in range(len(df))]
+
+def _pairs_within_orders(order_idx: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Entry-index pairs (a, b), a != b, of every two entries sharing an order."""
+    if not len(order_idx):
+        z = np.zeros(0, dtype=np.int64)
+        return z, z
+    starts = np.flatnonzero(np.r_[True, order_idx[1:] != order_idx[:-1]])
+    m = np.diff(np.r_[starts, len(order_idx)])
+    m_e = np.repeat(m, m)
+    left = np.repeat(np.arange(len(order_idx)), m_e)
+    block_start = np.repeat(np.cumsum(m_e) - m_e, m_e)
+    right = np.repeat(np.repeat(starts, m), m_e) + (np.arange(len(left)) - block_start)
+    keep = left != right
+    return left[keep], right[keep]
+
+def count_triples(order_idx: np.ndarray, item_ids: np.ndarray, n_items: int,
+                  block: int = PAIR_BLOCK) -> tuple[np.ndarray, np.ndarray]:
+    """Sparse (i, k) -> j order counts for every item pair and third item of an order.
+
+    Each within-order pair with ``item[i] < item[k]`` is expanded across the
+    order's other entries; codes of a block of orders are reduced with
+    ``np.unique``. Orders need at least three distinct items to contribute.
+    """
+    n = n_items
+    keys, counts = [], []
+    n_orders = int(order_idx[-1]) + 1 if len(order_idx) else 0
+    for start in range(0, n_orders, block):
+        lo, hi = np.searchsorted(order_idx, [start, start + block])
+        o, it = order_idx[lo:hi], item_ids[lo:hi]
+        left, right = _pairs_within_orders(o)
+        keep = it[left] < it[right]
+        left, right = left[keep], right[keep]
+        if not len(left):
+            continue
+        starts = np.flatnonzero(np.r_[True, o[1:] != o[:-1]])
+        sizes = np.diff(np.r_[starts, len(o)])
+        entry_start = np.repeat(starts, sizes)
+        entry_size = np.repeat(sizes, sizes)
+        m = entry_size[left]
+        rep_idx = np.repeat(np.arange(len(left)), m)
+        within = np.arange(len(rep_idx)) - np.repeat(np.cumsum(m) - m, m)
+        third = entry_start[left][rep_idx] + within
+        ok = (third != left[rep_idx]) & (third != right[rep_idx])
+        code = (it[left][rep_idx][ok] * n + it[right][rep_idx][ok]) * n + it[third[ok]]
+        uniq, cnt = np.unique(code, return_counts=True)
+        keys.append(uniq)
+        counts.append(cnt)
+    return _sum_by_key(keys, counts)
+
+def count_partition_pairs(order_idx: np.ndarray, item_ids: np.ndarray, order_part: np.ndarray,
+                          n_items: int, block: int = PAIR_BLOCK) -> tuple[np.ndarray, np.ndarray]:
+    """Sparse ``(p * n + i) * n + j`` order counts of item pairs per partition.
+
+    ``order_part`` holds one partition index per order (-1 = none). Like
+    ``pair_count`` both (i, j) and (j, i) are counted and the diagonal is
+    left out; unlike the segment tables nothing is P x n x n dense, so
+    thousands of partitions stay cheap.
+    """
+    n = n_items
+    keys, counts = [], []
+    for start in range(0, len(order_part), block):
+        lo, hi = np.searchsorted(order_idx, [start, start + block])
+        o, it = order_idx[lo:hi], item_ids[lo:hi]
+        left, right = _pairs_within_orders(o)
+        p = order_part[o[left]]
+        ok = p >= 0
+        uniq, cnt = np.unique((p[ok] * n + it[left][ok]) * n + it[right][ok], return_counts=True)
+        keys.append(uniq)
+        counts.append(cnt)
+    return _sum_by_key(keys, counts)
+
+def count_segment_pairs(order_idx: np.ndarray, item_ids: np.ndarray, order_seg: np.ndarray,
+                        n_segments: int, n_items: int,
+                        block: int = PAIR_BLOCK) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Orders, item counts and pair counts per segment via grouped bincounts.
+
+    ``order_seg`` is n_orders x n_dims of segment indices (-1 = none). Every
+    pair is expanded once per dimension into a (segment, i, j) code and all
+    codes of a block of orders go through one ``np.bincount``.
+    """
+    S, n = n_segments, n_items
+    seg_orders = np.bincount(order_seg[order_seg >= 0], minlength=S).astype(np.int64)
+    seg_item_count = np.zeros(S * n, dtype=np.int64)
+    seg_pair_count = np.zeros(S * n * n, dtype=np.int64)
+    n_orders = len(order_seg)
+    for start in range(0, n_orders, block):
+        lo, hi = np.searchsorted(order_idx, [start, start + block])
+        o, it = order_idx[lo:hi], item_ids[lo:hi]
+        left, right = _pairs_within_orders(o)
+        item_codes, pair_codes = [], []
+        for d in range(order_seg.shape[1]):
+            s_e = order_seg[o, d]
+            ok = s_e >= 0
+            item_codes.append(s_e[ok] * n + it[ok])
+            s_p = s_e[left]
+            okp = s_p >= 0
+            pair_codes.append((s_p[okp] * n + it[left][okp]) * n + it[right][okp])
+        if item_codes:
+            seg_item_count += np.bincount(np.concatenate(item_codes), minlength=S * n)
+            seg_pair_count += np.bincount(np.concatenate(pair_codes), minlength=S * n * n)
+    return seg_orders, seg_item_count.reshape(S, n), seg_pair_count.reshape(S, n, n)
+
+def segment_comatrix(counts: OrderCounts, prior: float = SEGMENT_PRIOR,
+                     min_orders: int = SEGMENT_MIN_ORDERS) -> tuple[list[str], np.ndarray]:
+    """Per-segment P(j|i) shrunk toward the global matrix.
+
+    ``(seg_pair + prior * P_global) / (seg_item + prior)``: rows an item has
+    few orders for in a segment stay close to the global row. Segments below
+    ``min_orders`` are left out.
+    """
+    keep = np.flatnonzero(counts.seg_orders >= min_orders)
+    glob = counts.pair_count / np.maximum(counts.item_count, 1)[:, None]
+    seg = (counts.seg_pair_count[keep] + prior * glob[None]) / (counts.seg_item_count[keep][:, :, None] + prior)
+    return [counts.segments[s] for s in keep], seg
+
+def count_parsed(parsed: ParsedOrders, order_segs: Optional[list[list[str]]] = None,
+                 pair_context: bool = False) -> OrderCounts:
+    """Count items and co-occurring pairs of ``ParsedOrders``.
+
+    ``order_segs`` (segment keys per order, see ``order_segments``) also
+    fills the per-segment tables; ``pair_context`` also counts (i, k) -> j
+    triples.
+    """
+    n_orders = parsed.n_orders
+    with stage("pair_counting", rows=n_orders):
+        present = np.unique(parsed.item_ids)
+        items = sorted(parsed.items[i] for i in present.tolist())
+        item_id = {it: i for i, it in enumerate(items)}
+        lut = np.full(len(parsed.items), -1, dtype=np.int64)
+        lut[present] = [item_id[parsed.items[i]] for i in present.tolist()]
+        occ = lut[parsed.item_ids]
+        freq = np.bincount(occ, minlength=len(items)).astype(np.int64)
+        first_seen = np.zeros(len(items), dtype=np.int64)
+        seen, first = np.unique(occ, return_index=True)
+        first_seen[seen] = first
+        order_idx, item_ids = parsed.encode(item_id)
+        item_count, pair_count = count_items_and_pairs(order_idx, item_ids, n_orders, len(items))
+        counts = OrderCounts(items, freq, item_count, pair_count, first_seen, n_orders, len(occ))
+    if order_segs is not None:
+        with stage("segment_counting", rows=n_orders):
+            segments = sorted({sg for keys in order_segs for sg in keys})
+            seg_pos = {sg: i for i, sg in enumerate(segments)}
+            width = max((len(keys) for keys in order_segs), default=0)
+            order_seg = np.full((n_orders, width), -1, dtype=np.int64)
+            for r, keys in enumerate(order_segs):
+                order_seg[r, :len(keys)] = [seg_pos[sg] for sg in keys]
+            counts.segments = segments
+            counts.seg_orders, counts.seg_item_count, counts.seg_pair_count = count_segment_pairs(
+                order_idx, item_ids, order_seg, len(segments), len(items))
+    if pair_context:
+        with stage("triple_counting", rows=n_orders):
+            counts.triple_keys, counts.triple_counts = count_triples(order_idx, item_ids, len(items))
+    return counts
+
+def count_item_lists(lists: Iterable[list[str]], order_segs: Optional[list[list[str]]] = None,
+                     pair_context: bool = False) -> OrderCounts:
+    """``count_parsed`` over already-cleaned item lists."""
+    return count_parsed(intern_item_lists(lists), order_segs, pair_context)
+
+def count_order_payloads(payloads: list[str], parser: Optional[OrderParser] = None) -> OrderCounts:
+    """Parse raw ``ORDERS`` JSON strings and count them."""
+    return count_parsed((parser or OrderParser()).parse(payloads))
+
+def count_order_chunk(chunk: pd.DataFrame, pair_context: bool = False,
+                      parser: Optional[OrderParser] = None, tallies: Optional[dict] = None) -> OrderCounts:
+    """Count one chunk of the order CSV (process-pool worker).
+
+    Segment tables are filled when the chunk carries any ``SEGMENT_DIMS``
+    column. Each of ``tallies`` counts the chunk from the same parse into
+    ``extras``. Pass the same ``parser`` for every chunk of a file.
+    """
+    parsed = (parser or OrderParser()).parse(chunk["ORDERS"])
+    has_context = any(col in chunk for col in SEGMENT_DIMS.values())
+    counts = count_parsed(parsed, order_segments(chunk) if has_context else None, pair_context)
+    counts.extras = {k: t.count(chunk, parsed) for k, t in (tallies or {}).items()}
+    return counts
+
+def iter_order_chunks(path, chunksize: int = ORDER_CHUNK,
+                      columns: Iterable[str] = ("ORDERS",)) -> Iterable[pd.DataFrame]:
+    """Yield ``columns`` of ``path`` (a path or binary buffer; those present) in chunks of at most ``chunksize`` rows."""
+    header = pd.read_csv(path, nrows=0).columns
+    if hasattr(path, "seek"):
+        path.seek(0)
+    usecols = [c for c in columns if c in header]
+    reader = pd.read_csv(path, usecols=usecols, dtype=str, chunksize=chunksize)
+    while True:
+        with stage("read_csv") as rec:
+            chunk = next(reader, None)
+            rec["rows"] = 0 if chunk is None else len(chunk)
+        if chunk is None:
+            return
+        yield chunk
+
+# ===== Map-reduce build =====
+# target bytes of order CSV per map task
+SHARD_BYTES = 64 << 20
+# minimum map tasks per worker, so progress (absorbed per finished shard) advances in steps
+SHARDS_PER_WORKER = 4
+# bytes scanned per step while placing shard boundaries
+SCAN_BLOCK = 16 << 20
+
+def shard_offsets(path: str, n_shards: int) -> list[tuple[int, int]]:
+    """Split the rows of ``path`` into about ``n_shards`` byte ranges.
+
+    Every range starts and ends on a record boundary: a newline ends a CSV
+    record only after an even number of ``"`` (escaped quotes come in
+    pairs), so quote parity is tracked while scanning for each cut.
+    """
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        f.readline()
+        data_start = f.tell()
+        targets = [data_start + k * (size - data_start) // n_shards for k in range(1, n_shards)]
+        cuts, quotes, pos = [], 0, data_start
+        f.seek(pos)
+        while targets:
+            blk = np.frombuffer(f.read(SCAN_BLOCK), dtype=np.uint8)
+            if not len(blk):
+                break
+            parity = (quotes + np.cumsum(blk == ord('"'))) % 2
+            newlines = np.flatnonzero((blk == ord("\n")) & (parity == 0))
+            while targets and targets[0] < pos + len(blk):
+                later = newlines[newlines >= targets[0] - pos]
+                if not len(later):
+                    targets[0] = pos + len(blk)  # boundary is in a later block
+                    break
+                cut = pos + int(later[0]) + 1
+                cuts.append(cut)
+                targets = [max(t, cut) for t in targets[1:]]
+            quotes += int(np.count_nonzero(blk == ord('"')))
+            pos += len(blk)
+    bounds = [data_start] + sorted(set(cuts)) + [size]
+    return [(a, b) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+
+def count_order_shard(path: str, start: int, end: int, columns: Iterable[str],
+                      chunksize: int = ORDER_CHUNK, pair_context: bool = False,
+                      tallies: Optional[dict] = None) -> OrderCounts:
+    """Map task: count the rows in bytes ``[start, end)`` of ``path``."""
+    with open(path, "rb") as f:
+        header = f.readline()
+        f.seek(start)
+        data = f.read(end - start)
+    total, parser = OrderCounts.empty(), OrderParser()
+    for chunk in iter_order_chunks(io.BytesIO(header + data), chunksize, columns):
+        total = total.merge(count_order_chunk(chunk, pair_context, parser, tallies))
+    return total
+
+def _count_order_shard_timed(path: str, start: int, end: int, columns: Iterable[str],
+                             chunksize: int, pair_context: bool,
+                             tallies: Optional[dict]) -> tuple[OrderCounts, list[dict]]:
+    """``count_order_shard`` plus the worker's stage records for the parent."""
+    with capture() as recs:
+        counts = count_order_shard(path, start, end, columns, chunksize, pair_context, tallies)
+    return counts, recs
+
+def _merge_pair(pair: tuple[OrderCounts, OrderCounts]) -> OrderCounts:
+    return pair[0].merge(pair[1])
+
+def tree_merge(parts: list[OrderCounts], pool: Optional[ProcessPoolExecutor] = None) -> OrderCounts:
+    """Reduce partial counts pairwise, level by level, keeping row order.
+
+    ``merge`` is associative, so the result equals the serial left fold.
+    With a ``pool`` the merges of one level run in parallel.
+    """
+    parts = list(parts) or [OrderCounts.empty()]
+    while len(parts) > 1:
+        pairs = list(zip(parts[0::2], parts[1::2]))
+        if pool is not None and len(pairs) > 1:
+            merged = list(pool.map(_merge_pair, pairs))
+        else:
+            merged = [a.merge(b) for a, b in pairs]
+        parts = merged + parts[len(pairs) * 2:]
+    return parts[0]
+
+def stream_order_counts(path: Optional[str] = None,
+                        chunksize: int = ORDER_CHUNK,
+                        workers: Optional[int] = None,
+                        segments: bool = False,
+                        pair_context: bool = False,
+                        tallies: Optional[dict] = None) -> OrderCounts:
+    """Count items and pairs of an order CSV without loading it whole.
+
+    ``workers=1`` reads the file chunk by chunk in-process. Otherwise
+    (default: every core) the file is cut into row-aligned byte ranges of
+    about ``SHARD_BYTES`` (at least ``SHARDS_PER_WORKER`` per worker), each
+    worker reads and counts its own range, and the partials are combined
+    with ``tree_merge``; the result is identical to the serial pass. A
+    shard's stage records are absorbed as soon as it finishes, so a
+    ``listen``-er (the build job's progress) sees the count advance. With ``segments`` the same pass also counts the
+    context segment tables, with ``pair_context`` the (i, k) -> j triples.
+
+    ``tallies`` maps names to side counters fed from the same parse of each
+    chunk: a tally has ``columns`` to read, ``count(chunk, parsed)``
+    returning that chunk's partial and ``merge(later)`` on partials. The
+    merged partials end up in ``counts.extras`` under the same names.
+    """
+    path = path or csv_paths()["order"]
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Missing required CSV: {path}")
+    columns = ["ORDERS"] + (list(SEGMENT_DIMS.values()) if segments else [])
+    columns += [c for t in (tallies or {}).values() for c in t.columns if c not in columns]
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        total, parser = OrderCounts.empty(), OrderParser()
+        for chunk in iter_order_chunks(path, chunksize, columns):
+            total = total.merge(count_order_chunk(chunk, pair_context, parser, tallies))
+        return total
+
+    n_shards = max(workers * SHARDS_PER_WORKER, -(-os.path.getsize(path) // SHARD_BYTES))
+    ranges = shard_offsets(path, n_shards)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        try:
+            futures = {pool.submit(_count_order_shard_timed, path, a, b, columns, chunksize, pair_context,
+                                   tallies): k for k, (a, b) in enumerate(ranges)}
+            parts: list[Optional[OrderCounts]] = [None] * len(ranges)
+            for fut in as_completed(futures):
+                counts, recs = fut.result()
+                parts[futures[fut]] = counts  # merged in file order below
+                absorb(recs)
+            with stage("merge", rows=len(parts)):
+                return tree_merge(parts, pool)
+        except BaseException:
+            pool.shutdown(cancel_futures=True)  # e.g. a cancelled build: drop shards not started yet
+            raise
+
+def items_and_tags_from_counts(counts: OrderCounts) -> tuple[dict, dict, dict, list[str]]:
+    """Same outputs as ``build_items_and_tags``, from streamed counts."""
+    with stage("tagging", rows=len(counts.items)):
+        all_items = list(counts.items)
+        item_type_dict = {it: tag_item_type(it) for it in all_items}
+        item_feature_dict = {it: extract_item_features(it) for it in all_items}
+        order = np.argsort(counts.first_seen, kind="stable")
+        freq = [(all_items[i], int(counts.freq[i])) for i in order]
+        return item_type_dict, item_feature_dict, rank_items_by_type(freq, item_type_dict), all_items
+
+# ===== Pair-context index =====
+# orders a pair must appear in to get its own (i, k) -> j row
+PAIR_MIN_SUPPORT = 50
+# targets kept per pair row
+PAIR_TOP_K = 20
+
+def pair_context_index(counts: OrderCounts, min_support: int = PAIR_MIN_SUPPORT,
+                       top_k: int = PAIR_TOP_K) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Top-K P(j | i, k) targets for every pair seen in ``min_support`` orders.
+
+    Returns CSR arrays: ``pairs`` (R x 2 item IDs, ``i < k``, sorted),
+    ``offsets`` (R + 1), ``targets`` (item IDs, ascending within a row) and
+    ``probs``. Within a row the kept targets are the ``top_k`` most likely,
+    ties broken by item ID.
+    """
+    n = len(counts.items)
+    keys = counts.triple_keys if counts.triple_keys is not None else np.zeros(0, dtype=np.int64)
+    pair_code, j = np.divmod(keys, n)
+    i, k = np.divmod(pair_code, n)
+    support = counts.pair_count[i, k]
+    keep = support >= min_support
+    pair_code, j, prob = pair_code[keep], j[keep], counts.triple_counts[keep] / support[keep]
+    # rank within each pair: probability desc, then item ID; keys are sorted by pair then j
+    order = np.lexsort((j, -prob, pair_code))
+    pair_code, j, prob = pair_code[order], j[order], prob[order]
+    starts = np.flatnonzero(np.r_[True, pair_code[1:] != pair_code[:-1]]) if len(pair_code) else np.zeros(0, dtype=np.int64)
+    rank = np.arange(len(pair_code)) - np.repeat(starts, np.diff(np.r_[starts, len(pair_code)]))
+    top = rank < top_k
+    pair_code, j, prob = pair_code[top], j[top], prob[top]
+    order = np.lexsort((j, pair_code))  # back to ascending target IDs per row
+    pair_code, j, prob = pair_code[order], j[order], prob[order]
+    uniq, row_len = np.unique(pair_code, return_counts=True)
+    pairs = np.stack(np.divmod(uniq, n), axis=1) if len(uniq) else np.zeros((0, 2), dtype=np.int64)
+    offsets = np.concatenate([[0], np.cumsum(row_len)]).astype(np.int64)
+    return pairs, offsets, j, prob
+
+def comatrix_from_counts(counts: OrderCounts) -> dict:
+    """Same output as ``build_normalized_comatrix``, from streamed counts."""
+    with stage("normalization", rows=len(counts.items)):
+        return normalize_pair_counts(counts.items, counts.item_count, counts.pair_count)
+
 def save_artifact(name: str, obj):
     ensure_dirs()
     p = os.path.join(ART_DIR, name)
-    with open(p, "wb") as f:
+    with stage("pickle"), open(p, "wb") as f:
         pickle.dump(obj, f)
     return p
 
@@ -0,0 +1,188 @@
+"""Offline Recall@K / Precision@K / coverage on a time-based holdout.
+
+    python app/evaluate.py --holdout-frac 0.1 --boost 1.0 1.2 1.5 --max-per-type 1 2 --json eval.json
+
+The order CSV is parsed once by ``OrderParser`` into flat ``ParsedOrders``
+arrays. Train orders build the co-occurrence model; every holdout order
+with at least two known items becomes a cart of up to three visible items,
+and the rest of the order is hidden. ``enhanced_recommend`` (through
+``SmartCartModel.recommend_batch``, identical output) and a popularity
+baseline are scored on the hidden items. Holdout shards run in a process
+pool whose workers memory-map one float32 file of the P(j|i) matrix (the
+artifact's precision). Orders without a parseable date are left out of
+both sides and counted in the report.
+"""
+from __future__ import annotations
+import argparse, itertools, json, os, tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+
+from data_loader import (
+    csv_paths, count_parsed, items_and_tags_from_counts, iter_order_chunks, OrderParser, ParsedOrders,
+    ORDER_CHUNK
+)
+from recommender import DEFAULT_BLACKLIST, SmartCartModel
+
+MAX_VISIBLE = 3
+# holdout carts per pool task
+SHARD_SIZE = 50_000
+
+def load_orders(path: Optional[str] = None, chunksize: int = ORDER_CHUNK) -> Tuple[pd.Series, ParsedOrders]:
+    """``ORDER_CREATED_DATE`` per order and the orders as one ``ParsedOrders``.
+
+    One parser reads every chunk, so item IDs are shared across chunks and
+    each distinct payload is parsed once.
+    """
+    path = path or csv_paths()["order"]
+    parser = OrderParser()
+    dates, order_idx, item_ids, n = [], [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)], 0
+    for chunk in iter_order_chunks(path, chunksize, ("ORDER_CREATED_DATE", "ORDERS")):
+        parsed = parser.parse(chunk["ORDERS"])
+        dates.append(chunk["ORDER_CREATED_DATE"] if "ORDER_CREATED_DATE" in chunk
+                     else pd.Series(np.nan, index=chunk.index, dtype=object))
+        order_idx.append(parsed.order_idx + n)
+        item_ids.append(parsed.item_ids)
+        n += parsed.n_orders
+    dates = pd.concat(dates, ignore_index=True) if dates else pd.Series([], dtype=object)
+    return dates, ParsedOrders(list(parser.items), np.concatenate(order_idx), np.concatenate(item_ids), n)
+
+def time_split(dates: pd.Series, holdout_frac: float = 0.1,
+               split_date: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray, int]:
+    """Row positions of the orders before the split date (train) and of the rest (holdout).
+
+    Orders whose date does not parse belong to neither side; the third
+    value counts them.
+    """
+    dates = pd.to_datetime(dates, errors="coerce")
+    if split_date is None:
+        split = dates.quantile(1 - holdout_frac)
+    else:
+        split = pd.Timestamp(split_date)
+    dated = dates.notna().to_numpy()
+    before = (dates < split).to_numpy()
+    return np.flatnonzero(dated & before), np.flatnonzero(dated & ~before), int((~dated).sum())
+
+def make_holdout_carts(parsed: ParsedOrders, item_id: Dict[str, int],
+                       max_visible: int = MAX_VISIBLE, seed: int = 42) -> Tuple[np.ndarray, np.ndarray]:
+    """Visible-cart code matrix (carts x max_visible, -1 padded) and hidden-item mask.
+
+    Each order's distinct known items are shuffled (one random key per
+    item); the first ``min(max_visible, items - 1)`` are visible.
+    """
+    rng = np.random.default_rng(seed)
+    o, ids = parsed.encode(item_id)
+    shuffle = np.lexsort((rng.random(len(o)), o))  # random order within each order
+    o, ids = o[shuffle], ids[shuffle]
+    size = np.bincount(o, minlength=parsed.n_orders)
+    carted = size >= 2
+    cart_of = np.cumsum(carted) - 1
+    rank = np.arange(len(o)) - np.repeat(np.cumsum(size) - size, size)
+    keep = carted[o]
+    o, ids, rank = o[keep], ids[keep], rank[keep]
+    vis = rank < np.minimum(max_visible, size[o] - 1)
+    codes = np.full((int(carted.sum()), max_visible), SmartCartModel.EMPTY, dtype=np.int64)
+    codes[cart_of[o[vis]], rank[vis]] = ids[vis]
+    hidden = np.zeros((len(codes), len(item_id)), dtype=bool)
+    hidden[cart_of[o[~vis]], ids[~vis]] = True
+    return codes, hidden
+
+def _score(rec: np.ndarray, hidden: np.ndarray, k: int) -> dict:
+    """Summed recall/precision and the set of recommended IDs for one result matrix."""
+    rows = np.arange(len(rec))[:, None]
+    valid = rec >= 0
+    hits = (hidden[rows, np.where(valid, rec, 0)] & valid).sum(axis=1)
+    return {"recall_sum": float((hits / hidden.sum(axis=1)).sum()), "precision_sum": float((hits / k).sum()),
+            "recommended": np.unique(rec[valid]).tolist()}
+
+def popularity_baseline(codes: np.ndarray, popular: np.ndarray, n_items: int, k: int) -> np.ndarray:
+    """Top-k most frequent training items not already in each cart."""
+    in_cart = np.zeros((len(codes), n_items + 1), dtype=bool)
+    in_cart[np.arange(len(codes))[:, None], np.where(codes >= 0, codes, n_items)] = True
+    free = ~in_cart[:, popular]
+    pos = np.cumsum(free, axis=1)
+    rec = np.full((len(codes), k), -1, dtype=np.int64)
+    r, c = np.nonzero(free & (pos <= k))
+    rec[r, pos[r, c] - 1] = popular[c]
+    return rec
+
+_MODEL: Optional[SmartCartModel] = None
+
+def _init_worker(co_path: str, spec: dict) -> None:
+    """Pool initializer: every worker maps the same read-only P(j|i) file."""
+    global _MODEL
+    _MODEL = SmartCartModel(spec["items"], np.load(co_path, mmap_mode="r"), spec["item_type"],
+                            spec["item_tags"], spec["top_by_type"])
+
+def _eval_shard(args) -> dict:
+    codes, hidden, grid, k, popular = args
+    out = {"n": len(codes), "popularity": _score(popularity_baseline(codes, popular, len(_MODEL.items), k), hidden, k)}
+    for boost, mpt in grid:
+        rec, _ = _MODEL.recommend_batch(codes, DEFAULT_BLACKLIST, top_n=k, boost_factor=boost, max_per_type=mpt)
+        out[(boost, mpt)] = _score(rec, hidden, k)
+    return out
+
+def evaluate(dates: pd.Series, parsed: ParsedOrders, boost_factors: Iterable[float] = (1.2,),
+             max_per_types: Iterable[int] = (1,), k: int = 3, holdout_frac: float = 0.1,
+             split_date: Optional[str] = None, workers: Optional[int] = None, seed: int = 42) -> dict:
+    """Train/holdout evaluation over a ``boost_factor`` x ``max_per_type`` grid (see ``load_orders``)."""
+    train, holdout, undated = time_split(dates, holdout_frac, split_date)
+    counts = count_parsed(parsed.take(train))
+    item_type, item_feat, top_by_type, items = items_and_tags_from_counts(counts)
+    item_id = {it: i for i, it in enumerate(items)}
+    co = (counts.pair_count / np.maximum(counts.item_count, 1)[:, None]).astype(np.float32)
+    popular = np.argsort(-counts.freq, kind="stable")
+
+    codes, hidden = make_holdout_carts(parsed.take(holdout), item_id, seed=seed)
+    grid = list(itertools.product(boost_factors, max_per_types))
+    spec = {"items": items, "item_type": item_type, "item_tags": item_feat, "top_by_type": top_by_type}
+    shards = [(codes[s:s + SHARD_SIZE], hidden[s:s + SHARD_SIZE], grid, k, popular)
+              for s in range(0, len(codes), SHARD_SIZE)]
+
+    with tempfile.TemporaryDirectory(prefix="smartcart-eval-") as tmp:
+        co_path = os.path.join(tmp, "co.npy")
+        np.save(co_path, co)
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count(),
+                                 initializer=_init_worker, initargs=(co_path, spec)) as pool:
+            parts = list(pool.map(_eval_shard, shards))
+
+    n = sum(p["n"] for p in parts) or 1
+    def summarize(key) -> dict:
+        rec_items = set().union(*[p[key]["recommended"] for p in parts]) if parts else set()
+        return {f"recall@{k}": round(sum(p[key]["recall_sum"] for p in parts) / n, 4),
+                f"precision@{k}": round(sum(p[key]["precision_sum"] for p in parts) / n, 4),
+                "coverage": round(len(rec_items) / max(len(items), 1), 4)}
+
+    baseline = summarize("popularity")
+    results = []
+    for boost, mpt in grid:
+        res = {"boost_factor": boost, "max_per_type": mpt, **summarize((boost, mpt))}
+        base = baseline[f"recall@{k}"]
+        res["recall_lift"] = round(res[f"recall@{k}"] / base, 3) if base else None
+        results.append(res)
+    return {"train_orders": len(train), "holdout_orders": len(holdout), "undated_orders": undated,
+            "evaluated_carts": int(sum(p["n"] for p in parts)),
+            "items": len(items), "popularity": baseline, "grid": results}
+
+def main(argv=None) -> None:
+    ap = argparse.ArgumentParser(description="Offline Recall@K / Precision@K evaluation")
+    ap.add_argument("--orders", help="order_data.csv (default: data/order_data.csv)")
+    ap.add_argument("--k", type=int, default=3)
+    ap.add_argument("--holdout-frac", type=float, default=0.1, help="latest share of orders held out")
+    ap.add_argument("--split-date", help="hold out orders on/after this date instead")
+    ap.add_argument("--boost", type=float, nargs="+", default=[1.2])
+    ap.add_argument("--max-per-type", type=int, nargs="+", default=[1])
+    ap.add_argument("--workers", type=int, default=0)
+    ap.add_argument("--json", help="write results here")
+    args = ap.parse_args(argv)
+    dates, parsed = load_orders(args.orders)
+    report = evaluate(dates, parsed, args.boost, args.max_per_type, k=args.k, holdout_frac=args.holdout_frac,
+                      split_date=args.split_date, workers=args.workers or None)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+"""Stage timings and online latency histograms (stdlib only).
+
+    with stage("parse_json") as rec:
+        lists = [...]
+        rec["rows"] = len(lists)
+
+    @timed("normalize_user_items")
+    def normalize_user_items(...): ...
+
+``stage`` records wall time, rows, the RSS at its end and its own RSS
+high-water mark ``peak_rss_mb``: while any stage is open a background
+thread samples RSS every ``RSS_SAMPLE_S`` into every open stage, so nested
+and concurrent stages each get their own peak (spikes shorter than the
+interval can be missed). When tracemalloc is tracing
+(``SMARTCART_TRACEMALLOC=1`` or ``enable_tracemalloc()``) the Python
+allocation peak is recorded too; nested stages share tracemalloc's single
+peak counter, so only the innermost stage's ``py_peak_mb`` is exact. ``timed`` keeps the last
+``LATENCY_WINDOW`` call latencies per name. ``snapshot`` / ``export_json``
+return everything as JSON; process-pool workers hand their records back
+through ``capture`` / ``absorb``. ``listen`` hands every record made on the
+current thread to a callback (build progress and cancellation).
+"""
+from __future__ import annotations
+import bisect, functools, json, os, threading, time, tracemalloc
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Deque, Dict, Iterator, List, Optional
+
+try:
+    import resource
+except ImportError:  # not on Windows
+    resource = None
+
+# stage records kept in memory
+STAGE_HISTORY = 2_000
+# most recent latencies kept per timed function
+LATENCY_WINDOW = 10_000
+# histogram bucket upper bounds in microseconds: 1-2-5 steps from 1 us to 10 s
+BUCKETS_US = [m * 10 ** e for e in range(0, 7) for m in (1, 2, 5)] + [10_000_000]
+METRICS_FILE = "metrics.json"
+# seconds between RSS samples while a stage is open
+RSS_SAMPLE_S = 0.005
+
+_lock = threading.Lock()
+_stages: Deque[dict] = deque(maxlen=STAGE_HISTORY)
+_latencies: Dict[str, Deque[float]] = {}
+_captures: List[List[dict]] = []
+_local = threading.local()
+_open: List[dict] = []  # records of the stages open right now, in any thread
+_sampler: Optional[threading.Thread] = None
+
+if os.environ.get("SMARTCART_TRACEMALLOC") == "1":
+    tracemalloc.start()
+
+def enable_tracemalloc() -> None:
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+def rss_mb() -> Optional[float]:
+    """Current resident set size (Linux ``/proc``), else None."""
+    try:
+        with open("/proc/self/statm") as f:
+            return round(int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20, 1)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def peak_rss_mb() -> Optional[float]:
+    """Peak RSS of this process so far (Linux reports KiB)."""
+    if resource is None:
+        return None
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+def _sample_rss() -> None:
+    """Sampler thread: raise ``peak_rss_mb`` of every open stage; exits once none is open."""
+    global _sampler
+    while True:
+        rss = rss_mb()
+        with _lock:
+            if not _open:
+                _sampler = None
+                return
+            for rec in _open if rss is not None else ():
+                rec["peak_rss_mb"] = max(rec["peak_rss_mb"], rss)
+        time.sleep(RSS_SAMPLE_S)
+
+def _after_fork() -> None:
+    """Reset a forked worker: no sampler thread survived the fork.
+
+    The forking thread's listener belongs to the parent, which gets the
+    worker's records through ``absorb``.
+    """
+    global _sampler
+    _sampler = None
+    _open.clear()
+    _local.listener = None
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
+
+def _open_stage(rec: dict) -> None:
+    global _sampler
+    rec["peak_rss_mb"] = rss_mb()
+    if rec["peak_rss_mb"] is None:  # no /proc: nothing to sample
+        return
+    with _lock:
+        _open.append(rec)
+        if _sampler is None:
+            _sampler = threading.Thread(target=_sample_rss, name="stage-rss", daemon=True)
+            _sampler.start()
+
+def _close_stage(rec: dict) -> None:
+    rss = rss_mb()
+    with _lock:
+        _open[:] = [r for r in _open if r is not rec]
+        if rec["peak_rss_mb"] is not None and rss is not None:
+            rec["peak_rss_mb"] = max(rec["peak_rss_mb"], rss)
+    rec["rss_mb"] = rss
+
+def _record(rec: dict) -> None:
+    with _lock:
+        _stages.append(rec)
+        for cap in _captures:
+            cap.append(rec)
+    listener = getattr(_local, "listener", None)
+    if listener is not None:
+        listener(rec)
+
+@contextmanager
+def listen(fn: Callable[[dict], None]) -> Iterator[None]:
+    """Call ``fn(rec)`` for each stage record made or absorbed on this thread.
+
+    ``fn`` may raise to abort the work in progress.
+    """
+    prev = getattr(_local, "listener", None)
+    _local.listener = fn
+    try:
+        yield
+    finally:
+        _local.listener = prev
+
+@contextmanager
+def stage(name: str, rows: Optional[int] = None) -> Iterator[dict]:
+    """Time a build stage; set ``rec["rows"]`` inside the block if not known up front."""
+    rec = {"stage": name, "rows": rows, "pid": os.getpid(), "started_at": time.time()}
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.reset_peak()
+    _open_stage(rec)
+    t = time.perf_counter()
+    try:
+        yield rec
+    finally:
+        rec["wall_s"] = round(time.perf_counter() - t, 6)
+        _close_stage(rec)
+        if tracing:
+            rec["py_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 2**20, 2)
+        _record(rec)
+
+@contextmanager
+def capture() -> Iterator[List[dict]]:
+    """Collect the stage records made inside the block (to return from a worker)."""
+    recs: List[dict] = []
+    with _lock:
+        _captures.append(recs)
+    try:
+        yield recs
+    finally:
+        with _lock:
+            _captures.remove(recs)
+
+def absorb(records: List[dict]) -> None:
+    """Add stage records made in another process."""
+    for rec in records:
+        _record(rec)
+
+def record_latency(name: str, seconds: float) -> None:
+    window = _latencies.get(name)
+    if window is None:
+        with _lock:
+            window = _latencies.setdefault(name, deque(maxlen=LATENCY_WINDOW))
+    window.append(seconds)
+
+def timed(name: str) -> Callable:
+    """Decorator: record every call's latency under ``name``."""
+    def wrap(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            t = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                record_latency(name, time.perf_counter() - t)
+        return inner
+    return wrap
+
+def _percentile(sorted_us: List[float], q: float) -> float:
+    return sorted_us[min(len(sorted_us) - 1, int(q * len(sorted_us)))]
+
+def latency_summary(name: str) -> dict:
+    """Percentiles and a bucket histogram over the current window of ``name``."""
+    us = sorted(s * 1e6 for s in list(_latencies.get(name, ())))
+    if not us:
+        return {"n": 0}
+    counts = [0] * len(BUCKETS_US)
+    for v in us:
+        counts[min(bisect.bisect_left(BUCKETS_US, v), len(BUCKETS_US) - 1)] += 1
+    return {"n": len(us), "p50_us": round(_percentile(us, 0.50), 2), "p90_us": round(_percentile(us, 0.90), 2),
+            "p99_us": round(_percentile(us, 0.99), 2), "max_us": round(us[-1], 2),
+            "mean_us": round(sum(us) / len(us), 2),
+            "histogram": [{"le_us": b, "count": c} for b, c in zip(BUCKETS_US, counts) if c]}
+
+def stage_summary() -> List[dict]:
+    """Per stage name: calls, total wall time, rows, throughput and memory peaks."""
+    out: Dict[str, dict] = {}
+    for rec in list(_stages):
+        s = out.setdefault(rec["stage"], {"stage": rec["stage"], "calls": 0, "wall_s": 0.0, "rows": 0,
+                                          "peak_rss_mb": None, "py_peak_mb": None})
+        s["calls"] += 1
+        s["wall_s"] += rec["wall_s"]
+        s["rows"] += rec.get("rows") or 0
+        for k in ("peak_rss_mb", "py_peak_mb"):
+            if rec.get(k) is not None:
+                s[k] = max(s[k] or 0, rec[k])
+    for s in out.values():
+        s["wall_s"] = round(s["wall_s"], 4)
+        s["rows_per_s"] = round(s["rows"] / s["wall_s"], 1) if s["rows"] and s["wall_s"] else None
+    return list(out.values())
+
+def snapshot() -> dict:
+    return {"taken_at": time.time(), "pid": os.getpid(), "rss_mb": rss_mb(), "peak_rss_mb": peak_rss_mb(),
+            "stages": stage_summary(), "stage_records": list(_stages),
+            "latency": {name: latency_summary(name) for name in sorted(_latencies)}}
+
+def export_json(path: Optional[str] = None) -> str:
+    """Write ``snapshot()`` to ``path`` (default ``artifacts/metrics.json``)."""
+    if path is None:
+        from paths import ART_DIR, ensure_dirs
+        ensure_dirs()
+        path = os.path.join(ART_DIR, METRICS_FILE)
+    with open(path, "w") as f:
+        json.dump(snapshot(), f, indent=2)
+    return path
+
+def reset() -> None:
+    with _lock:
+        _stages.clear()
+        _latencies.clear()
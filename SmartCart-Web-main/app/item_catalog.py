@@ -0,0 +1,73 @@
+"""Per-artifact item catalog shared by the recommender and the pages.
+
+Built once per loaded artifact: item ID -> type code, tag bitmask, icon
+and blacklist flag as parallel arrays. The recommender tests tags with
+``tag_mask & TAG_BIT[...]`` and the pages read ``catalog.icon(item)``
+instead of rescanning keyword lists on every render.
+"""
+from __future__ import annotations
+from typing import Dict, Iterable, List
+import numpy as np
+
+from item_tables import (  # noqa: F401  (re-exported)
+    TYPE_NAMES, TAG_NAMES, TAG_BIT, DEFAULT_BLACKLIST, EMOJI_MAP, DEFAULT_ICON, ICONS,
+    encode_tags, decode_tags, icon_for_name
+)
+
+class ItemCatalog:
+    """Item IDs with ``type_code`` (int8 into ``TYPE_NAMES``), ``tag_mask``
+    (uint8 over ``TAG_NAMES``), ``icon_code`` (into ``ICONS``) and the
+    ``blacklisted`` mask of ``DEFAULT_BLACKLIST``.
+
+    ``bits`` holds the same tag masks as a name -> int dict for scalar code.
+    """
+
+    def __init__(self, items: List[str], type_code: np.ndarray, tag_mask: np.ndarray,
+                 blacklist: Iterable[str] = DEFAULT_BLACKLIST):
+        self.items = list(items)
+        self.item_id = {it: i for i, it in enumerate(self.items)}
+        self.type_code = np.asarray(type_code, dtype=np.int8)
+        self.tag_mask = np.asarray(tag_mask, dtype=np.uint8)
+        self.bits = dict(zip(self.items, self.tag_mask.tolist()))
+        self.icon_code = np.array([ICONS.index(icon_for_name(it)) for it in self.items], dtype=np.uint8)
+        self._masks: Dict[frozenset, np.ndarray] = {}
+        self.blacklisted = self.blacklist_mask(blacklist)
+
+    @classmethod
+    def from_tags(cls, items: List[str], item_type: Dict[str, str], item_feat: Dict[str, set]) -> "ItemCatalog":
+        """From the ``item_type`` / ``item_feat`` dicts (unknown types count as "other")."""
+        other = TYPE_NAMES.index("other")
+        code = {t: c for c, t in enumerate(TYPE_NAMES)}
+        return cls(items, [code.get(item_type.get(it, "other"), other) for it in items],
+                   [encode_tags(item_feat.get(it, ())) for it in items])
+
+    @classmethod
+    def from_arrays(cls, arrs: dict) -> "ItemCatalog":
+        """From the stored ``type_code`` / ``tag_mask`` arrays of an opened artifact."""
+        return cls(arrs["items"], arrs["type_code"], arrs["tag_mask"])
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def tagged(self, tag: str) -> np.ndarray:
+        """Boolean mask of the items carrying ``tag``."""
+        return (self.tag_mask & TAG_BIT[tag]) != 0
+
+    def blacklist_mask(self, blacklist: Iterable[str]) -> np.ndarray:
+        """Boolean mask of the known items in ``blacklist`` (cached per distinct set)."""
+        key = frozenset(blacklist)
+        mask = self._masks.get(key)
+        if mask is None:
+            mask = np.zeros(len(self.items), dtype=bool)
+            mask[[self.item_id[b] for b in key if b in self.item_id]] = True
+            self._masks[key] = mask
+        return mask
+
+    def type_of(self, item: str) -> str:
+        i = self.item_id.get(item)
+        return "other" if i is None else TYPE_NAMES[self.type_code[i]]
+
+    def icon(self, item) -> str:
+        """Icon of an item ID or name; names outside the catalog are matched by keyword."""
+        i = item if isinstance(item, (int, np.integer)) else self.item_id.get(item)
+        return icon_for_name(item) if i is None else ICONS[self.icon_code[i]]
@@ -0,0 +1,97 @@
+from __future__ import annotations
+import threading
+from collections import Counter, OrderedDict
+from difflib import SequenceMatcher
+from typing import Dict, List, Optional
+import numpy as np
+
+DEFAULT_CUTOFF = 0.75
+MEMO_SIZE = 65_536
+
+def build_char_index(names: List[str]) -> tuple[str, np.ndarray]:
+    """Alphabet and names x alphabet character-count matrix (the n=1 gram index)."""
+    alphabet = "".join(sorted({ch for nm in names for ch in nm}))
+    pos = {ch: i for i, ch in enumerate(alphabet)}
+    counts = np.zeros((len(names), len(alphabet)), dtype=np.uint16)
+    for r, nm in enumerate(names):
+        for ch, c in Counter(nm).items():
+            counts[r, pos[ch]] = min(c, 65_535)
+    return alphabet, counts
+
+class ItemMatcher:
+    """Fuzzy raw-string -> canonical item lookup with ``get_close_matches`` semantics.
+
+    Candidates are prefiltered with the character index: the shared
+    character count is ``quick_ratio``, an upper bound on
+    ``SequenceMatcher.ratio``, so nothing that could reach ``cutoff`` is
+    dropped. Survivors are scored exactly and ties go to the larger string,
+    as in difflib. Results, including misses, are memoized in a bounded LRU
+    that is locked, since one matcher serves every session thread.
+
+    The index is deliberately unigram counts rather than n-gram postings:
+    shared n-grams do not bound ``ratio``, so pruning on them could drop a
+    match difflib would return, while the character-count bound is exact.
+    For a menu of a few hundred names the bound is one vectorized pass over
+    the count matrix; postings would only pay off for far larger vocabularies.
+    """
+
+    def __init__(self, lower_to_orig: Dict[str, str], cutoff: float = DEFAULT_CUTOFF,
+                 alphabet: Optional[str] = None, char_counts: Optional[np.ndarray] = None,
+                 memo_size: int = MEMO_SIZE):
+        self.lower_to_orig = lower_to_orig
+        self.names = list(lower_to_orig.keys())
+        self.cutoff = cutoff
+        if alphabet is None or char_counts is None:
+            alphabet, char_counts = build_char_index(self.names)
+        self.char_pos = {ch: i for i, ch in enumerate(alphabet)}
+        self.char_counts = np.asarray(char_counts, dtype=np.int64)
+        self.lengths = np.array([len(nm) for nm in self.names], dtype=np.int64)
+        self.memo: OrderedDict[str, Optional[str]] = OrderedDict()
+        self.memo_size = memo_size
+        self.hits = self.misses = 0
+        self._lock = threading.Lock()
+
+    def match(self, raw: str) -> Optional[str]:
+        """Canonical item for ``raw`` or None when nothing clears the cutoff."""
+        lx = raw.lower()
+        if lx in self.lower_to_orig:
+            return self.lower_to_orig[lx]
+        with self._lock:
+            if lx in self.memo:
+                self.hits += 1
+                self.memo.move_to_end(lx)
+                return self.memo[lx]
+            self.misses += 1
+        best = self._closest(lx)
+        with self._lock:
+            self.memo[lx] = best
+            self.memo.move_to_end(lx)
+            if len(self.memo) > self.memo_size:
+                self.memo.popitem(last=False)
+        return best
+
+    def _closest(self, lx: str) -> Optional[str]:
+        if not self.names:
+            return None
+        total = self.lengths + len(lx)
+        # real_quick_ratio bound from lengths alone
+        ok = 2.0 * np.minimum(self.lengths, len(lx)) >= self.cutoff * total - 1e-9
+        # quick_ratio bound from shared character counts
+        q_idx, q_cnt = [], []
+        for ch, c in Counter(lx).items():
+            if ch in self.char_pos:
+                q_idx.append(self.char_pos[ch]); q_cnt.append(c)
+        shared = np.minimum(self.char_counts[:, q_idx], np.array(q_cnt, dtype=np.int64)).sum(axis=1)
+        ok &= 2.0 * shared >= self.cutoff * total - 1e-9
+
+        s = SequenceMatcher()
+        s.set_seq2(lx)
+        best = None
+        for r in np.flatnonzero(ok):
+            x = self.names[r]
+            s.set_seq1(x)
+            if s.real_quick_ratio() >= self.cutoff and s.quick_ratio() >= self.cutoff:
+                sc = s.ratio()
+                if sc >= self.cutoff and (best is None or (sc, x) > best):
+                    best = (sc, x)
+        return self.lower_to_orig[best[1]] if best else None
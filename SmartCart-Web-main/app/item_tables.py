@@ -0,0 +1,48 @@
+"""Fixed item code tables, tag bits, the blacklist and icon keywords.
+
+Standard library only, so the pages can import icons without loading
+numpy; ``item_catalog`` builds its arrays over these tables.
+"""
+from __future__ import annotations
+from typing import Iterable
+
+# Fixed code tables: array values index into these lists
+TYPE_NAMES = ["main", "side", "dip", "drink", "other"]
+TAG_NAMES = ["veg", "non-veg", "spicy", "combo", "dessert", "cold_drink", "non-food"]
+TAG_BIT = {t: 1 << i for i, t in enumerate(TAG_NAMES)}
+
+# Blacklist items we never recommend
+DEFAULT_BLACKLIST = {
+    "Plastic Fork","Plastic Knife","Plastic Straw","Plastic Utensils",
+    "Delivery Fee","Unavailable Item","Ketchup Pack","Seasoning Pack","Extra Sauce"
+}
+
+EMOJI_MAP = [
+    (["wing", "wings", "grilled"], "🍗"),
+    (["spicy"], "🌶️"),
+    (["fries", "voodoo"], "🍟"),
+    (["soda", "punch", "drink", "tea", "lager", "root beer"], "🥤"),
+    (["dip", "sauce"], "🥣"),
+    (["corn"], "🌽"),
+    (["veggie", "celery", "carrot"], "🥕"),
+    (["cake", "dessert", "choco"], "🍰"),
+    (["combo", "feast", "bundle", "lunch", "box", "platter"], "🍱"),
+    (["strip", "strips"], "🍗"),
+    (["water"], "💧"),
+]
+DEFAULT_ICON = "🍽️"
+# icon codes index into this list
+ICONS = [DEFAULT_ICON] + list(dict.fromkeys(emoji for _, emoji in EMOJI_MAP))
+
+def encode_tags(tags: Iterable[str]) -> int:
+    return sum(TAG_BIT[t] for t in tags if t in TAG_BIT)
+
+def decode_tags(mask: int) -> set[str]:
+    return {t for t, bit in TAG_BIT.items() if mask & bit}
+
+def icon_for_name(name: str) -> str:
+    n = (name or "").lower()
+    for keys, emoji in EMOJI_MAP:
+        if any(k in n for k in keys):
+            return emoji
+    return DEFAULT_ICON
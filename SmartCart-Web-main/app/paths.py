@@ -0,0 +1,18 @@
+"""Data and artifact locations (stdlib only, safe to import before numpy/pandas)."""
+from __future__ import annotations
+import os
+
+# SMARTCART_DATA_DIR / SMARTCART_ART_DIR override the repo-local folders (benchmarks, batch hosts)
+DATA_DIR = os.environ.get("SMARTCART_DATA_DIR", os.path.join(os.path.dirname(os.path.dirname(__file__)), "data"))
+ART_DIR = os.environ.get("SMARTCART_ART_DIR", os.path.join(os.path.dirname(os.path.dirname(__file__)), "artifacts"))
+
+def ensure_dirs():
+    os.makedirs(ART_DIR, exist_ok=True)
+
+def csv_paths() -> dict:
+    return {
+        "order": os.path.join(DATA_DIR, "order_data.csv"),
+        "customer": os.path.join(DATA_DIR, "customer_data.csv"),
+        "store": os.path.join(DATA_DIR, "store_data.csv"),
+        "test": os.path.join(DATA_DIR, "test_data_question.csv"),
+    }
@@ -0,0 +1,168 @@
+from __future__ import annotations
+import itertools, json, os, threading
+from collections import OrderedDict
+from math import comb
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+
+from instrument import timed
+from recommender import DEFAULT_BLACKLIST, SmartCartModel
+
+CACHE_SIZE = 50_000
+PRECOMPUTED_SIZES = (1, 2, 3)
+# combinations scored per recommend_batch call while precomputing
+PRECOMPUTE_BLOCK = 20_000
+
+_DEFAULT_BLACKLIST_KEY = frozenset(DEFAULT_BLACKLIST)
+
+def combo_rank(ids: np.ndarray) -> np.ndarray:
+    """Colex rank of strictly increasing ID rows: sum of C(ids[k], k+1)."""
+    rank = np.zeros(len(ids), dtype=np.int64)
+    for k in range(ids.shape[1]):
+        col = ids[:, k].astype(np.int64)
+        # C(col, k+1) via the falling factorial, exact in int64 for our vocab sizes
+        num = np.ones(len(ids), dtype=np.int64)
+        for j in range(k + 1):
+            num *= col - j
+        rank += num // np.int64(np.prod(np.arange(1, k + 2)))
+    return rank
+
+def precompute_recommendations(model: SmartCartModel, out_dir: str, version: str,
+                               sizes: Iterable[int] = PRECOMPUTED_SIZES,
+                               top_n: int = 3, boost_factor: float = 1.2,
+                               max_per_type: int = 1) -> str:
+    """Score every sorted cart of distinct items for each size in ``sizes``.
+
+    Writes ``precomputed_k{k}_rec.npy`` / ``_score.npy`` (rows in colex combo
+    order) and ``precomputed.json`` with the parameters and artifact version
+    they are valid for. Uses the default blacklist.
+    """
+    n = len(model.items)
+    sizes = [k for k in sizes if k <= n]
+    for k in sizes:
+        rec = np.full((comb(n, k), top_n), -1, dtype=np.int16)
+        score = np.zeros((comb(n, k), top_n))
+        combos = itertools.combinations(range(n), k)
+        while True:
+            block = np.array(list(itertools.islice(combos, PRECOMPUTE_BLOCK)), dtype=np.int64)
+            if not len(block):
+                break
+            r, sc = model.recommend_batch(block, DEFAULT_BLACKLIST, top_n=top_n,
+                                          boost_factor=boost_factor, max_per_type=max_per_type)
+            rank = combo_rank(block)
+            rec[rank], score[rank] = r, sc
+        np.save(os.path.join(out_dir, f"precomputed_k{k}_rec.npy"), rec)
+        np.save(os.path.join(out_dir, f"precomputed_k{k}_score.npy"), score)
+    meta = {"version": version, "sizes": sizes, "top_n": top_n,
+            "boost_factor": boost_factor, "max_per_type": max_per_type}
+    with open(os.path.join(out_dir, "precomputed.json"), "w") as f:
+        json.dump(meta, f)
+    return out_dir
+
+def load_precomputed(out_dir: str, version: str) -> Optional[dict]:
+    """Memory-map precomputed tables if they exist for this artifact version."""
+    p = os.path.join(out_dir, "precomputed.json")
+    if not os.path.exists(p):
+        return None
+    with open(p) as f:
+        meta = json.load(f)
+    if meta["version"] != version:
+        return None
+    meta["tables"] = {
+        k: (np.load(os.path.join(out_dir, f"precomputed_k{k}_rec.npy"), mmap_mode="r"),
+            np.load(os.path.join(out_dir, f"precomputed_k{k}_score.npy"), mmap_mode="r"))
+        for k in meta["sizes"]
+    }
+    return meta
+
+class RecommendationCache:
+    """Cart-level LRU in front of ``SmartCartModel.recommend``.
+
+    Keys are the canonical (sorted) cart, ``top_n``, ``boost_factor``,
+    ``max_per_type``, the blacklist, the context segment and the artifact
+    version, and a miss computes the recommendation for that sorted cart.
+    Carts of distinct known items with default parameters and no segment are
+    answered from the precomputed tables when they were built for this
+    version.
+
+    One cache is shared by every Streamlit session thread: lookups, inserts,
+    evictions and the counters run under one lock; a miss is scored outside
+    it, so concurrent misses do not wait on each other.
+    """
+
+    def __init__(self, model: SmartCartModel, version: str,
+                 maxsize: int = CACHE_SIZE, precomputed: Optional[dict] = None):
+        self.model = model
+        self.version = version
+        self.maxsize = maxsize
+        self.precomputed = precomputed
+        self.entries: OrderedDict[tuple, List[Tuple[str, float]]] = OrderedDict()
+        self.hits = self.misses = self.precomputed_hits = self.evictions = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_artifact(cls, art: dict, maxsize: int = CACHE_SIZE) -> "RecommendationCache":
+        arrs = art.get("arrays")
+        pre = load_precomputed(arrs["dir"], art["version"]) if arrs is not None else None
+        return cls(SmartCartModel.from_artifact(art), art["version"], maxsize=maxsize, precomputed=pre)
+
+    @timed("RecommendationCache.recommend")
+    def recommend(self, cart_items: List[str],
+                  blacklist: set[str] = DEFAULT_BLACKLIST,
+                  top_n: int = 3,
+                  boost_factor: float = 1.2,
+                  max_per_type: int = 1,
+                  context: Optional[dict] = None,
+                  customer_id=None) -> List[Tuple[str, float]]:
+        cart = tuple(sorted(cart_items))
+        history = self.model.history
+        if customer_id is not None and history is not None and history.row(customer_id) >= 0:
+            # personalized results are per customer: scored directly, never cached
+            return self.model.recommend(list(cart), blacklist, top_n=top_n, boost_factor=boost_factor,
+                                        max_per_type=max_per_type, context=context, customer_id=customer_id)
+        bl_key = _DEFAULT_BLACKLIST_KEY if blacklist is DEFAULT_BLACKLIST else frozenset(blacklist)
+        segment = self.model.segment_for(context)
+        key = (cart, top_n, boost_factor, max_per_type, bl_key, segment, self.version)
+        with self._lock:
+            hit = self.entries.get(key)
+            if hit is not None:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return list(hit)
+            self.misses += 1
+
+        recs = self._from_precomputed(cart, top_n, boost_factor, max_per_type, bl_key) if segment is None else None
+        from_table = recs is not None
+        if recs is None:
+            recs = self.model.recommend(list(cart), blacklist, top_n=top_n, boost_factor=boost_factor,
+                                        max_per_type=max_per_type, context=context)
+        with self._lock:
+            self.precomputed_hits += from_table
+            self.entries[key] = recs
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return list(recs)
+
+    def _from_precomputed(self, cart: tuple, top_n: int, boost_factor: float,
+                          max_per_type: int, bl_key: frozenset) -> Optional[List[Tuple[str, float]]]:
+        pre = self.precomputed
+        if (pre is None or bl_key != _DEFAULT_BLACKLIST_KEY or len(cart) not in pre["tables"]
+                or (top_n, boost_factor, max_per_type) != (pre["top_n"], pre["boost_factor"], pre["max_per_type"])):
+            return None
+        ids = [self.model.item_id.get(x) for x in cart]
+        if None in ids or len(set(ids)) != len(ids):
+            return None
+        rec, score = pre["tables"][len(cart)]
+        r = int(combo_rank(np.array([ids], dtype=np.int64))[0])
+        return [(self.model.items[i], round(float(s), 4)) for i, s in zip(rec[r], score[r]) if i >= 0]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "precomputed_hits": self.precomputed_hits,
+                    "evictions": self.evictions, "size": len(self.entries), "maxsize": self.maxsize}
+
+    def clear(self) -> None:
+        with self._lock:
+            self.entries.clear()
@@ -1,14 +1,21 @@
 from __future__ import annotations
 from collections import defaultdict, Counter
 from difflib import get_close_matches
+from itertools import combinations
 from typing import List, Dict, Tuple, Iterable, Optional
+import numpy as np
+import pandas as pd
 
-# Blacklist items we never recommend
-DEFAULT_BLACKLIST = {
-    "Plastic Fork","Plastic Knife","Plastic Straw","Plastic Utensils",
-    "Delivery Fee","Unavailable Item","Ketchup Pack","Seasoning Pack","Extra Sauce"
-}
+from item_catalog import DEFAULT_BLACKLIST, TAG_BIT, ItemCatalog
+from item_matcher import ItemMatcher
+from data_loader import SEGMENT_DIMS
+from instrument import timed
 
+# columns batch_predict reads a row's context from, per segment dimension
+CONTEXT_COLS = dict(SEGMENT_DIMS)
+SPICY = TAG_BIT["spicy"]
+
+@timed("enhanced_recommend")
 def enhanced_recommend(cart_items: List[str],
                        co_dict: Dict[str, Dict[str, float]],
                        item_type: Dict[str,str],
@@ -17,22 +24,49 @@ def enhanced_recommend(cart_items: List[str],
                        blacklist: set[str] = DEFAULT_BLACKLIST,
                        top_n: int = 3,
                        boost_factor: float = 1.2,
-                       max_per_type: int = 1) -> List[Tuple[str, float]]:
-    """Type-aware, spicy-aware, fallback-enabled recommender returning (item, score)."""
+                       max_per_type: int = 1,
+                       context: Optional[dict] = None,
+                       segment_co: Optional[Dict[str, Dict[str, Dict[str, float]]]] = None,
+                       pair_co: Optional[Dict[Tuple[str, str], Dict[str, float]]] = None,
+                       customer_id=None, history=None,
+                       catalog: Optional[ItemCatalog] = None) -> List[Tuple[str, float]]:
+    """Type-aware, spicy-aware, fallback-enabled recommender returning (item, score).
+
+    With ``context`` and per-segment matrices ``segment_co`` the matrix of the
+    segment ``pick_segment`` selects replaces ``co_dict``. With a pair-context
+    index ``pair_co`` the P(j | i, k) rows of the cart's indexed pairs are
+    scored instead of the single-item rows, when the cart has any. With a
+    ``CustomerHistory`` and a ``customer_id`` found in it, candidate scores
+    are multiplied by the customer's item affinities before the top-N pick.
+    An ``ItemCatalog`` replaces the ``item_tags`` set lookups with tag bits.
+    """
+    if context and segment_co:
+        seg = pick_segment(context, segment_co)
+        if seg is not None:
+            co_dict = segment_co[seg]
     score = defaultdict(float)
     cart_types = Counter([item_type.get(x, "other") for x in cart_items])
-    cart_has_spicy = any("spicy" in item_tags.get(x, set()) for x in cart_items)
+    bits = catalog.bits if catalog is not None else None
+    if bits is not None:
+        cart_has_spicy = any(bits.get(x, 0) & SPICY for x in cart_items)
+    else:
+        cart_has_spicy = any("spicy" in item_tags.get(x, ()) for x in cart_items)
 
-    # 1) score from co-occurrence matrix
-    for it in cart_items:
-        if it not in co_dict:
-            continue
-        for co_it, cnt in co_dict[it].items():
+    rows = []
+    if pair_co:
+        known = [x for x in cart_items if x in item_type]
+        rows = [pair_co[key] for key in (tuple(sorted(p)) for p in combinations(known, 2)) if key in pair_co]
+    if not rows:
+        rows = [co_dict[it] for it in cart_items if it in co_dict]
+
+    # 1) score from co-occurrence matrix (or pair rows)
+    for row in rows:
+        for co_it, cnt in row.items():
             if co_it in cart_items or co_it in blacklist:
                 continue
             t = item_type.get(co_it, "other")
-            tags = item_tags.get(co_it, set())
-            spicy_bonus = cnt*0.3 if ("spicy" in tags and not cart_has_spicy) else (cnt*0.1 if "spicy" in tags else 0.0)
+            spicy = bits.get(co_it, 0) & SPICY if bits is not None else "spicy" in item_tags.get(co_it, ())
+            spicy_bonus = cnt*0.3 if (spicy and not cart_has_spicy) else (cnt*0.1 if spicy else 0.0)
             if cart_types.get(t, 0) == 0 and t == "drink":
                 score[co_it] += cnt*(boost_factor*1.5) + spicy_bonus
             elif cart_types.get(t, 0) == 0:
@@ -40,6 +74,12 @@ def enhanced_recommend(cart_items: List[str],
             else:
                 score[co_it] += cnt + spicy_bonus
 
+    # 1b) customer-affinity re-rank
+    if history is not None and customer_id is not None:
+        for it, m in history.affinity(customer_id).items():
+            if it in score:
+                score[it] *= m
+
     # 2) top-N with 1 per type
     sorted_items = sorted(score.items(), key=lambda x: x[1], reverse=True)
     reco, used_type = [], Counter()
@@ -66,14 +106,38 @@ def enhanced_recommend(cart_items: List[str],
             if len(reco) >= top_n: break
     return reco[:top_n]
 
+def context_value(context: dict, dim: str) -> Optional[str]:
+    """A dimension's value from ``context``, keyed by dimension or CSV column name."""
+    v = context.get(dim, context.get(SEGMENT_DIMS[dim]))
+    if dim == "daypart" and v is not None and v not in ("weekday", "weekend"):
+        d = pd.to_datetime(v, errors="coerce")
+        v = None if pd.isna(d) else ("weekend" if d.dayofweek >= 5 else "weekday")
+    return v if isinstance(v, str) and v else None
+
+def pick_segment(context: Optional[dict], segments: Iterable[str]) -> Optional[str]:
+    """First available segment key in ``SEGMENT_DIMS`` order (occasion, channel, daypart)."""
+    if not context:
+        return None
+    for dim in SEGMENT_DIMS:
+        v = context_value(context, dim)
+        if v is not None and f"{dim}={v}" in segments:
+            return f"{dim}={v}"
+    return None
+
+@timed("normalize_user_items")
 def normalize_user_items(raw_items: Iterable[str],
                          known_items_lower: List[str],
                          lower_to_orig: Dict[str,str],
-                         cutoff: float = 0.75) -> List[str]:
+                         cutoff: float = 0.75,
+                         matcher: Optional[ItemMatcher] = None) -> List[str]:
+    """Map raw strings to canonical items; ``matcher`` (same cutoff) replaces the difflib scan."""
     mapped = []
     for x in raw_items:
         if not isinstance(x, str) or not x.strip():
             continue
+        if matcher is not None:
+            m = matcher.match(x)
+            mapped.append(m if m is not None else x); continue
         lx = x.lower()
         if lx in lower_to_orig:
             mapped.append(lower_to_orig[lx]); continue
@@ -81,17 +145,440 @@ def normalize_user_items(raw_items: Iterable[str],
         mapped.append(lower_to_orig[m[0]] if m else x)
     return mapped
 
+ITEM_COLS = ["item1", "item2", "item3"]
+# unique carts scored per block in batch_predict (block x n_items float64 arrays)
+BATCH_BLOCK = 20_000
+
+@timed("batch_predict")
 def batch_predict(test_df,
                   co_dict, item_type, top_items_by_type, item_tags,
                   known_items_lower, lower_to_orig,
-                  blacklist=DEFAULT_BLACKLIST, top_n=3):
+                  blacklist=DEFAULT_BLACKLIST, top_n=3, model=None, matcher=None, use_context=False,
+                  use_customer=False, stores=None):
+    """Fill ``RECOMMENDATION 1..top_n`` for every row of ``test_df``.
+
+    Raw item strings are normalized once per distinct value, identical carts
+    are scored once and the result columns are assigned in bulk. Pass a
+    compiled ``model`` to skip compiling one from the dicts and an
+    ``ItemMatcher`` for indexed fuzzy matching. ``use_context`` scores each
+    row with the segment matrix its occasion/channel/date columns select;
+    ``use_customer`` re-ranks rows whose ``CUSTOMER_ID`` is in the model's
+    purchase history. With a ``StoreModelRegistry`` as ``stores`` rows whose
+    ``STORE_NUMBER`` has a store model are scored on it (without context);
+    the rest use ``model``.
+    """
+    if model is None:
+        model = SmartCartModel.from_artifact({"item_type": item_type, "item_feat": item_tags,
+                                              "top_by_type": top_items_by_type, "co_norm": co_dict})
     out = test_df.copy()
     for col in ["RECOMMENDATION 1","RECOMMENDATION 2","RECOMMENDATION 3"]:
         out[col] = ""
-    for idx, row in out.iterrows():
-        raw = [row.get("item1",""), row.get("item2",""), row.get("item3","")]
-        cart = normalize_user_items(raw, known_items_lower, lower_to_orig)
-        recs = enhanced_recommend(cart, co_dict, item_type, top_items_by_type, item_tags, blacklist, top_n=top_n)
-        for i,(it,_) in enumerate(recs):
-            out.at[idx, f"RECOMMENDATION {i+1}"] = it
-    return out
\ No newline at end of file
+    if len(out) == 0:
+        return out
+
+    codes = model.encode_raw_carts(out, known_items_lower, lower_to_orig, matcher=matcher)
+    if use_customer and model.history is not None and "CUSTOMER_ID" in out:
+        codes = np.column_stack([codes, model.history.rows(out["CUSTOMER_ID"])])  # history row
+    else:
+        codes = np.column_stack([codes, np.full(len(codes), -1, dtype=np.int64)])
+    if use_context and model.segments:
+        codes = np.column_stack([codes, model.segment_codes(out)])  # segment
+    else:
+        codes = np.column_stack([codes, np.full(len(codes), -1, dtype=np.int64)])
+    if stores is not None:
+        codes = np.column_stack([codes, stores.partition_codes(out)])  # last column: store model
+    else:
+        codes = np.column_stack([codes, np.full(len(codes), -1, dtype=np.int64)])
+    uniq, inverse = np.unique(codes, axis=0, return_inverse=True)
+    rec = np.empty((len(uniq), top_n), dtype=np.int64)
+    for p in np.unique(uniq[:, -1]).tolist():
+        rows = np.flatnonzero(uniq[:, -1] == p)
+        m = model if p < 0 else stores.model(p)
+        for start in range(0, len(rows), BATCH_BLOCK):
+            block = uniq[rows[start:start + BATCH_BLOCK]]
+            rec[rows[start:start + BATCH_BLOCK]], _ = m.recommend_batch(
+                block[:, :-3], blacklist, top_n=top_n, segments=block[:, -2] if p < 0 else None,
+                customers=block[:, -3])
+    names = np.array(model.items + [""], dtype=object)  # -1 -> ""
+    inverse = inverse.reshape(-1)
+    for i in range(top_n):
+        out[f"RECOMMENDATION {i+1}"] = names[rec[inverse, i]]
+    return out
+
+class SmartCartModel:
+    """Array-compiled ``enhanced_recommend``.
+
+    Built once per artifact: items become integer IDs, P(j|i) a dense matrix
+    kept in the artifact's float32 (a memory-mapped file stays mapped; only
+    the gathered rows become float64, which is exact) and optionally
+    truncated to each item's top-K neighbors, types,
+    tags and blacklists come from the artifact's ``ItemCatalog`` (type
+    codes, tag bitmasks), and fallback lists ID arrays. With
+    ``neighbors=None`` (default) ``recommend`` returns exactly what
+    ``enhanced_recommend`` returns for the same artifact.
+
+    ``segments``/``seg_co`` are the optional per-context matrices (one
+    n x n slice per segment key); a request's context picks one slice in
+    place of ``co``.
+
+    ``pairs`` is the optional pair-context index (``pair_keys``,
+    ``pair_offsets``, ``pair_targets``, ``pair_probs`` CSR arrays). It is
+    opt-in: with ``pair_context`` a cart holding indexed pairs is scored on
+    their dense P(j | i, k) rows, found through an n x n row table, and only
+    falls back to single-item rows when it holds none; this matches
+    ``enhanced_recommend(..., pair_co=...)``. Without it (the default)
+    results are the single-item ones of ``enhanced_recommend``.
+
+    ``history`` is the optional ``CustomerHistory``; ``recommend`` with a
+    ``customer_id`` and ``recommend_batch`` with ``customers`` (history row
+    per cart) apply the same affinity multipliers as ``enhanced_recommend``.
+    """
+
+    FALLBACK_TYPES = ["main", "side", "dip", "drink"]
+
+    def __init__(self, items: List[str], co: np.ndarray, item_type: Dict[str, str],
+                 item_tags: Dict[str, set], top_items_by_type: Dict[str, List[Tuple[str, int]]],
+                 neighbors: Optional[int] = None,
+                 segments: Optional[List[str]] = None, seg_co: Optional[np.ndarray] = None,
+                 pairs: Optional[dict] = None, pair_context: bool = False, history=None,
+                 catalog: Optional[ItemCatalog] = None):
+        self.items = list(items)
+        self.item_id = {it: i for i, it in enumerate(self.items)}
+        if catalog is None or catalog.items != self.items:
+            catalog = ItemCatalog.from_tags(self.items, item_type, item_tags)
+        self.catalog = catalog
+        n = len(self.items)
+        co = np.asarray(co)  # no dtype: a float32 memmap stays mapped, no copy
+        self.segments = list(segments or [])
+        self.segment_id = {sg: i for i, sg in enumerate(self.segments)}
+        seg_co = np.asarray(seg_co) if self.segments else np.zeros((0, n, n), dtype=co.dtype)
+        if neighbors is not None and neighbors < n:
+            # keep only each row's top-K entries (approximate, smaller fan-out)
+            co, seg_co = co.copy(), seg_co.copy()
+            for m in (co, *seg_co):
+                drop = np.argpartition(-m, neighbors, axis=1)[:, neighbors:]
+                np.put_along_axis(m, drop, 0.0, axis=1)
+        self.co = co
+        self.seg_co = seg_co
+        self.pair_row: Optional[np.ndarray] = None
+        self.pair_co: Optional[np.ndarray] = None
+        if pair_context and pairs is not None and pairs.get("pair_keys") is not None:
+            keys = np.asarray(pairs["pair_keys"], dtype=np.int64)
+            offsets = np.asarray(pairs["pair_offsets"], dtype=np.int64)
+            self.pair_row = np.full((n, n), -1, dtype=np.int32)
+            self.pair_row[keys[:, 0], keys[:, 1]] = np.arange(len(keys))
+            self.pair_row[keys[:, 1], keys[:, 0]] = np.arange(len(keys))
+            self.pair_co = np.zeros((len(keys), n), dtype=np.asarray(pairs["pair_probs"]).dtype)
+            row_of = np.repeat(np.arange(len(keys)), np.diff(offsets))
+            self.pair_co[row_of, np.asarray(pairs["pair_targets"], dtype=np.int64)] = pairs["pair_probs"]
+        # recommend_batch row space: co, every segment slice, the pair rows, then one all-zero row
+        self._row_blocks = [b for b in (co, seg_co.reshape(-1, n), self.pair_co) if b is not None]
+        self._zero_row = sum(len(b) for b in self._row_blocks)
+        self.history = history
+        self.type_names = self.FALLBACK_TYPES + ["other"]
+        code = {t: c for c, t in enumerate(self.type_names)}
+        self.type_code = catalog.type_code.astype(np.int64)
+        self.is_drink = self.type_code == code["drink"]
+        self.tag_mask = catalog.tag_mask
+        self.spicy = catalog.tagged("spicy")
+        self.fallback = [
+            (code[t], np.array([self.item_id[c] for c, _ in top_items_by_type.get(t, []) if c in self.item_id],
+                               dtype=np.int64))
+            for t in self.FALLBACK_TYPES
+        ]
+        self._other = code["other"]
+        self._weight_cache: Dict[tuple, Tuple[np.ndarray, np.ndarray]] = {}
+
+    @classmethod
+    def from_artifact(cls, art: dict, neighbors: Optional[int] = None,
+                      pair_context: bool = False) -> "SmartCartModel":
+        """Compile from a loaded artifact (array-backed or legacy pickle)."""
+        arrs = art.get("arrays")
+        segments, seg_co, pairs = None, None, None
+        if arrs is not None:
+            items, co = arrs["items"], arrs["co"]
+            segments, seg_co, pairs = arrs.get("segments"), arrs.get("seg_co"), arrs
+        else:
+            items = sorted(art["item_type"])
+            pos = {it: i for i, it in enumerate(items)}
+            co = np.zeros((len(items), len(items)))
+            for a, row in art["co_norm"].items():
+                for b, p in row.items():
+                    co[pos[a], pos[b]] = p
+        return cls(items, co, art["item_type"], art["item_feat"], art["top_by_type"], neighbors=neighbors,
+                   segments=segments, seg_co=seg_co, pairs=pairs, pair_context=pair_context,
+                   history=art.get("customer_history"), catalog=art.get("catalog"))
+
+    def segment_for(self, context: Optional[dict]) -> Optional[int]:
+        """Segment index ``context`` selects, or None for the global matrix."""
+        seg = pick_segment(context, self.segment_id) if self.segments else None
+        return None if seg is None else self.segment_id[seg]
+
+    def segment_codes(self, df) -> np.ndarray:
+        """Per-row segment index (-1 = global) from the context columns of ``df``."""
+        out = np.full(len(df), -1, dtype=np.int64)
+        for dim in reversed(list(CONTEXT_COLS)):  # earlier dimensions win
+            col = CONTEXT_COLS[dim]
+            if col not in df:
+                continue
+            vals = df[col]
+            if dim == "daypart":
+                d = pd.to_datetime(vals, errors="coerce")
+                vals = pd.Series(np.where(d.dt.dayofweek >= 5, "weekend", "weekday"), index=d.index).where(d.notna())
+            keys = (dim + "=" + vals.astype(str)).where(vals.notna())
+            seg = keys.map(self.segment_id).to_numpy(dtype=float)
+            out = np.where(np.isnan(seg), out, np.nan_to_num(seg, nan=-1).astype(np.int64))
+        return out
+
+    def _segment_matrix(self, segment: Optional[int]) -> np.ndarray:
+        return self.co if segment is None else self.seg_co[segment]
+
+    def _pair_rows(self, ids: List[int]) -> Optional[np.ndarray]:
+        """Dense P(j | i, k) rows of the cart's indexed pairs, in cart order, or None."""
+        if self.pair_row is None or len(ids) < 2:
+            return None
+        found = [r for r in (self.pair_row[a, b] for a, b in combinations(ids, 2)) if r >= 0]
+        return self.pair_co[found] if found else None
+
+    def blacklist_mask(self, blacklist: Iterable[str]) -> np.ndarray:
+        return self.catalog.blacklist_mask(blacklist)
+
+    @timed("SmartCartModel.recommend")
+    def recommend(self, cart_items: List[str],
+                  blacklist: set[str] = DEFAULT_BLACKLIST,
+                  top_n: int = 3,
+                  boost_factor: float = 1.2,
+                  max_per_type: int = 1,
+                  context: Optional[dict] = None,
+                  customer_id=None) -> List[Tuple[str, float]]:
+        """Same contract as ``enhanced_recommend``; ``context`` may select a segment matrix."""
+        n = len(self.items)
+        ids = [self.item_id[x] for x in cart_items if x in self.item_id]
+        cart_type = np.zeros(len(self.type_names), dtype=bool)
+        cart_type[self.type_code[ids]] = True
+        if len(ids) < len(cart_items):
+            cart_type[self._other] = True  # unknown names count as "other"
+        cart_has_spicy = bool(np.bitwise_or.reduce(self.tag_mask[ids]) & SPICY)
+
+        excluded = self.blacklist_mask(blacklist).copy()
+        excluded[ids] = True
+
+        reco: List[Tuple[str, float]] = []
+        used_type = [0] * len(self.type_names)  # plain ints: the pick loops below run per candidate
+        if ids:
+            # 1) boosted co-occurrence scores, summed row by row in cart order
+            mult, spicy_coef = self._weights(cart_type, cart_has_spicy, boost_factor)
+            rows = self._pair_rows(ids)
+            if rows is None:
+                rows = self._segment_matrix(self.segment_for(context))[ids]
+            rows = rows.astype(np.float64)
+            hit = (rows != 0) & ~excluded
+            c = rows * hit
+            score = np.add.reduce(c * mult + c * spicy_coef, axis=0)
+            if customer_id is not None and self.history is not None:
+                affinity = self.history.multipliers(customer_id)
+                if affinity is not None:
+                    score = score * affinity
+            cand = np.flatnonzero(hit.any(axis=0))
+
+            # 2) top-N with max_per_type per type, walking an argpartition prefix
+            if len(cand):
+                # enhanced_recommend breaks ties by insertion order: first cart row, then item ID
+                first_row = hit[:, cand].argmax(axis=0) if len(hit) > 1 else np.zeros(len(cand), dtype=np.int64)
+                s = score[cand]
+                k = top_n * max_per_type * 2
+                if len(cand) > k > 0:
+                    kth = np.partition(-s, k - 1)[k - 1]
+                    prefix = np.flatnonzero(-s <= kth)  # closed under ties with the k-th
+                else:
+                    prefix = np.arange(len(cand))
+                for sel in (prefix, np.arange(len(cand))):
+                    reco, used_type = [], [0] * len(self.type_names)
+                    order = sel[np.lexsort((cand[sel], first_row[sel], -s[sel]))]
+                    for c, t, sc in zip(cand[order].tolist(), self.type_code[cand[order]].tolist(),
+                                        s[order].tolist()):
+                        if used_type[t] >= max_per_type:
+                            continue
+                        reco.append((self.items[c], round(sc, 4)))
+                        used_type[t] += 1
+                        if len(reco) >= top_n:
+                            break
+                    if len(reco) >= top_n or len(sel) == len(cand):
+                        break
+
+        # 3) fallback fill
+        if len(reco) < top_n:
+            taken = excluded.copy()
+            taken[[self.item_id[it] for it, _ in reco]] = True
+            for t, cands in self.fallback:
+                if used_type[t] >= max_per_type:
+                    continue
+                for c in cands.tolist():
+                    if taken[c]:
+                        continue
+                    reco.append((self.items[c], 0.0))
+                    taken[c] = True
+                    used_type[t] += 1
+                    if len(reco) >= top_n: break
+                if len(reco) >= top_n: break
+        return reco[:top_n]
+
+    # cart slot codes for recommend_batch
+    EMPTY, UNKNOWN = -1, -2
+
+    def encode_raw_carts(self, df, known_items_lower: List[str], lower_to_orig: Dict[str, str],
+                         cols: List[str] = ITEM_COLS, matcher: Optional[ItemMatcher] = None) -> np.ndarray:
+        """Map raw item columns to a rows x len(cols) slot-code matrix.
+
+        Each distinct raw string goes through ``normalize_user_items`` once;
+        known items become IDs, unmatched strings ``UNKNOWN`` (they still count
+        as an "other" cart item) and blanks/NaN ``EMPTY``. Blanks are moved
+        after the filled slots so slot order equals cart order.
+        """
+        codes = np.full((len(df), len(cols)), self.EMPTY, dtype=np.int64)
+        for k, col in enumerate(cols):
+            if col not in df:
+                continue
+            vals, inv = np.unique(df[col].astype(object).where(df[col].notna(), "").astype(str).to_numpy(),
+                                  return_inverse=True)
+            mapped = np.full(len(vals), self.EMPTY, dtype=np.int64)
+            for v, raw in enumerate(vals):
+                m = normalize_user_items([raw], known_items_lower, lower_to_orig, matcher=matcher)
+                if m:
+                    mapped[v] = self.item_id.get(m[0], self.UNKNOWN)
+            codes[:, k] = mapped[inv.reshape(-1)]
+        order = np.argsort(codes == self.EMPTY, axis=1, kind="stable")
+        return np.take_along_axis(codes, order, axis=1)
+
+    def recommend_batch(self, codes: np.ndarray,
+                        blacklist: set[str] = DEFAULT_BLACKLIST,
+                        top_n: int = 3,
+                        boost_factor: float = 1.2,
+                        max_per_type: int = 1,
+                        segments: Optional[np.ndarray] = None,
+                        customers: Optional[np.ndarray] = None) -> tuple[np.ndarray, np.ndarray]:
+        """Vectorized ``recommend`` over a carts x slots code matrix.
+
+        Returns ``(item_ids, scores)``, both carts x top_n, padded with -1 /
+        0.0; scores are unrounded. Row by row the result equals ``recommend``
+        on the decoded cart. ``segments`` holds one segment index per row
+        (-1 = global matrix) and ``customers`` one ``history`` row per cart
+        (-1 = no re-rank).
+        """
+        n, n_types = len(self.items), len(self.type_names)
+        B = len(codes)
+        rows_b = np.arange(B)[:, None]
+        known = codes >= 0
+        zero_row = self._zero_row
+        base = np.zeros((B, 1), dtype=np.int64) if segments is None else (np.asarray(segments)[:, None] + 1) * n
+        safe = np.where(known, base + codes, zero_row)
+        if self.pair_row is not None and codes.shape[1] >= 2:
+            # carts holding indexed pairs score their pair rows instead (combination order)
+            combos = list(combinations(range(codes.shape[1]), 2))
+            pidx = np.full((B, len(combos)), -1, dtype=np.int64)
+            for c, (a, b) in enumerate(combos):
+                both = known[:, a] & known[:, b]
+                pidx[both, c] = self.pair_row[codes[both, a], codes[both, b]]
+            use = (pidx >= 0).any(axis=1)
+            if use.any():
+                pair_base = n * (len(self.segments) + 1)
+                width = max(codes.shape[1], len(combos))
+                src = np.full((B, width), zero_row, dtype=np.int64)
+                src[:, :codes.shape[1]] = safe
+                src[use] = zero_row
+                src[use, :len(combos)] = np.where(pidx[use] >= 0, pair_base + pidx[use], zero_row)
+                safe = src
+        item_safe = np.where(known, codes, n)
+        type_pad = np.append(self.type_code, self._other)
+
+        cart_type = np.zeros((B, n_types), dtype=bool)
+        filled = codes != self.EMPTY
+        cart_type[np.broadcast_to(rows_b, codes.shape)[filled], type_pad[item_safe][filled]] = True
+        cart_has_spicy = (np.bitwise_or.reduce(np.append(self.tag_mask, 0)[item_safe], axis=1) & SPICY) != 0
+
+        excluded = np.broadcast_to(self.blacklist_mask(blacklist), (B, n)).copy()
+        excluded[np.broadcast_to(rows_b, codes.shape)[known], codes[known]] = True
+
+        # 1) boosted scores, slot by slot in cart order
+        missing = ~cart_type[:, self.type_code]
+        mult = np.where(missing, np.where(self.is_drink, boost_factor * 1.5, boost_factor), 1.0)
+        spicy_coef = np.where(self.spicy, np.where(cart_has_spicy[:, None], 0.1, 0.3), 0.0)
+        score = np.zeros((B, n))
+        width = safe.shape[1]
+        first_row = np.full((B, n), width, dtype=np.int64)
+        for k in range(width):
+            r = self._gather_rows(safe[:, k])
+            h = (r != 0) & ~excluded
+            c = r * h
+            score += c * mult + c * spicy_coef
+            first_row = np.where(h & (first_row == width), k, first_row)
+        if customers is not None and self.history is not None and (np.asarray(customers) >= 0).any():
+            score *= self.history.multiplier_rows(customers)
+        cand = first_row < width
+
+        # 2) sort each row, keep the first max_per_type per type, then top_n
+        ids = np.broadcast_to(np.arange(n), (B, n))
+        order = np.lexsort((ids, first_row, np.where(cand, -score, np.inf)), axis=-1)
+        s_cand = np.take_along_axis(cand, order, axis=1)
+        s_type = self.type_code[order]
+        accepted = np.zeros((B, n), dtype=bool)
+        for t in range(n_types):
+            of_t = s_cand & (s_type == t)
+            accepted |= of_t & (np.cumsum(of_t, axis=1) <= max_per_type)
+        pos = np.cumsum(accepted, axis=1)
+        sel = accepted & (pos <= top_n)
+
+        rec = np.full((B, top_n), -1, dtype=np.int64)
+        rec_score = np.zeros((B, top_n))
+        r_idx, c_idx = np.nonzero(sel)
+        slot = pos[r_idx, c_idx] - 1
+        rec[r_idx, slot] = order[r_idx, c_idx]
+        rec_score[r_idx, slot] = score[r_idx, order[r_idx, c_idx]]
+
+        # 3) fallback fill (like enhanced_recommend, a type's list may fill several slots)
+        n_have = sel.sum(axis=1)
+        used = np.zeros((B, n_types), dtype=np.int64)
+        np.add.at(used, (r_idx, self.type_code[order[r_idx, c_idx]]), 1)
+        taken = excluded
+        taken[r_idx, order[r_idx, c_idx]] = True
+        for t, fb in self.fallback:
+            if not len(fb):
+                continue
+            quota = np.where(used[:, t] >= max_per_type, 0, top_n - n_have)
+            valid = ~taken[:, fb]
+            fpos = np.cumsum(valid, axis=1)
+            pick = valid & (fpos <= quota[:, None])
+            pr, pc = np.nonzero(pick)
+            rec[pr, n_have[pr] + fpos[pr, pc] - 1] = fb[pc]
+            taken[pr, fb[pc]] = True
+            got = pick.sum(axis=1)
+            n_have += got
+            used[:, t] += got
+        return rec, rec_score
+
+    def _gather_rows(self, idx: np.ndarray) -> np.ndarray:
+        """float64 rows ``idx`` of the ``_row_blocks`` row space (``_zero_row`` gives zeros).
+
+        Each block is indexed where it lives, so the matrices are never
+        stacked into one private copy.
+        """
+        out = np.zeros((len(idx), len(self.items)))
+        lo = 0
+        for block in self._row_blocks:
+            hit = (idx >= lo) & (idx < lo + len(block))
+            if hit.any():
+                out[hit] = block[idx[hit] - lo]
+            lo += len(block)
+        return out
+
+    def _weights(self, cart_type: np.ndarray, cart_has_spicy: bool,
+                 boost_factor: float) -> tuple[np.ndarray, np.ndarray]:
+        """Per-candidate boost multiplier and spicy coefficient for one cart state."""
+        key = (cart_type.tobytes(), cart_has_spicy, boost_factor)
+        w = self._weight_cache.get(key)
+        if w is None:
+            missing = ~cart_type[self.type_code]
+            mult = np.where(missing, np.where(self.is_drink, boost_factor * 1.5, boost_factor), 1.0)
+            spicy_coef = np.where(self.spicy, 0.1 if cart_has_spicy else 0.3, 0.0)
+            w = self._weight_cache[key] = (mult, spicy_coef)
+        return w
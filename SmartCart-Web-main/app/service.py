@@ -0,0 +1,274 @@
+"""Standalone asyncio HTTP recommendation service (stdlib only).
+
+Run from the repo root::
+
+    python app/service.py --host 127.0.0.1 --port 8080 --watch 5
+
+Endpoints (JSON in, JSON out):
+  - ``POST /recommend``        ``{"items": [...], "top_n": 3, "boost_factor": 1.2, "max_per_type": 1,
+                                 "context": {"occasion": "ToGo", "channel": "Digital", "daypart": "weekend"},
+                                 "store": 49}``
+  - ``POST /recommend/batch``  ``{"carts": [[...], ...], ...same options}``
+  - ``POST /reload``           reload the artifact if its version changed
+  - ``GET  /health``           artifact version, micro-batch and store-model counters
+
+A ``store`` with its own model (see ``store_models``) is scored on it,
+without context; other stores use the global model.
+"""
+from __future__ import annotations
+import argparse, asyncio, json, os, warnings
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+import numpy as np
+
+from artifact_store import MODEL_DIR_NAME, load_model_artifact, model_dir
+from item_matcher import ItemMatcher
+from recommender import DEFAULT_BLACKLIST, SmartCartModel, normalize_user_items
+from store_models import StoreModelRegistry, store_key
+
+MAX_BATCH = 256
+MAX_WAIT_S = 0.002
+MAX_BODY = 8 * 1024 * 1024
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+@dataclass(frozen=True)
+class ServingState:
+    """Everything one request needs; replaced as a whole on reload."""
+    version: str
+    model: SmartCartModel
+    matcher: ItemMatcher
+    known_items_lower: List[str]
+    lower_to_orig: dict
+    stores: Optional[StoreModelRegistry] = None
+
+    @classmethod
+    def load(cls, name: str = MODEL_DIR_NAME) -> Optional["ServingState"]:
+        art = load_model_artifact(name)
+        if art is None:
+            return None
+        model = SmartCartModel.from_artifact(art)
+        return cls(art["version"], model, art["matcher"], art["known_items_lower"], art["lower_to_orig"],
+                   StoreModelRegistry.open(art, model))
+
+    def score(self, carts: List[List[str]], top_n: int, boost_factor: float,
+              max_per_type: int, blacklist: set[str], context: tuple = (),
+              store: Optional[str] = None) -> List[List[Tuple[str, float]]]:
+        """``enhanced_recommend`` semantics for many raw carts in one array pass."""
+        if store is not None and self.stores is None:
+            warnings.warn(f"version {self.version} has no store build; store {store} uses the global model",
+                          RuntimeWarning, stacklevel=2)
+        m = self.model if self.stores is None or store is None else self.stores.model_for(store)
+        mapped = [normalize_user_items(c, self.known_items_lower, self.lower_to_orig, matcher=self.matcher)
+                  for c in carts]
+        width = max((len(c) for c in mapped), default=0) or 1
+        codes = np.full((len(mapped), width), m.EMPTY, dtype=np.int64)
+        for r, cart in enumerate(mapped):
+            codes[r, :len(cart)] = [m.item_id.get(x, m.UNKNOWN) for x in cart]
+        uniq, inverse = np.unique(codes, axis=0, return_inverse=True)
+        seg = m.segment_for(dict(context))
+        rec, sc = m.recommend_batch(uniq, blacklist, top_n=top_n, boost_factor=boost_factor,
+                                    max_per_type=max_per_type,
+                                    segments=None if seg is None else np.full(len(uniq), seg))
+        out = [[(m.items[i], round(float(s), 4)) for i, s in zip(rec[u], sc[u]) if i >= 0] for u in range(len(uniq))]
+        return [out[u] for u in inverse.reshape(-1)]
+
+_DEFAULT_BLACKLIST = frozenset(DEFAULT_BLACKLIST)
+
+def parse_options(body: dict) -> tuple:
+    """Hashable (top_n, boost_factor, max_per_type, blacklist, context, store); batches group on it."""
+    blacklist = body.get("blacklist")
+    context = body.get("context") or {}
+    if not isinstance(context, dict):
+        raise ValueError("context must be an object")
+    return (int(body.get("top_n", 3)), float(body.get("boost_factor", 1.2)), int(body.get("max_per_type", 1)),
+            _DEFAULT_BLACKLIST if blacklist is None else frozenset(blacklist),
+            tuple(sorted((str(k), str(v)) for k, v in context.items())), store_key(body.get("store")))
+
+def parse_cart(items) -> List[str]:
+    if not isinstance(items, list):
+        raise ValueError("cart must be a list of item names")
+    return [x for x in items if isinstance(x, str)]
+
+class RecommendationService:
+    """Holds the current ``ServingState`` and micro-batches single-cart requests.
+
+    Concurrent ``/recommend`` calls are queued and scored together once
+    ``max_batch`` requests are waiting or ``max_wait`` seconds have passed.
+    A batch keeps the state it started with, so ``reload`` can swap the
+    state reference at any time without dropping requests.
+    """
+
+    def __init__(self, name: str = MODEL_DIR_NAME, max_batch: int = MAX_BATCH, max_wait: float = MAX_WAIT_S):
+        self.name = name
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.state: Optional[ServingState] = ServingState.load(name)
+        self.queue: Optional[asyncio.Queue] = None
+        self.batches = self.batched_requests = self.reloads = 0
+        self._reload_lock: Optional[asyncio.Lock] = None
+
+    def _meta_path(self) -> str:
+        return os.path.join(model_dir(self.name), "meta.json")  # follows the ``current`` pointer
+
+    async def reload(self) -> bool:
+        """Load the artifact off the event loop and swap it in if its version changed."""
+        async with self._reload_lock:
+            new = await asyncio.to_thread(ServingState.load, self.name)
+            if new is None or (self.state is not None and new.version == self.state.version):
+                return False
+            self.state = new  # single reference assignment: in-flight batches keep the old state
+            self.reloads += 1
+            return True
+
+    async def watch(self, interval: float) -> None:
+        """Poll the published artifact's ``meta.json`` and hot-reload when it changes."""
+        last = None
+        while True:
+            try:
+                mtime = os.stat(self._meta_path()).st_mtime_ns
+            except FileNotFoundError:
+                mtime = None
+            if mtime is not None and mtime != last:
+                last = mtime
+                await self.reload()
+            await asyncio.sleep(interval)
+
+    async def recommend(self, cart: List[str], options: tuple) -> dict:
+        fut = asyncio.get_running_loop().create_future()
+        await self.queue.put((cart, options, fut))
+        return await fut
+
+    async def run_batcher(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            state = self.state
+            self.batches += 1
+            self.batched_requests += len(batch)
+            groups = {}
+            for cart, options, fut in batch:
+                groups.setdefault(options, []).append((cart, fut))
+            for options, reqs in groups.items():
+                try:
+                    results = await asyncio.to_thread(state.score, [c for c, _ in reqs], *options)
+                except Exception as e:  # surface to every waiter instead of killing the batcher
+                    for _, fut in reqs:
+                        if not fut.done():
+                            fut.set_exception(e)
+                    continue
+                for (_, fut), recs in zip(reqs, results):
+                    if not fut.done():
+                        fut.set_result(self._payload(state, recs))
+
+    @staticmethod
+    def _payload(state: ServingState, recs: List[Tuple[str, float]]) -> dict:
+        return {"recommendations": [{"item": it, "score": sc} for it, sc in recs], "version": state.version}
+
+    async def route(self, method: str, path: str, body: bytes) -> tuple[int, dict]:
+        if path == "/health":
+            return 200, {"status": "ok" if self.state else "no-artifact",
+                         "version": self.state.version if self.state else None,
+                         "batches": self.batches, "batched_requests": self.batched_requests,
+                         "reloads": self.reloads,
+                         "stores": self.state.stores.stats() if self.state and self.state.stores else None}
+        if method != "POST":
+            return 405, {"error": "use POST"}
+        if path == "/reload":
+            return 200, {"reloaded": await self.reload(), "version": self.state.version if self.state else None}
+        if path not in ("/recommend", "/recommend/batch"):
+            return 404, {"error": f"unknown path {path}"}
+        if self.state is None:
+            return 503, {"error": "no artifact; build the model first"}
+        try:
+            req = json.loads(body or b"{}")
+            options = parse_options(req)
+            if path == "/recommend":
+                return 200, await self.recommend(parse_cart(req.get("items", [])), options)
+            state = self.state
+            carts = [parse_cart(c) for c in req.get("carts", [])]
+            results = await asyncio.to_thread(state.score, carts, *options) if carts else []
+            return 200, {"results": [self._payload(state, r)["recommendations"] for r in results],
+                         "version": state.version}
+        except (ValueError, TypeError, KeyError, AttributeError) as e:
+            return 400, {"error": str(e)}
+        except Exception as e:  # a scoring bug must not drop the connection
+            return 500, {"error": f"{type(e).__name__}: {e}"}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Minimal HTTP/1.1 with keep-alive and Content-Length bodies."""
+        try:
+            while True:
+                line = await reader.readline()
+                if not line.strip():
+                    break
+                method, target, version = line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    h = await reader.readline()
+                    if h in (b"\r\n", b"\n", b""):
+                        break
+                    k, _, v = h.decode("latin-1").partition(":")
+                    headers[k.strip().lower()] = v.strip()
+                length = int(headers.get("content-length") or 0)
+                if length > MAX_BODY:
+                    status, payload = 413, {"error": "body too large"}
+                    keep_alive = False
+                else:
+                    body = await reader.readexactly(length)
+                    status, payload = await self.route(method.upper(), target.split("?")[0], body)
+                    keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                data = json.dumps(payload).encode()
+                writer.write(
+                    f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\nContent-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\nConnection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+                    .encode("latin-1") + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8080, watch: float = 0.0) -> None:
+        self.queue = asyncio.Queue()
+        self._reload_lock = asyncio.Lock()
+        tasks = [asyncio.create_task(self.run_batcher())]
+        if watch > 0:
+            tasks.append(asyncio.create_task(self.watch(watch)))
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"SmartCart service on http://{host}:{port} (artifact {self.state.version if self.state else 'missing'})")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for t in tasks:
+                t.cancel()
+
+def main(argv=None) -> None:
+    ap = argparse.ArgumentParser(description="SmartCart recommendation HTTP service")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8080)
+    ap.add_argument("--artifact", default=MODEL_DIR_NAME, help="artifact directory name under artifacts/")
+    ap.add_argument("--watch", type=float, default=0.0, help="poll the artifact every N seconds and hot-reload")
+    ap.add_argument("--max-batch", type=int, default=MAX_BATCH)
+    ap.add_argument("--max-wait-ms", type=float, default=MAX_WAIT_S * 1000)
+    args = ap.parse_args(argv)
+    svc = RecommendationService(args.artifact, max_batch=args.max_batch, max_wait=args.max_wait_ms / 1000)
+    try:
+        asyncio.run(svc.serve(args.host, args.port, watch=args.watch))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
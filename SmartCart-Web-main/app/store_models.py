@@ -0,0 +1,406 @@
+"""Per-store (or per-region) co-occurrence models next to the global one.
+
+``build_store_models`` streams ``STORE_NUMBER`` / ``ORDERS`` once and counts
+every partition in the same pass (sparse pair keys, so thousands of stores
+cost no more memory than their distinct pairs). Layout of
+``artifacts/stores/versions/<key>/``, ``key`` being the global build key:
+
+  - ``co/<p>.npy``  dense ``n x n`` float32 P(j|i) of partition ``p``, written
+                    only for partitions with at least ``min_orders`` orders
+  - ``freq.npy``    ``P x n`` item counts per partition (its ``top_by_type``)
+  - ``first.npy``   ``P x n`` first position of each item (ties in ``top_by_type``)
+  - ``counts.npz``  orders-per-item and pair counts per partition, so
+                    ``update_store_models`` can add new orders
+  - ``meta.json``   global vocabulary, partition level and keys, orders per
+                    partition, the modelled partitions and, for a region
+                    level, the store -> region map
+
+``StoreModelRegistry`` memory-maps a partition's matrix on its first request,
+keeps at most ``capacity`` compiled models in an LRU and answers with the
+global model for unknown stores and stores under ``min_orders``.
+
+A full build counts the partitions in its sharded order pass instead: the
+``StoreCounts`` of ``store_tally`` is a ``stream_order_counts`` tally, and
+the merged one is ``regrown`` to the artifact items and written.
+"""
+from __future__ import annotations
+import json, os, shutil, threading, uuid, warnings
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional
+import numpy as np
+import pandas as pd
+
+from artifact_store import FORMAT_VERSION, VERSIONS_DIR, find_version, publish_version, version_dir
+from data_loader import (
+    ART_DIR, ORDER_CHUNK, OrderParser, ParsedOrders, count_partition_pairs, csv_paths, ensure_dirs,
+    iter_order_chunks, parse_orders, rank_items_by_type
+)
+from instrument import stage
+from recommender import SmartCartModel
+
+STORE_DIR_NAME = "stores"
+STORE_COLUMN = "STORE_NUMBER"
+# orders a partition needs for its own model; smaller ones use the global model
+STORE_MIN_ORDERS = 1_000
+# count state saved with a store build (what update_store_models folds new orders into)
+COUNTS_FILE = "counts.npz"
+# compiled store models kept loaded per registry (each maps its n x n float32 co file)
+STORE_CACHE = 256
+
+def store_key(value) -> Optional[str]:
+    """Canonical store number: ``49``, ``"49"`` and ``49.0`` are one store; None if missing."""
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    s = str(value).strip()
+    if s.endswith(".0") and s[:-2].isdigit():
+        s = s[:-2]
+    return s or None
+
+def store_regions(level: str, path: Optional[str] = None) -> Optional[Dict[str, str]]:
+    """Store -> ``level`` value from ``store_data.csv`` (None for per-store partitions)."""
+    if level == STORE_COLUMN:
+        return None
+    path = path or csv_paths()["store"]
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Missing required CSV: {path}")
+    if level not in pd.read_csv(path, nrows=0).columns:
+        raise ValueError(f"{path} has no column {level!r}")
+    df = pd.read_csv(path, usecols=[STORE_COLUMN, level], dtype=str).dropna()
+    return {store_key(s): r for s, r in zip(df[STORE_COLUMN], df[level]) if store_key(s)}
+
+def partition_keys(stores: Iterable, regions: Optional[Dict[str, str]]) -> list:
+    """Partition key of each store value (None when the store or its region is unknown)."""
+    keys = [store_key(s) for s in stores]
+    return keys if regions is None else [regions.get(k) for k in keys]
+
+def _grow(arr: np.ndarray, rows: int, fill: int) -> np.ndarray:
+    if rows <= len(arr):
+        return arr
+    return np.vstack([arr, np.full((rows - len(arr), arr.shape[1]), fill, dtype=arr.dtype)])
+
+@dataclass
+class StoreCounts:
+    """Per-partition counts of a run of orders over the global vocabulary ``items``.
+
+    ``part_id`` numbers partition keys in order of first appearance;
+    ``orders``, ``freq``, ``item_orders`` and ``first`` have one row per
+    partition and ``pair_keys`` / ``pair_counts`` hold the sorted
+    ``(p * n + i) * n + j`` pair codes. ``seen`` is the occurrence offset
+    the next order starts at. A store build saves this state so
+    ``update_store_models`` can add new orders without a recount.
+    """
+    columns = (STORE_COLUMN, "ORDERS")
+
+    items: List[str]
+    level: str
+    regions: Optional[Dict[str, str]]
+    part_id: Dict[str, int]
+    orders: np.ndarray
+    freq: np.ndarray
+    item_orders: np.ndarray
+    first: np.ndarray
+    pair_keys: np.ndarray
+    pair_counts: np.ndarray
+    seen: int = 0
+
+    @classmethod
+    def empty(cls, items: List[str], level: str = STORE_COLUMN,
+              regions: Optional[Dict[str, str]] = None) -> "StoreCounts":
+        n = len(items)
+        return cls(list(items), level, regions, {}, np.zeros(0, dtype=np.int64), np.zeros((0, n), dtype=np.int64),
+                   np.zeros((0, n), dtype=np.int64), np.zeros((0, n), dtype=np.int64),
+                   np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+
+    def add(self, stores: pd.Series, parsed: ParsedOrders) -> None:
+        """Count the orders of ``parsed`` (store values ``stores``, in the same order)."""
+        n = len(self.items)
+        item_id = {it: i for i, it in enumerate(self.items)}
+        codes, uniques = pd.factorize(stores)
+        lut = np.array([-1 if k is None else self.part_id.setdefault(k, len(self.part_id))
+                        for k in partition_keys(uniques, self.regions)] + [-1], dtype=np.int64)
+        part = lut[codes]  # factorize codes missing values as -1, the lut's last slot
+        P = len(self.part_id)
+        self.orders = np.concatenate([self.orders, np.zeros(P - len(self.orders), dtype=np.int64)])
+        self.orders += np.bincount(part[part >= 0], minlength=P)
+        self.freq, self.item_orders = _grow(self.freq, P, 0), _grow(self.item_orders, P, 0)
+        self.first = _grow(self.first, P, np.iinfo(np.int64).max)
+
+        o, it = parsed.encode(item_id, distinct=False)
+        p = part[o]
+        pos = self.seen + np.flatnonzero(p >= 0)
+        self.seen += len(o)
+        flat = p[p >= 0] * n + it[p >= 0]
+        uniq, idx, cnt = np.unique(flat, return_index=True, return_counts=True)
+        self.freq.reshape(-1)[uniq] += cnt
+        self.first.reshape(-1)[uniq] = np.minimum(self.first.reshape(-1)[uniq], pos[idx])
+
+        o, it = parsed.encode(item_id)
+        p = part[o]
+        uniq, cnt = np.unique(p[p >= 0] * n + it[p >= 0], return_counts=True)
+        self.item_orders.reshape(-1)[uniq] += cnt
+        k, c = count_partition_pairs(o, it, part, n)
+        self.pair_keys, inv = np.unique(np.concatenate([self.pair_keys, k]), return_inverse=True)
+        self.pair_counts = np.bincount(inv.reshape(-1), weights=np.concatenate([self.pair_counts, c]),
+                                       minlength=len(self.pair_keys)).astype(np.int64)
+
+    def count(self, chunk: pd.DataFrame, parsed: ParsedOrders) -> "StoreCounts":
+        """The counts of one parsed chunk over its own (sorted) vocabulary."""
+        part = StoreCounts.empty(sorted(parsed.items), self.level, self.regions)
+        part.add(chunk[STORE_COLUMN], parsed)
+        return part
+
+    def merge(self, later: "StoreCounts") -> "StoreCounts":
+        """Combine with the counts of the orders that directly follow these."""
+        items = sorted(set(self.items) | set(later.items))
+        a, b = self.regrown(items), later.regrown(items)
+        part_id = dict(a.part_id)
+        for k in b.part_id:
+            part_id.setdefault(k, len(part_id))
+        remap = np.array(list(map(part_id.get, b.part_id)), dtype=np.int64)
+        P, m, top = len(part_id), max(len(items), 1), np.iinfo(np.int64).max
+        orders = np.zeros(P, dtype=np.int64)
+        orders[:len(a.orders)] = a.orders
+        orders[remap] += b.orders
+        freq, item_orders, first = _grow(a.freq, P, 0), _grow(a.item_orders, P, 0), _grow(a.first, P, top)
+        freq[remap] += b.freq
+        item_orders[remap] += b.item_orders
+        first[remap] = np.minimum(first[remap], np.where(b.first == top, top, b.first + a.seen))
+        bp, rest = np.divmod(b.pair_keys, m * m)
+        keys, inv = np.unique(np.concatenate([a.pair_keys, remap[bp] * m * m + rest]), return_inverse=True)
+        counts = np.bincount(inv.reshape(-1), weights=np.concatenate([a.pair_counts, b.pair_counts]),
+                             minlength=len(keys)).astype(np.int64)
+        return StoreCounts(items, self.level, self.regions, part_id, orders, freq, item_orders, first,
+                           keys, counts, a.seen + b.seen)
+
+    def regrown(self, items: List[str]) -> "StoreCounts":
+        """The same counts over ``items``, a sorted superset of ``self.items`` (new items count zero)."""
+        pos = {it: i for i, it in enumerate(items)}
+        idx = np.array([pos[it] for it in self.items], dtype=np.int64)
+        n, m = max(len(self.items), 1), len(items)
+        def cols(a: np.ndarray, fill: int) -> np.ndarray:
+            out = np.full((len(a), m), fill, dtype=a.dtype)
+            out[:, idx] = a
+            return out
+        pp, rest = np.divmod(self.pair_keys, n * n)
+        i, j = np.divmod(rest, n)
+        # idx is increasing, so the re-coded keys stay sorted
+        keys = (pp * m + idx[i]) * m + idx[j]
+        return StoreCounts(list(items), self.level, self.regions, dict(self.part_id), self.orders.copy(),
+                           cols(self.freq, 0), cols(self.item_orders, 0), cols(self.first, np.iinfo(np.int64).max),
+                           keys, self.pair_counts.copy(), self.seen)
+
+    def write(self, key: str, min_orders: int = STORE_MIN_ORDERS, name: str = STORE_DIR_NAME,
+              publish: bool = False) -> str:
+        """Write the models of every partition with ``min_orders`` orders as version ``key``."""
+        n = len(self.items)
+        ensure_dirs()
+        out_dir = os.path.join(ART_DIR, name, VERSIONS_DIR, f".staging-{os.getpid()}-{uuid.uuid4().hex[:8]}")
+        os.makedirs(os.path.join(out_dir, "co"))
+        models = [p for p in range(len(self.part_id)) if self.orders[p] >= min_orders]
+        with stage("save_artifact", rows=len(models)):
+            pp, rest = np.divmod(self.pair_keys, max(n, 1) ** 2)
+            i, j = np.divmod(rest, max(n, 1))
+            bounds = np.searchsorted(pp, np.arange(len(self.part_id) + 1))
+            for p in models:
+                lo, hi = bounds[p], bounds[p + 1]
+                co = np.zeros((n, n), dtype=np.float32)
+                co[i[lo:hi], j[lo:hi]] = self.pair_counts[lo:hi] / np.maximum(self.item_orders[p, i[lo:hi]], 1)
+                np.save(os.path.join(out_dir, "co", f"{p}.npy"), co)
+            np.save(os.path.join(out_dir, "freq.npy"), self.freq)
+            np.save(os.path.join(out_dir, "first.npy"), self.first)
+            np.savez(os.path.join(out_dir, COUNTS_FILE), item_orders=self.item_orders,
+                     pair_keys=self.pair_keys, pair_counts=self.pair_counts)
+            meta = {"format": FORMAT_VERSION, "key": key, "items": list(self.items), "level": self.level,
+                    "min_orders": min_orders, "partitions": list(self.part_id), "orders": self.orders.tolist(),
+                    "models": models, "stores": self.regions, "seen": self.seen}
+            with open(os.path.join(out_dir, "meta.json"), "w") as f:
+                json.dump(meta, f)
+        final = version_dir(key, name)
+        if find_version(key, name) is None:
+            try:
+                os.replace(out_dir, final)
+            except OSError:  # a concurrent identical build got there first
+                shutil.rmtree(out_dir, ignore_errors=True)
+        else:
+            shutil.rmtree(out_dir, ignore_errors=True)
+        if publish:
+            publish_version(key, name)
+        return final
+
+def load_store_counts(directory: str) -> Optional[StoreCounts]:
+    """The count state saved with a store build (None for builds that predate it)."""
+    path = os.path.join(directory, COUNTS_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(os.path.join(directory, "meta.json")) as f:
+        meta = json.load(f)
+    with np.load(path) as z:
+        return StoreCounts(meta["items"], meta["level"], meta["stores"],
+                           {k: p for p, k in enumerate(meta["partitions"])},
+                           np.asarray(meta["orders"], dtype=np.int64),
+                           np.load(os.path.join(directory, "freq.npy")), z["item_orders"],
+                           np.load(os.path.join(directory, "first.npy")), z["pair_keys"], z["pair_counts"],
+                           meta["seen"])
+
+def store_tally(path: Optional[str] = None, level: str = STORE_COLUMN, items: Iterable[str] = ()) -> StoreCounts:
+    """Empty ``level`` partition counts over ``items`` for the order CSV ``path`` (checked for a store column)."""
+    path = path or csv_paths()["order"]
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Missing required CSV: {path}")
+    if STORE_COLUMN not in pd.read_csv(path, nrows=0).columns:
+        raise ValueError(f"{path} has no {STORE_COLUMN} column")
+    return StoreCounts.empty(list(items), level, store_regions(level))
+
+@stage("store_models")
+def build_store_models(items: List[str], key: str, path: Optional[str] = None, level: str = STORE_COLUMN,
+                       min_orders: int = STORE_MIN_ORDERS, chunksize: int = ORDER_CHUNK,
+                       name: str = STORE_DIR_NAME, publish: bool = False) -> str:
+    """Count all partitions of the order CSV in one pass and write their models.
+
+    ``items`` is the global artifact's vocabulary (other names are dropped)
+    and ``key`` its build key, so ``StoreModelRegistry.open`` finds the
+    store build of a loaded model. ``level`` is ``STORE_NUMBER`` or a column
+    of ``store_data.csv`` (e.g. ``STATE``) to pool stores by. Returns the
+    version directory.
+    """
+    path = path or csv_paths()["order"]
+    counts, parser = store_tally(path, level, items), OrderParser()
+    for chunk in iter_order_chunks(path, chunksize, StoreCounts.columns):
+        parsed = parser.parse(chunk["ORDERS"])
+        with stage("pair_counting", rows=len(chunk)):
+            counts.add(chunk[STORE_COLUMN], parsed)
+    return counts.write(key, min_orders, name, publish)
+
+def update_store_models(prev_key: Optional[str], key: str, items: List[str], new_orders_df: pd.DataFrame,
+                        name: str = STORE_DIR_NAME, publish: bool = True) -> Optional[str]:
+    """Carry the store build of ``prev_key`` forward to ``key`` with the orders of ``new_orders_df``.
+
+    Called by ``update_artifacts``: the saved counts are re-indexed to the
+    grown vocabulary ``items`` and the delta (``ORDERS`` or ``ITEM_LIST`` and
+    ``STORE_NUMBER``) is added, so the result equals a store build over
+    history + delta. Returns the new version directory, or None (with a
+    warning when a store build exists but cannot be carried forward).
+    """
+    d = find_version(prev_key, name) if prev_key else None
+    if d is None:
+        return None
+    counts = load_store_counts(d)
+    if counts is None or STORE_COLUMN not in new_orders_df:
+        why = "has no saved counts" if counts is None else f"the new orders have no {STORE_COLUMN} column"
+        warnings.warn(f"store build {prev_key} not carried forward to {key}: {why}; "
+                      "store requests will use the global model", RuntimeWarning, stacklevel=2)
+        return None
+    with open(os.path.join(d, "meta.json")) as f:
+        min_orders = json.load(f)["min_orders"]
+    counts = counts.regrown(items)
+    with stage("pair_counting", rows=len(new_orders_df)):
+        counts.add(new_orders_df[STORE_COLUMN], parse_orders(new_orders_df))
+    return counts.write(key, min_orders, name, publish)
+
+def store_version(art: dict, name: str = STORE_DIR_NAME) -> Optional[str]:
+    """Directory of the store build for ``art``'s build key, or None (legacy artifacts or no store build)."""
+    arrs = art.get("arrays")
+    key = arrs.get("key") if arrs else None
+    return find_version(key, name) if key else None
+
+class StoreModelRegistry:
+    """Lazily loaded per-partition ``SmartCartModel``s of one global artifact.
+
+    ``model(p)`` memory-maps ``co/<p>.npy`` and compiles it on first use;
+    at most ``capacity`` models stay loaded, least recently used evicted
+    first. Store models share the global catalog and customer history and
+    carry no context segments or pair index. Safe to share across threads.
+    """
+
+    def __init__(self, art: dict, directory: str, model: Optional[SmartCartModel] = None,
+                 capacity: int = STORE_CACHE):
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+        self.art = art
+        self.dir = directory
+        self.global_model = model or SmartCartModel.from_artifact(art)
+        self.items: List[str] = meta["items"]
+        self.level: str = meta["level"]
+        self.min_orders: int = meta["min_orders"]
+        self.partitions: List[str] = meta["partitions"]
+        self.orders = np.asarray(meta["orders"], dtype=np.int64)
+        self.regions: Optional[Dict[str, str]] = meta["stores"]
+        modelled = np.zeros(len(self.partitions), dtype=bool)
+        modelled[meta["models"]] = True
+        # partition key -> model index, only for partitions with their own model
+        self.part_id = {k: p for p, k in enumerate(self.partitions) if modelled[p]}
+        self.freq = np.load(os.path.join(directory, "freq.npy"), mmap_mode="r")
+        self.first = np.load(os.path.join(directory, "first.npy"), mmap_mode="r")
+        self.capacity = capacity
+        self.models: OrderedDict[int, SmartCartModel] = OrderedDict()
+        self.hits = self.loads = self.evictions = self.fallbacks = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def open(cls, art: dict, model: Optional[SmartCartModel] = None, capacity: int = STORE_CACHE,
+             name: str = STORE_DIR_NAME) -> Optional["StoreModelRegistry"]:
+        """The registry of ``art``'s store build, or None when there is none (see ``store_version``)."""
+        d = store_version(art, name)
+        if d is None:
+            return None
+        reg = cls(art, d, model, capacity)
+        return reg if reg.items == list(art["arrays"]["items"]) else None
+
+    def __len__(self) -> int:
+        return len(self.part_id)
+
+    def partition(self, store) -> int:
+        """Model index serving ``store`` (-1 = the global model)."""
+        k = store_key(store)
+        if k is not None and self.regions is not None:
+            k = self.regions.get(k)
+        return self.part_id.get(k, -1)
+
+    def partition_codes(self, df) -> np.ndarray:
+        """Per-row model index (-1 = global) from the ``STORE_NUMBER`` column of ``df``."""
+        if STORE_COLUMN not in df:
+            return np.full(len(df), -1, dtype=np.int64)
+        codes, uniques = pd.factorize(df[STORE_COLUMN])
+        lut = np.array([self.partition(s) for s in uniques] + [-1], dtype=np.int64)
+        return lut[codes]
+
+    def top_by_type(self, p: int) -> dict:
+        """``build_items_and_tags``-style top items per type over partition ``p``'s orders."""
+        freq, first = np.asarray(self.freq[p]), np.asarray(self.first[p])
+        seen = np.flatnonzero(freq)
+        by_first = seen[np.argsort(first[seen], kind="stable")].tolist()
+        return rank_items_by_type([(self.items[i], int(freq[i])) for i in by_first], self.art["item_type"])
+
+    def model(self, p: int) -> SmartCartModel:
+        """Compiled model of partition ``p``, loading it (and evicting the LRU one) if needed."""
+        if p < 0:
+            return self.global_model
+        with self._lock:
+            m = self.models.get(p)
+            if m is not None:
+                self.hits += 1
+                self.models.move_to_end(p)
+                return m
+            co = np.load(os.path.join(self.dir, "co", f"{p}.npy"), mmap_mode="r")
+            g = self.global_model
+            m = SmartCartModel(self.items, co, self.art["item_type"], self.art["item_feat"], self.top_by_type(p),
+                               history=g.history, catalog=g.catalog)
+            self.loads += 1
+            self.models[p] = m
+            if len(self.models) > self.capacity:
+                self.models.popitem(last=False)
+                self.evictions += 1
+            return m
+
+    def model_for(self, store) -> SmartCartModel:
+        """Model of ``store``'s partition, or the global model when it has none."""
+        p = self.partition(store)
+        if p < 0:
+            self.fallbacks += 1
+        return self.model(p)
+
+    def stats(self) -> Dict[str, int]:
+        return {"partitions": len(self.partitions), "models": len(self.part_id), "loaded": len(self.models),
+                "capacity": self.capacity, "hits": self.hits, "loads": self.loads,
+                "evictions": self.evictions, "fallbacks": self.fallbacks}
@@ -1,25 +1,20 @@
-import os
-import pickle
-import math
+import os, time
 import streamlit as st
-import pandas as pd
-import numpy as np
-from collections import Counter, defaultdict
+from collections import Counter
 from typing import Optional
 
-from data_loader import (
-    ensure_dirs, load_csvs, build_items_and_tags, build_normalized_comatrix,
-    save_artifact, load_artifact
-)
-from recommender import enhanced_recommend, batch_predict, normalize_user_items
+# Only stdlib-backed modules at import time; pandas/numpy and the model code
+# load on the pages that use them, so the start page renders immediately.
+from paths import ART_DIR
+from data_cache import row_counts, build_data_cache, load_columns
+import instrument
+import build_jobs
 from ui_components import (
     icon_for_item, TYPE_EMOJI, chip, card, header, topbar_badges, reco_card
 )
 
 APP_DIR = os.path.dirname(__file__)
 BASE_DIR = os.path.dirname(APP_DIR)
-DATA_DIR = os.path.join(BASE_DIR, "data")
-ART_DIR = os.path.join(BASE_DIR, "artifacts")
 
 st.set_page_config(
     page_title="SmartCart Web — Menu Recommender",
@@ -87,22 +82,37 @@ page = st.sidebar.radio("Navigate", [
     "ℹ️ About"
 ])
 
-@st.cache_data(show_spinner=False)
-def load_all_csvs():
-    return load_csvs()
-
-@st.cache_data(show_spinner=True)
-def prepare_artifacts(sample_n: Optional[int]):
-    dfs = load_all_csvs()
-    order = dfs["order"].copy()
-
-    # Parse & clean items
-    from data_loader import extract_item_names, clean_item_list
-    order["ITEM_LIST"] = order["ORDERS"].apply(extract_item_names).apply(clean_item_list)
+def build_artifact(sample_n: Optional[int], key: str) -> str:
+    """Run the build for ``sample_n`` and write it (unpublished) as version ``key``.
 
-    # Build artifacts (same logic as before)
-    item_type, item_feat, top_by_type, all_items = build_items_and_tags(order)
-    co_norm = build_normalized_comatrix(order, sample_n=sample_n)
+    A full build also writes the store build of ``key``.
+    """
+    from data_loader import (build_items_and_tags, build_normalized_comatrix, parse_orders, stream_order_counts,
+                             items_and_tags_from_counts, comatrix_from_counts)
+    from artifact_store import save_model_artifact
+    from customer_history import CustomerCounts, guest_ids
+    from store_models import store_tally
+    if sample_n is None:
+        # Full build: stream the order file in chunks across all cores,
+        # counting occasion/channel/daypart segments, per-customer purchase
+        # history and per-store partitions from the same parse
+        build_jobs.step("Counting orders")
+        counts = stream_order_counts(segments=True, pair_context=True,
+                                     tallies={"customers": CustomerCounts(guest_ids()), "stores": store_tally()})
+        item_type, item_feat, top_by_type, all_items = items_and_tags_from_counts(counts)
+        co_norm = comatrix_from_counts(counts)
+        customers = counts.extras["customers"].history(all_items)
+    else:
+        counts, customers = None, None
+        build_jobs.step("Parsing sampled orders")
+        order = load_columns("order", ["ORDERS"])
+
+        # Parse & clean items once into flat (order, item ID) arrays
+        parsed = parse_orders(order)
+
+        # Build artifacts (same logic as before)
+        item_type, item_feat, top_by_type, all_items = build_items_and_tags(parsed)
+        co_norm = build_normalized_comatrix(parsed, sample_n=sample_n)
 
     known_lower = {itm.lower(): itm for itm in all_items}
     known_items_lower = list(known_lower.keys())
@@ -115,12 +125,76 @@ def prepare_artifacts(sample_n: Optional[int]):
         "known_items_lower": known_items_lower,
         "lower_to_orig": known_lower
     }
-    save_artifact("artifacts.pkl", art)
-    return art
+    build_jobs.step("Saving artifact")
+    out = save_model_artifact(art, counts=counts, key=key, publish=False, customers=customers)
+    if counts is not None:
+        build_jobs.step("Building store models")
+        with instrument.stage("store_models"):
+            counts.extras["stores"].regrown(all_items).write(key)
+    return out
+
+def prepare_artifacts(sample_n: Optional[int], precompute: bool = False):
+    """Build the artifact unless an identical one exists, then publish it.
+
+    Returns ``(version_dir, reused)``. The build key covers the order CSV
+    fingerprint, ``sample_n`` and the build code, so an edited CSV rebuilds
+    and an unchanged one is reused from disk.
+    """
+    from artifact_store import build_key, find_version, publish_version, load_model_artifact, open_model_artifact
+    from reco_cache import precompute_recommendations
+    from recommender import SmartCartModel
+    from store_models import STORE_DIR_NAME, build_store_models
+    full = sample_n is None
+    key = build_key(sample_n, segments=full, pair_context=full, customers=full)
+    out_dir = find_version(key)
+    reused = out_dir is not None
+    if not reused:
+        out_dir = build_artifact(sample_n, key)
+    if full and find_version(key, STORE_DIR_NAME) is None:
+        # a reused artifact without its store build: one pass for every store's own model
+        build_jobs.step("Building store models")
+        build_store_models(open_model_artifact(version=key)["items"], key)
+    if precompute and not os.path.exists(os.path.join(out_dir, "precomputed.json")):
+        # score every 1-, 2- and 3-item cart once so the Menu page only does lookups
+        build_jobs.step("Precomputing carts")
+        loaded = load_model_artifact(version=key)
+        precompute_recommendations(SmartCartModel.from_artifact(loaded), out_dir, loaded["version"])
+    build_jobs.step("Publishing")
+    publish_version(key)
+    if full:
+        publish_version(key, STORE_DIR_NAME)
+    return out_dir, reused
+
+def run_build(sample_n: Optional[int], precompute: bool):
+    """Background job body: build/publish, then export this build's stage timings."""
+    out = prepare_artifacts(sample_n, precompute)
+    instrument.export_json()  # shown on the Metrics page
+    return out
+
+@st.cache_resource(show_spinner=False)
+def get_reco_cache(version: str, _art: dict) -> "RecommendationCache":
+    """One cart-level cache per artifact version, shared across sessions."""
+    from reco_cache import RecommendationCache
+    return RecommendationCache.from_artifact(_art)
+
+@st.cache_resource(show_spinner=False)
+def get_store_models(version: str, _art: dict):
+    """Per-store model registry of an artifact version (None without a full build)."""
+    from store_models import StoreModelRegistry
+    return StoreModelRegistry.open(_art, get_reco_cache(version, _art).model)
+
+@st.cache_resource(show_spinner=False, max_entries=2)
+def get_artifact(version: Optional[str]) -> Optional[dict]:
+    """The artifact of one published version, loaded once and shared across sessions and reruns."""
+    from artifact_store import load_model_artifact
+    return load_model_artifact(version=version)
 
 def load_or_build_artifacts():
-    art = load_artifact("artifacts.pkl")
+    from artifact_store import current_key
+    # keyed on the current pointer, so a newly published build is picked up on the next rerun
+    art = get_artifact(current_key())
     if art is None:
+        get_artifact.clear()  # retry the load once a build exists
         st.warning("Artifacts not found. Go to **Build Model (first run)**.")
         return None
     return art
@@ -128,19 +202,23 @@ def load_or_build_artifacts():
 def start_page():
     st.markdown("<div class='dark-header'>🍗 SmartCart Web — Menu Recommender</div>", unsafe_allow_html=True)
     st.write("Select **up to 3 items** from a **menu**, get **top-3 recommendations**. All logic identical to the previous system.")
-    st.info("Put your CSVs under `data/`, then build the model once. Recommendations are purely cart-based (no user identity).")
+    st.info("Put your CSVs under `data/`, then build the model once. Recommendations are cart-based; a registered customer's purchase history can re-rank them.")
 
+    # Row counts come from the data cache sidecar; the CSVs are parsed only once
     try:
-        dfs = load_all_csvs()
+        rows = row_counts()
+        if rows is None:
+            with st.spinner("Converting CSVs to the columnar data cache (one time)..."):
+                rows = {t: info["rows"] for t, info in build_data_cache()["tables"].items()}
     except Exception as e:
         st.error(f"CSV load error: {e}")
         st.stop()
 
     col1, col2, col3, col4 = st.columns(4)
-    col1.metric("Orders", f"{len(dfs['order']):,}")
-    col2.metric("Customers", f"{len(dfs['customer']):,}")
-    col3.metric("Stores", f"{len(dfs['store']):,}")
-    col4.metric("Test Rows", f"{len(dfs['test']):,}")
+    col1.metric("Orders", f"{rows['order']:,}")
+    col2.metric("Customers", f"{rows['customer']:,}")
+    col3.metric("Stores", f"{rows['store']:,}")
+    col4.metric("Test Rows", f"{rows['test']:,}")
 
     st.markdown("---")
     header("Quick steps", "🧭")
@@ -150,15 +228,49 @@ def build_model_page():
     st.markdown("<div class='dark-header'>🧱 Build Model (first run)</div>", unsafe_allow_html=True)
     st.write("Computes normalized co-occurrence + item tagging. Cached to disk for fast reuse.")
 
-    sample = st.slider(
+    use_all = st.checkbox("Use all orders", value=True,
+                          help="Pair counting is vectorized, so the full dataset builds in seconds.")
+    sample = None if use_all else st.slider(
         "Sample N orders (speed vs quality)",
         100_000, 1_414_410, 250_000, step=50_000,
-        help="Use 200–300k for fast dev. Full dataset if you have RAM/Time."
+        help="Sampling is only needed to reproduce older sampled builds."
     )
-    if st.button("🚀 Build now"):
-        with st.spinner("Crunching pairs & normalizing..."):
-            _ = prepare_artifacts(sample_n=sample)
-        st.success("Artifacts built and cached to `artifacts/artifacts.pkl`")
+    precompute = st.checkbox("Precompute all 1–3 item carts", value=False,
+                             help="Slower build; every distinct-item cart becomes a table lookup.")
+    from artifact_store import MODEL_DIR_NAME
+    job = build_jobs.current(MODEL_DIR_NAME)
+    if st.button("🚀 Build now", disabled=job is not None and job.active):
+        rows = row_counts()
+        job = build_jobs.submit(MODEL_DIR_NAME, run_build, sample, precompute,
+                                total_rows=rows["order"] if rows else None)
+    if job is not None:
+        build_status(job)
+
+def build_status(job):
+    """Progress of a background build; reruns every second while it is active."""
+    snap = job.snapshot()
+    if job.active:
+        detail = f"{snap['orders_parsed']:,} orders parsed · {snap['orders_counted']:,} pair-counted"
+        st.progress(snap["fraction"] or 0.0, text=f"{snap['step'] or 'Starting'} — {detail} · {snap['elapsed_s']}s")
+        if snap["cancel_requested"]:
+            st.caption("Cancelling at the next chunk...")
+        elif st.button("✋ Cancel build"):
+            job.cancel()
+        st.caption("Other pages keep serving the current model until this build is published.")
+        time.sleep(1)
+        st.rerun()
+    elif snap["state"] == "done":
+        out_dir, reused = job.result
+        if reused:
+            st.success(f"Data and code unchanged: reused and published `{out_dir}`")
+        else:
+            st.success(f"Artifacts built and published to `{out_dir}` in {snap['elapsed_s']}s")
+    elif snap["state"] == "cancelled":
+        st.warning("Build cancelled; the previous model is still being served.")
+    else:
+        st.error(f"Build failed: {snap['error']}")
+        with st.expander("Traceback"):
+            st.code(job.traceback or "")
 
 def menu_reco_page():
     st.markdown("<div class='dark-header'>🛒 Menu & Recommendations</div>", unsafe_allow_html=True)
@@ -167,7 +279,8 @@ def menu_reco_page():
         return
 
     item_type, item_feat = art["item_type"], art["item_feat"]
-    top_by_type, co_norm = art["top_by_type"], art["co_norm"]
+    top_by_type = art["top_by_type"]
+    catalog = art.get("catalog")
     known_items_lower, lower_to_orig = art["known_items_lower"], art["lower_to_orig"]
 
     all_items = list(lower_to_orig.values())
@@ -187,12 +300,55 @@ def menu_reco_page():
         selected = selected[:3]
 
     # Display top bar badges (pretty)
-    topbar_badges(selected, limit=3)
+    topbar_badges(selected, limit=3, catalog=catalog)
+
+    # Optional order context (only segments the model was built with)
+    context = {}
+    segments = art.get("segments", [])
+    if segments:
+        dims = {}
+        for sg in segments:
+            dim, _, val = sg.partition("=")
+            dims.setdefault(dim, []).append(val)
+        ctx_cols = st.columns(len(dims))
+        for (dim, vals), col in zip(dims.items(), ctx_cols):
+            with col:
+                choice = st.selectbox(dim.title(), ["Any"] + vals, key=f"ctx_{dim}")
+            if choice != "Any":
+                context[dim] = choice
+
+    # Optional customer ID: registered customers get a personalized re-rank
+    customer_id = None
+    history = art.get("customer_history")
+    if history is not None:
+        raw_id = st.text_input("Customer ID (optional)", help=f"{len(history):,} registered customers have a purchase history.")
+        if raw_id.strip():
+            customer_id = raw_id.strip()
+            if history.row(customer_id) < 0:
+                st.caption("No purchase history for this customer; showing cart-based recommendations.")
+
+    # Optional store: stores with enough orders have their own model
+    store_model = None
+    stores = get_store_models(art["version"], art)
+    if stores is not None:
+        raw_store = st.text_input("Store number (optional)", help=f"{len(stores):,} stores have their own model.")
+        if raw_store.strip():
+            store_model = stores.model_for(raw_store.strip())
+            if store_model is stores.global_model:
+                store_model = None
+                st.caption("Not enough orders for this store; showing chain-wide recommendations.")
 
     if st.button("🍽️ Recommend", disabled=(len(selected) == 0)):
+        from recommender import normalize_user_items
         # Normalize (same logic)
-        cart = normalize_user_items(selected, known_items_lower, lower_to_orig)
-        recs = enhanced_recommend(cart, co_norm, item_type, top_by_type, item_feat)
+        cart = normalize_user_items(selected, known_items_lower, lower_to_orig, matcher=art.get("matcher"))
+        if store_model is not None:
+            recs = store_model.recommend(cart, customer_id=customer_id)
+        else:
+            reco_cache = get_reco_cache(art["version"], art)
+            recs = reco_cache.recommend(cart, context=context, customer_id=customer_id)
+            stats = reco_cache.stats()
+            st.caption(f"Cache: {stats['hits']} hits / {stats['misses']} misses")
 
         if not recs:
             st.warning("No recommendations found. Try different items or rebuild the model.")
@@ -206,7 +362,7 @@ def menu_reco_page():
         for idx, (it, score) in enumerate(recs, start=1):
             t = item_type.get(it, "other")
             with cols[idx - 1]:
-                reco_card(idx, it, score, t)
+                reco_card(idx, it, score, t, catalog=catalog)
 
 def batch_page():
     st.markdown("<div class='dark-header'>📦 Batch Predict (CSV)</div>", unsafe_allow_html=True)
@@ -214,19 +370,28 @@ def batch_page():
     if art is None:
         return
 
-    st.caption("Reads `data/test_data_question.csv` and writes output under `artifacts/`")
+    st.caption("Reads `data/test_data_question.csv` and writes output under `artifacts/`. "
+               "For large files or scheduled jobs run `python -m app.batch` instead.")
+    use_context = st.checkbox("Use order context (occasion / channel)", value=bool(art.get("segments")),
+                              disabled=not art.get("segments"))
+    use_customer = st.checkbox("Personalize by CUSTOMER_ID", value=art.get("customer_history") is not None,
+                               disabled=art.get("customer_history") is None)
+    stores = get_store_models(art["version"], art)
+    per_store = st.checkbox("Use per-store models (STORE_NUMBER)", value=stores is not None, disabled=stores is None)
     if st.button("Run batch on test_data_question.csv"):
+        from recommender import batch_predict
         try:
-            test_path = os.path.join(DATA_DIR, "test_data_question.csv")
-            test_df = pd.read_csv(test_path)
+            test_df = load_columns("test")
         except Exception as e:
             st.error(f"Cannot read test_data_question.csv: {e}")
             return
 
         out = batch_predict(
             test_df,
-            art["co_norm"], art["item_type"], art["top_by_type"], art["item_feat"],
-            art["known_items_lower"], art["lower_to_orig"]
+            None, art["item_type"], art["top_by_type"], art["item_feat"],
+            art["known_items_lower"], art["lower_to_orig"],
+            model=get_reco_cache(art["version"], art).model, matcher=art.get("matcher"),
+            use_context=use_context, use_customer=use_customer, stores=stores if per_store else None
         )
         out_path = os.path.join(ART_DIR, "SmartCart_Recommendation_Output.csv")
         out.to_csv(out_path, index=False)
@@ -246,8 +411,9 @@ def metrics_page():
         return
 
     # Category distribution
-    item_type = art["item_type"]
+    item_type, catalog = art["item_type"], art.get("catalog")
     counts = Counter(item_type.values())
+    import pandas as pd
     st.bar_chart(pd.DataFrame.from_dict(counts, orient="index", columns=["Count"]))
 
     # Top items by type
@@ -257,7 +423,43 @@ def metrics_page():
         with col:
             st.markdown(f"**{t.title()}** {TYPE_EMOJI.get(t, '🍽️')}")
             for it, cnt in art["top_by_type"].get(t, [])[:10]:
-                st.write(f"{icon_for_item(it)} {it} — {cnt}")
+                st.write(f"{icon_for_item(it, catalog)} {it} — {cnt}")
+
+    performance_section()
+
+def performance_section():
+    """Build stage timings and online latency histograms from ``instrument``."""
+    import json
+    st.markdown("#### Performance")
+    snap = instrument.snapshot()
+    if not snap["stages"]:
+        # builds cached by Streamlit ran in an earlier process; show the last export
+        saved = os.path.join(ART_DIR, instrument.METRICS_FILE)
+        if os.path.exists(saved):
+            with open(saved) as f:
+                snap["stages"] = json.load(f).get("stages", [])
+            st.caption("Build stages from the last exported build (`artifacts/metrics.json`).")
+    st.caption(f"Process RSS {snap['rss_mb']} MB, peak {snap['peak_rss_mb']} MB")
+
+    if snap["stages"]:
+        st.markdown("**Build stages**")
+        st.dataframe(snap["stages"], use_container_width=True)
+    else:
+        st.info("No build stages recorded yet. Build the model to see where the time goes.")
+
+    lat = {name: s for name, s in snap["latency"].items() if s["n"]}
+    if lat:
+        st.markdown("**Online latency (rolling window)**")
+        st.dataframe([{"call": name, **{k: v for k, v in s.items() if k != "histogram"}} for name, s in lat.items()],
+                     use_container_width=True)
+        name = st.selectbox("Latency histogram", list(lat))
+        import pandas as pd
+        hist = pd.DataFrame(lat[name]["histogram"])
+        hist.index = [f"≤{b:,} µs" for b in hist.pop("le_us")]
+        st.bar_chart(hist)
+
+    st.download_button("Download metrics JSON", json.dumps(snap, indent=2),
+                       file_name="smartcart_metrics.json", mime="application/json")
 
 def about_page():
     st.markdown("<div class='dark-header'>ℹ️ About</div>", unsafe_allow_html=True)
@@ -1,19 +1,11 @@
 import streamlit as st
-from typing import Optional
+from typing import TYPE_CHECKING, Optional
 
-EMOJI_MAP = [
-    (["wing", "wings", "grilled"], "🍗"),
-    (["spicy"], "🌶️"),
-    (["fries", "voodoo"], "🍟"),
-    (["soda", "punch", "drink", "tea", "lager", "root beer"], "🥤"),
-    (["dip", "sauce"], "🥣"),
-    (["corn"], "🌽"),
-    (["veggie", "celery", "carrot"], "🥕"),
-    (["cake", "dessert", "choco"], "🍰"),
-    (["combo", "feast", "bundle", "lunch", "box", "platter"], "🍱"),
-    (["strip", "strips"], "🍗"),
-    (["water"], "💧"),
-]
+# stdlib-only tables: importing ItemCatalog here would load numpy with the start page
+from item_tables import icon_for_name
+
+if TYPE_CHECKING:
+    from item_catalog import ItemCatalog
 
 TYPE_EMOJI = {
     "main": "🍱",
@@ -23,12 +15,9 @@ TYPE_EMOJI = {
     "other": "🍽️"
 }
 
-def icon_for_item(name: str) -> str:
-    n = (name or "").lower()
-    for keys, emoji in EMOJI_MAP:
-        if any(k in n for k in keys):
-            return emoji
-    return "🍽️"
+def icon_for_item(name: str, catalog: Optional["ItemCatalog"] = None) -> str:
+    """The catalog's precomputed icon when given, else a keyword scan of ``name``."""
+    return catalog.icon(name) if catalog is not None else icon_for_name(name)
 
 def chip(text: str) -> None:
     st.markdown(f'<span class="item-chip">{text}</span>', unsafe_allow_html=True)
@@ -45,18 +34,19 @@ def card(title: str, subtitle: Optional[str] = None, body: Optional[str] = None)
 def header(title: str, emoji: str = "🍔") -> None:
     st.markdown(f"### {emoji} {title}")
 
-def topbar_badges(cart, limit: int = 3) -> None:
+def topbar_badges(cart, limit: int = 3, catalog: Optional["ItemCatalog"] = None) -> None:
     st.markdown('<div class="topbar">', unsafe_allow_html=True)
     st.markdown(f'<span class="badge">Pick up to {limit}</span>', unsafe_allow_html=True)
     if cart:
         for x in cart:
-            st.markdown(f'<span class="badge">{icon_for_item(x)} {x}</span>', unsafe_allow_html=True)
+            st.markdown(f'<span class="badge">{icon_for_item(x, catalog)} {x}</span>', unsafe_allow_html=True)
     st.markdown('</div>', unsafe_allow_html=True)
 
-def reco_card(rank: int, item: str, score: float, item_type: str) -> None:
+def reco_card(rank: int, item: str, score: float, item_type: str,
+              catalog: Optional["ItemCatalog"] = None) -> None:
     """Beautiful ranked recommendation card with medal badge."""
     medal = {1: "🥇", 2: "🥈", 3: "🥉"}.get(rank, "⭐️")
-    emoji = icon_for_item(item)
+    emoji = icon_for_item(item, catalog)
     type_emoji = TYPE_EMOJI.get(item_type, "🍽️")
     # rank label text
     rank_label = f"Rec {rank}"
@@ -0,0 +1,11 @@
+"""Synthetic data generator and performance benchmarks for SmartCart.
+
+The app modules use flat imports (``from data_loader import ...``), so the
+``app/`` folder is put on ``sys.path`` here, the same way Streamlit does
+when it runs ``app/streamlit_app.py``.
+"""
+import os, sys
+
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app")
+if APP_DIR not in sys.path:
+    sys.path.insert(0, APP_DIR)
@@ -0,0 +1,158 @@
+"""Benchmark the build, load and serving paths on synthetic (or real) data.
+
+    python -m bench.run --orders 1414410 --json bench_results.json
+
+Generates data with ``bench.synth`` unless ``--data`` already holds the
+CSVs, then runs every stage in its own spawned process so ``peak_rss_mb``
+is per stage. Results are printed and optionally written as JSON so runs
+can be diffed for regressions.
+"""
+from __future__ import annotations
+import argparse, json, multiprocessing as mp, os, platform, resource, statistics, tempfile, time
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from bench import synth
+
+STAGES = ["build_legacy", "build_stream", "artifact_load", "recommend_latency", "batch_predict"]
+
+def _peak_rss_mb() -> float:
+    """Peak RSS of this process or any child it waited for (Linux reports KiB)."""
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    kids = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(max(own, kids) / 1024, 1)
+
+def _timed(fn: Callable, *args, **kwargs):
+    t = time.perf_counter()
+    out = fn(*args, **kwargs)
+    return out, round(time.perf_counter() - t, 4)
+
+def _percentiles(samples: List[float]) -> Dict[str, float]:
+    us = np.array(samples) * 1e6
+    return {"p50_us": round(float(np.percentile(us, 50)), 2), "p99_us": round(float(np.percentile(us, 99)), 2),
+            "mean_us": round(float(us.mean()), 2), "n": len(samples)}
+
+def build_legacy(opts: dict) -> dict:
+    """``pd.read_csv`` + ``build_items_and_tags`` + ``build_normalized_comatrix``."""
+    import pandas as pd
+    from data_loader import (csv_paths, extract_item_names, clean_item_list,
+                             build_items_and_tags, build_normalized_comatrix)
+    order, t_read = _timed(pd.read_csv, csv_paths()["order"])
+    lists, t_parse = _timed(lambda: order["ORDERS"].apply(extract_item_names).apply(clean_item_list))
+    order["ITEM_LIST"] = lists
+    _, t_tags = _timed(build_items_and_tags, order)
+    _, t_pairs = _timed(build_normalized_comatrix, order)
+    return {"read_csv_s": t_read, "parse_s": t_parse, "build_items_and_tags_s": t_tags,
+            "build_normalized_comatrix_s": t_pairs, "total_s": round(t_read + t_parse + t_tags + t_pairs, 4),
+            "orders": len(order)}
+
+def build_stream(opts: dict) -> dict:
+    """Chunked, process-pool build; also writes the artifact later stages use."""
+    from data_loader import stream_order_counts, items_and_tags_from_counts, comatrix_from_counts
+    from artifact_store import save_model_artifact
+    counts, t_count = _timed(stream_order_counts, workers=opts["workers"])
+    (item_type, item_feat, top_by_type, all_items), t_tags = _timed(items_and_tags_from_counts, counts)
+    co_norm, t_norm = _timed(comatrix_from_counts, counts)
+    known = {it.lower(): it for it in all_items}
+    art = {"item_type": item_type, "item_feat": item_feat, "top_by_type": top_by_type, "co_norm": co_norm,
+           "known_items_lower": list(known), "lower_to_orig": known}
+    _, t_save = _timed(save_model_artifact, art, counts=counts)
+    return {"count_s": t_count, "tags_s": t_tags, "normalize_s": t_norm, "save_s": t_save,
+            "total_s": round(t_count + t_tags + t_norm + t_save, 4), "orders": counts.n_orders,
+            "items": len(all_items), "workers": opts["workers"] or os.cpu_count()}
+
+def artifact_load(opts: dict) -> dict:
+    from artifact_store import open_model_artifact, load_model_artifact
+    from recommender import SmartCartModel
+    opens = [_timed(open_model_artifact)[1] for _ in range(opts["repeats"])]
+    loads = [_timed(load_model_artifact)[1] for _ in range(opts["repeats"])]
+    art = load_model_artifact()
+    compiles = [_timed(SmartCartModel.from_artifact, art)[1] for _ in range(opts["repeats"])]
+    return {"open_mmap_s": statistics.median(opens), "load_model_artifact_s": statistics.median(loads),
+            "compile_model_s": statistics.median(compiles)}
+
+def recommend_latency(opts: dict) -> dict:
+    from artifact_store import load_model_artifact
+    from recommender import SmartCartModel, enhanced_recommend
+    art = load_model_artifact()
+    model = SmartCartModel.from_artifact(art)
+    rng = np.random.default_rng(0)
+    items = model.items
+    carts = [list(rng.choice(items, size=rng.integers(1, 4), replace=False)) for _ in range(opts["carts"])]
+    legacy, compiled = [], []
+    for cart in carts:
+        legacy.append(_timed(enhanced_recommend, cart, art["co_norm"], art["item_type"],
+                             art["top_by_type"], art["item_feat"])[1])
+        compiled.append(_timed(model.recommend, cart)[1])
+    return {"enhanced_recommend": _percentiles(legacy), "SmartCartModel.recommend": _percentiles(compiled)}
+
+def batch_predict(opts: dict) -> dict:
+    import pandas as pd
+    from data_loader import csv_paths
+    from artifact_store import load_model_artifact
+    from recommender import SmartCartModel, batch_predict as run_batch
+    art = load_model_artifact()
+    test = pd.read_csv(csv_paths()["test"])
+    reps = -(-opts["batch_rows"] // max(len(test), 1))
+    test = pd.concat([test] * reps, ignore_index=True).iloc[:opts["batch_rows"]]
+    model = SmartCartModel.from_artifact(art)
+    _, t = _timed(run_batch, test, art["co_norm"], art["item_type"], art["top_by_type"], art["item_feat"],
+                  art["known_items_lower"], art["lower_to_orig"], model=model, matcher=art["matcher"])
+    return {"rows": len(test), "seconds": t, "rows_per_s": round(len(test) / t, 1) if t else None}
+
+def _run_stage(name: str, opts: dict) -> dict:
+    out = globals()[name](opts)
+    out["peak_rss_mb"] = _peak_rss_mb()
+    return out
+
+def run(opts: dict) -> dict:
+    ctx = mp.get_context("spawn")
+    results = {}
+    for name in opts["stages"]:
+        with ctx.Pool(1) as pool:
+            results[name] = pool.apply(_run_stage, (name, opts))
+        print(f"{name}: {json.dumps(results[name])}", flush=True)
+    return results
+
+def main(argv=None) -> None:
+    ap = argparse.ArgumentParser(description="SmartCart performance benchmarks")
+    ap.add_argument("--data", help="folder with the four CSVs (generated if missing)")
+    ap.add_argument("--artifacts", help="artifact folder (default: a temp dir)")
+    ap.add_argument("--orders", type=int, default=synth.FULL_ORDERS, help="synthetic orders to generate")
+    ap.add_argument("--items", type=int, default=synth.FULL_ITEMS)
+    ap.add_argument("--skew", type=float, default=1.1)
+    ap.add_argument("--workers", type=int, default=0, help="build_stream pool size (0 = all cores)")
+    ap.add_argument("--carts", type=int, default=5_000, help="random carts for latency percentiles")
+    ap.add_argument("--batch-rows", type=int, default=100_000)
+    ap.add_argument("--repeats", type=int, default=5)
+    ap.add_argument("--stages", nargs="+", default=STAGES, choices=STAGES,
+                    help="later stages read the artifact build_stream writes; pass --artifacts to reuse one")
+    ap.add_argument("--json", help="write results here")
+    args = ap.parse_args(argv)
+
+    data_dir = args.data or tempfile.mkdtemp(prefix="smartcart-data-")
+    generated = not os.path.exists(os.path.join(data_dir, "order_data.csv"))
+    if generated:
+        _, t = _timed(synth.generate, data_dir, args.orders, args.items, args.skew)
+        print(f"generated {args.orders:,} orders in {t}s under {data_dir}", flush=True)
+    # spawned stage processes inherit these and import data_loader fresh
+    os.environ["SMARTCART_DATA_DIR"] = data_dir
+    os.environ["SMARTCART_ART_DIR"] = args.artifacts or tempfile.mkdtemp(prefix="smartcart-art-")
+
+    opts = {"workers": args.workers or None, "carts": args.carts, "batch_rows": args.batch_rows,
+            "repeats": args.repeats, "stages": args.stages}
+    report = {
+        "meta": {"data_dir": data_dir, "generated": generated,
+                 "synthetic": {"orders": args.orders, "items": args.items, "skew": args.skew} if generated else None,
+                 "cpu_count": os.cpu_count(), "python": platform.python_version(), "numpy": np.__version__,
+                 "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S")},
+        "stages": run(opts),
+    }
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""Synthetic order data in the real CSV schema.
+
+    python -m bench.synth --out /tmp/smartcart-data --orders 1414410
+
+Writes ``order_data.csv`` (``ORDERS`` JSON as
+``orders[].item_details[].item_name``), ``customer_data.csv``,
+``store_data.csv`` and ``test_data_question.csv`` so ``load_csvs`` works
+against the folder via ``SMARTCART_DATA_DIR``. Item popularity is Zipf with
+exponent ``skew``; dips and drinks are added as companions so the
+co-occurrence matrix has structure.
+"""
+from __future__ import annotations
+import argparse, json, os
+from typing import Dict, List
+import numpy as np
+import pandas as pd
+
+FULL_ORDERS = 1_414_410
+FULL_CUSTOMERS = 563_000
+FULL_ITEMS = 138
+FULL_STORES = 1_200
+
+FLAVORS = ["Spicy", "Grilled", "Lemon Pepper", "Garlic Parmesan", "Mango Habanero", "Hickory BBQ",
+           "Cajun", "Original Hot", "Atomic", "Teriyaki", "Louisiana Rub", "Hawaiian"]
+PIECES = [3, 5, 6, 8, 10, 15, 20, 30, 50]
+SIZES = ["Regular", "Large"]
+DIPS = ["Ranch", "Blue Cheese", "Honey Mustard", "Cheese Sauce", "Hot Honey"]
+DRINKS = ["Soda", "Lemonade", "Sweet Tea", "Fruit Punch", "Root Beer", "Bottled Water"]
+SIDES = ["Buffalo Fries", "Cajun Fries", "Fried Corn", "Veggie Sticks", "Voodoo Fries", "Chocolate Cake"]
+NON_ITEM_NAMES = ["Memo", "Delivery Fee", "Plastic Fork", "ASAP"]
+CHANNELS = [("Digital", "WWT", 0.7), ("Digital", "Third Party", 0.2), ("Call Center", "Phone", 0.1)]
+OCCASIONS = [("ToGo", 0.6), ("Delivery", 0.35), ("Dine In", 0.05)]
+CUSTOMER_TYPES = [("Registered", 0.55), ("Guest", 0.35), ("eClub", 0.10)]
+
+def menu(n_items: int = FULL_ITEMS, seed: int = 42) -> Dict[str, List[str]]:
+    """``n_items`` distinct names split into main/side/dip/drink pools."""
+    mains = [f"{p} pc {f} Wings" for p in PIECES for f in FLAVORS]
+    mains += [f"{p} pc {f} Wings Combo" for p in PIECES[:5] for f in FLAVORS]
+    mains += [f"{p} pc Crispy Strips" for p in PIECES[:6]] + [f"{p} pc Spicy Feast Deal" for p in (20, 30, 50)]
+    mains += ["Chicken Sub Combo", "Lunch Box", "Family Flavor Platter"]
+    pools = {
+        "main": mains,
+        "side": [f"{s} {z}" for s in SIDES for z in SIZES],
+        "dip": [f"{d} Dip - {z}" for d in DIPS for z in SIZES],
+        "drink": [f"{z} {d}" for d in DRINKS for z in ("20 oz", "32 oz")],
+    }
+    rng = np.random.default_rng(seed)
+    # keep every side/dip/drink we can, fill the rest with mains
+    out = {}
+    fixed = sum(len(v) for k, v in pools.items() if k != "main")
+    for k, names in pools.items():
+        names = list(rng.permutation(names))
+        out[k] = names if k != "main" else names[:max(n_items - fixed, 1)]
+    while sum(len(v) for v in out.values()) > n_items:
+        k = max(("side", "dip", "drink"), key=lambda t: len(out[t]))
+        out[k].pop()
+    return out
+
+def _weighted(rng, choices, n):
+    vals, probs = zip(*[(c[:-1] if len(c) > 2 else c[0], c[-1]) for c in choices])
+    return [vals[i] for i in rng.choice(len(vals), size=n, p=np.array(probs) / sum(probs))]
+
+def generate(out_dir: str, n_orders: int = FULL_ORDERS, n_items: int = FULL_ITEMS, skew: float = 1.1,
+             n_customers: int | None = None, n_stores: int | None = None, n_test: int = 1_000,
+             seed: int = 42, chunk: int = 100_000) -> Dict[str, str]:
+    """Write the four CSVs under ``out_dir`` and return their paths."""
+    os.makedirs(out_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    n_customers = n_customers or max(1, round(n_orders * FULL_CUSTOMERS / FULL_ORDERS))
+    n_stores = n_stores or max(1, min(FULL_STORES, n_orders // 500))
+
+    pools = menu(n_items, seed)
+    names = [it for t in ("main", "side", "dip", "drink") for it in pools[t]]
+    is_dip = np.array([it in pools["dip"] for it in names])
+    is_drink = np.array([it in pools["drink"] for it in names])
+    pop = 1.0 / np.arange(1, len(names) + 1) ** skew
+    pop = pop[rng.permutation(len(names))]
+    p_all = pop / pop.sum()
+    p_dip = np.where(is_dip, pop, 0) / pop[is_dip].sum()
+    p_drink = np.where(is_drink, pop, 0) / pop[is_drink].sum()
+    frags = np.array([json.dumps({"item_name": it, "item_quantity": 1}) for it in names + NON_ITEM_NAMES],
+                     dtype=object)
+    non_item_base = len(names)
+
+    paths = {k: os.path.join(out_dir, f) for k, f in
+             [("order", "order_data.csv"), ("customer", "customer_data.csv"),
+              ("store", "store_data.csv"), ("test", "test_data_question.csv")]}
+    test_rows = []
+    test_every = max(1, n_orders // max(n_test, 1))
+    start_day = np.datetime64("2023-01-01")
+    for start in range(0, n_orders, chunk):
+        m = min(chunk, n_orders - start)
+        sizes = np.minimum(rng.geometric(0.45, size=m), 8)
+        picks = rng.choice(len(names), size=sizes.sum(), p=p_all)
+        add_dip = rng.random(m) < 0.35
+        add_drink = rng.random(m) < 0.25
+        add_memo = rng.random(m) < 0.03
+        dips = rng.choice(len(names), size=m, p=p_dip)
+        drinks = rng.choice(len(names), size=m, p=p_drink)
+        memos = non_item_base + rng.integers(0, len(NON_ITEM_NAMES), size=m)
+        bounds = np.concatenate([[0], np.cumsum(sizes)])
+
+        orders = []
+        for r in range(m):
+            ids = list(picks[bounds[r]:bounds[r + 1]])
+            if add_dip[r]: ids.append(dips[r])
+            if add_drink[r]: ids.append(drinks[r])
+            if add_memo[r]: ids.append(memos[r])
+            orders.append('{"orders": [{"item_details": [' + ", ".join(frags[ids]) + "]}]}")
+            if (start + r) % test_every == 0 and len(test_rows) < n_test:
+                test_rows.append([names[i] for i in ids if i < non_item_base][:3])
+
+        channel = _weighted(rng, CHANNELS, m)
+        df = pd.DataFrame({
+            "CUSTOMER_ID": rng.zipf(1.3, size=m) % n_customers + 1,
+            "STORE_NUMBER": rng.integers(1, n_stores + 1, size=m),
+            "ORDER_CREATED_DATE": (start_day + rng.integers(0, 730, size=m)).astype(str),
+            "ORDER_ID": np.arange(start, start + m) + 1_000_000_000,
+            "ORDERS": orders,
+            "ORDER_CHANNEL_NAME": [c[0] for c in channel],
+            "ORDER_SUBCHANNEL_NAME": [c[1] for c in channel],
+            "ORDER_OCCASION_NAME": _weighted(rng, OCCASIONS, m),
+        })
+        df.to_csv(paths["order"], mode="w" if start == 0 else "a", header=start == 0, index=False)
+
+    pd.DataFrame({
+        "CUSTOMER_ID": np.arange(1, n_customers + 1),
+        "CUSTOMER_TYPE": _weighted(rng, CUSTOMER_TYPES, n_customers),
+    }).to_csv(paths["customer"], index=False)
+    pd.DataFrame({
+        "STORE_NUMBER": np.arange(1, n_stores + 1),
+        "CITY": [f"City {i % 97}" for i in range(n_stores)],
+        "STATE": [f"S{i % 40:02d}" for i in range(n_stores)],
+    }).to_csv(paths["store"], index=False)
+    channel = _weighted(rng, CHANNELS, len(test_rows))
+    pd.DataFrame({
+        "CUSTOMER_ID": rng.integers(1, n_customers + 1, size=len(test_rows)),
+        "STORE_NUMBER": rng.integers(1, n_stores + 1, size=len(test_rows)),
+        "ORDER_ID": np.arange(len(test_rows)) + 9_000_000_000,
+        "ORDER_CHANNEL_NAME": [c[0] for c in channel],
+        "ORDER_SUBCHANNEL_NAME": [c[1] for c in channel],
+        "ORDER_OCCASION_NAME": _weighted(rng, OCCASIONS, len(test_rows)),
+        "CUSTOMER_TYPE": _weighted(rng, CUSTOMER_TYPES, len(test_rows)),
+        **{f"item{k + 1}": [row[k] if k < len(row) else "" for row in test_rows] for k in range(3)},
+    }).to_csv(paths["test"], index=False)
+    return paths
+
+def main(argv=None) -> None:
+    ap = argparse.ArgumentParser(description="Write synthetic SmartCart CSVs")
+    ap.add_argument("--out", required=True, help="output folder (use as SMARTCART_DATA_DIR)")
+    ap.add_argument("--orders", type=int, default=FULL_ORDERS)
+    ap.add_argument("--items", type=int, default=FULL_ITEMS)
+    ap.add_argument("--skew", type=float, default=1.1, help="Zipf exponent of item popularity")
+    ap.add_argument("--test-rows", type=int, default=1_000)
+    ap.add_argument("--seed", type=int, default=42)
+    args = ap.parse_args(argv)
+    paths = generate(args.out, args.orders, args.items, args.skew, n_test=args.test_rows, seed=args.seed)
+    print(json.dumps(paths, indent=2))
+
+if __name__ == "__main__":
+    main()
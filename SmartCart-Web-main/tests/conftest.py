@@ -0,0 +1,51 @@
+"""Shared fixtures: one small synthetic order set and a full build over it.
+
+``paths`` reads ``SMARTCART_DATA_DIR`` / ``SMARTCART_ART_DIR`` at import, so
+both point at a scratch folder before any app module is imported.
+"""
+import os, shutil, sys, tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRATCH = tempfile.mkdtemp(prefix="smartcart-tests-")
+os.environ["SMARTCART_DATA_DIR"] = os.path.join(SCRATCH, "data")
+os.environ["SMARTCART_ART_DIR"] = os.path.join(SCRATCH, "artifacts")
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import bench  # noqa: E402  (puts app/ on sys.path)
+import pandas as pd  # noqa: E402
+import pytest  # noqa: E402
+
+N_ORDERS = 4_000
+N_ITEMS = 40
+N_STORES = 8
+
+@pytest.fixture(scope="session", autouse=True)
+def synth_data():
+    """The four CSVs of ``bench.synth`` under ``SMARTCART_DATA_DIR``."""
+    from bench.synth import generate
+    paths = generate(os.environ["SMARTCART_DATA_DIR"], n_orders=N_ORDERS, n_items=N_ITEMS,
+                     n_stores=N_STORES, n_test=300, chunk=1_500)
+    yield paths
+    shutil.rmtree(SCRATCH, ignore_errors=True)
+
+@pytest.fixture(scope="session")
+def order_df(synth_data):
+    return pd.read_csv(synth_data["order"], dtype=str)
+
+@pytest.fixture(scope="session")
+def test_df(synth_data):
+    return pd.read_csv(synth_data["test"], dtype=str, keep_default_na=False)
+
+@pytest.fixture(scope="session")
+def full_build(synth_data):
+    """A published full build (segments, pair index, customer history) and its loaded artifact."""
+    from artifact_store import load_model_artifact, save_model_artifact
+    from customer_history import build_customer_history
+    from data_loader import comatrix_from_counts, items_and_tags_from_counts, stream_order_counts
+    counts = stream_order_counts(workers=1, chunksize=1_000, segments=True, pair_context=True)
+    item_type, item_feat, top_by_type, items = items_and_tags_from_counts(counts)
+    art = {"item_type": item_type, "item_feat": item_feat, "top_by_type": top_by_type,
+           "co_norm": comatrix_from_counts(counts)}
+    save_model_artifact(art, counts=counts, key="full", customers=build_customer_history(sorted(item_type)))
+    return {"counts": counts, "built": art, "art": load_model_artifact(version="full")}
@@ -0,0 +1,133 @@
+"""Stored artifacts: round trip, incremental updates and store models."""
+import os
+
+import numpy as np
+
+import artifact_store
+import data_loader
+from artifact_store import build_key, load_counts, load_model_artifact, save_model_artifact, update_artifacts, version_dir
+from customer_history import CustomerCounts, build_customer_history, guest_ids
+from data_loader import build_normalized_comatrix, build_items_and_tags, comatrix_from_counts, count_order_chunk, \
+    items_and_tags_from_counts, stream_order_counts
+from recommender import SmartCartModel, enhanced_recommend
+from store_models import StoreModelRegistry, build_store_models, load_store_counts, store_tally
+
+def as_float32(co_norm):
+    return {a: {b: float(np.float32(p)) for b, p in row.items()} for a, row in co_norm.items()}
+
+def test_round_trip(full_build):
+    built, art = full_build["built"], full_build["art"]
+    assert art["co_norm"] == as_float32(built["co_norm"])
+    assert art["item_type"] == built["item_type"] and art["item_feat"] == built["item_feat"]
+    assert {t: [tuple(x) for x in v] for t, v in art["top_by_type"].items()} == dict(built["top_by_type"])
+    model = SmartCartModel.from_artifact(art, pair_context=False)
+    for it in model.items:
+        assert model.recommend([it]) == enhanced_recommend([it], art["co_norm"], art["item_type"],
+                                                           art["top_by_type"], art["item_feat"])
+
+def test_legacy_dicts_built_on_first_access(full_build):
+    art = load_model_artifact(version="full")
+    assert not {"co_norm", "segment_co", "pair_co"} & art.keys()
+    assert "co_norm" in art and art.get("co_norm") == full_build["art"]["co_norm"]
+    assert art["segments"] == list(art["segment_co"])
+
+def test_build_key_tracks_customer_csv(monkeypatch, synth_data, tmp_path):
+    paths = {"order": synth_data["order"], "customer": str(tmp_path / "customer_data.csv")}
+    monkeypatch.setattr(artifact_store, "csv_paths", lambda: paths)
+    with open(synth_data["customer"]) as f:
+        text = f.read()
+    (tmp_path / "customer_data.csv").write_text(text)
+    before = build_key(None, customers=True), build_key(None)
+    (tmp_path / "customer_data.csv").write_text(text.replace("Registered", "Guest", 1))
+    after = build_key(None, customers=True), build_key(None)
+    assert before[0] != after[0] and before[1] == after[1]
+
+def test_incremental_update_matches_full_build(order_df, synth_data, tmp_path):
+    base, delta = order_df.iloc[:3_000], order_df.iloc[3_000:]
+    counts = count_order_chunk(base, pair_context=True)
+    item_type, item_feat, top_by_type, _ = items_and_tags_from_counts(counts)
+    save_model_artifact({"item_type": item_type, "item_feat": item_feat, "top_by_type": top_by_type,
+                         "co_norm": comatrix_from_counts(counts)}, name="incremental", counts=counts)
+    base_arrs = load_model_artifact("incremental")["arrays"]
+    base.to_csv(tmp_path / "base.csv", index=False)
+    build_store_models(base_arrs["items"], base_arrs["key"], path=str(tmp_path / "base.csv"), min_orders=300)
+    update_artifacts(delta, name="incremental")
+    updated = load_model_artifact("incremental")
+
+    full = count_order_chunk(order_df, pair_context=True)
+    item_type, item_feat, top_by_type, items = items_and_tags_from_counts(full)
+    assert updated["arrays"]["items"] == items
+    assert updated["co_norm"] == as_float32(comatrix_from_counts(full))
+    assert {t: [tuple(x) for x in v] for t, v in updated["top_by_type"].items()} == dict(top_by_type)
+    assert updated["segment_co"].keys() == load_model_artifact(version="full")["segment_co"].keys()
+
+    # the store build is carried forward and equals one over history + delta
+    reg = StoreModelRegistry.open(updated)
+    assert reg is not None
+    build_store_models(items, "reference", path=synth_data["order"], min_orders=300, name="stores-ref")
+    ref = StoreModelRegistry(updated, version_dir("reference", "stores-ref"), reg.global_model)
+    assert reg.partitions == ref.partitions and reg.part_id == ref.part_id
+    np.testing.assert_array_equal(reg.orders, ref.orders)
+    assert len(ref.part_id) > 0
+    for p in ref.part_id.values():
+        np.testing.assert_array_equal(np.asarray(reg.model(p).co), np.asarray(ref.model(p).co))
+        assert reg.top_by_type(p) == ref.top_by_type(p)
+
+def test_incremental_update_without_segments_adds_none(order_df):
+    base, delta = order_df.iloc[:3_000], order_df.iloc[3_000:]
+    counts = count_order_chunk(base[["ORDERS"]], pair_context=True)
+    assert counts.segments == []
+    item_type, item_feat, top_by_type, _ = items_and_tags_from_counts(counts)
+    save_model_artifact({"item_type": item_type, "item_feat": item_feat, "top_by_type": top_by_type,
+                         "co_norm": comatrix_from_counts(counts)}, name="plain", counts=counts)
+    update_artifacts(delta, name="plain")  # the delta carries the context columns
+    updated = load_model_artifact("plain")
+    assert updated["segments"] == [] and updated["segment_co"] == {}
+    assert load_counts(os.path.join(updated["arrays"]["dir"], "counts.npz")).segments == []
+    assert updated["co_norm"] == as_float32(comatrix_from_counts(count_order_chunk(order_df[["ORDERS"]], pair_context=True)))
+
+def test_sharded_tallies_match_separate_passes(monkeypatch):
+    monkeypatch.setattr(data_loader, "SHARD_BYTES", 64 << 10)  # several shards per worker
+    counts = stream_order_counts(workers=2, chunksize=700,
+                                 tallies={"customers": CustomerCounts(guest_ids()), "stores": store_tally()})
+    items = counts.items
+    ref = build_customer_history(items)
+    for key, arr in counts.extras["customers"].history(items).items():
+        np.testing.assert_array_equal(arr, ref[key], err_msg=key)
+        assert arr.dtype == ref[key].dtype
+
+    stores = counts.extras["stores"].regrown(items)
+    got = load_store_counts(stores.write("tallied", min_orders=300, name="stores-tally"))
+    want = load_store_counts(build_store_models(items, "separate", min_orders=300, name="stores-tally"))
+    assert got.part_id == want.part_id and got.seen == want.seen and len(want.part_id) > 0
+    for field in ("orders", "freq", "item_orders", "first", "pair_keys", "pair_counts"):
+        np.testing.assert_array_equal(getattr(got, field), getattr(want, field), err_msg=field)
+
+def test_store_models_match_per_store_build(full_build, order_df):
+    art = full_build["art"]
+    items = art["arrays"]["items"]
+    build_store_models(items, art["arrays"]["key"], min_orders=400, chunksize=700)
+    reg = StoreModelRegistry.open(art, capacity=2)
+    pos = {it: i for i, it in enumerate(items)}
+    for store, orders in order_df.groupby("STORE_NUMBER"):
+        p = reg.partition(store)
+        if len(orders) < 400:
+            assert p < 0
+            continue
+        co = reg.model(p).co
+        dense = np.zeros(co.shape, dtype=np.float32)
+        for a, row in build_normalized_comatrix(orders).items():
+            for b, v in row.items():
+                dense[pos[a], pos[b]] = v
+        np.testing.assert_array_equal(np.asarray(co), dense)
+        assert reg.top_by_type(p) == build_items_and_tags(orders)[2]
+    assert reg.model_for("no such store") is reg.global_model
+    assert len(reg.models) <= 2 and reg.evictions > 0
+
+def test_region_partitions(full_build):
+    art = full_build["art"]
+    build_store_models(art["arrays"]["items"], art["arrays"]["key"], level="STATE", min_orders=1,
+                       name="regions")
+    reg = StoreModelRegistry.open(art, name="regions")
+    assert reg.partition(1) == reg.partition("1.0") >= 0
+    assert len(reg) == len(set(reg.regions.values()))
@@ -0,0 +1,90 @@
+"""Streaming batch CLI: output equals one in-memory ``batch_predict``."""
+import io, json
+
+import pandas as pd
+import pytest
+
+import batch
+from artifact_store import load_model_artifact, publish_version
+from recommender import DEFAULT_BLACKLIST, SmartCartModel, batch_predict
+
+@pytest.fixture(scope="module")
+def expected(full_build, synth_data, test_df):
+    publish_version("full")
+    art = load_model_artifact()
+    out = batch_predict(test_df, None, art["item_type"], art["top_by_type"], art["item_feat"],
+                        art["known_items_lower"], art["lower_to_orig"], DEFAULT_BLACKLIST,
+                        model=SmartCartModel.from_artifact(art), matcher=art["matcher"])
+    return out.to_csv(index=False)
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_run_batch_matches_batch_predict(tmp_path, synth_data, expected, workers):
+    out = tmp_path / "out.csv"
+    summary = batch.run_batch(synth_data["test"], str(out), chunksize=70, workers=workers, log=io.StringIO())
+    assert summary["total_rows"] == 300
+    assert out.read_text() == expected
+
+def test_run_batch_pair_context_is_opt_in(tmp_path, synth_data, test_df, expected):
+    art = load_model_artifact()
+    want = batch_predict(test_df, None, art["item_type"], art["top_by_type"], art["item_feat"],
+                         art["known_items_lower"], art["lower_to_orig"], DEFAULT_BLACKLIST,
+                         model=SmartCartModel.from_artifact(art, pair_context=True), matcher=art["matcher"])
+    out = tmp_path / "out.csv"
+    batch.run_batch(synth_data["test"], str(out), chunksize=70, pair_context=True, log=io.StringIO())
+    assert out.read_text() == want.to_csv(index=False) != expected
+
+def test_csv_chunks_match_read_csv(tmp_path, monkeypatch):
+    path = tmp_path / "carts.csv"
+    rows = ['a,b', '1,"x\ny"', '', '2,"say ""hi"""', '3,z\r', '\r', '4,"q,\nr"', 'NA,null', '5,last']
+    path.write_bytes("\n".join(rows).encode())  # no trailing newline
+    monkeypatch.setattr(batch, "SCAN_BLOCK", 7)  # rows straddle the scan blocks
+    want = pd.read_csv(path, dtype=str)
+    for chunksize in (1, 2, 10):
+        chunks = list(batch.iter_csv_chunks(str(path), chunksize))
+        pd.testing.assert_frame_equal(pd.concat([c for c, _ in chunks], ignore_index=True), want)
+        assert chunks[-1][1] == path.stat().st_size
+        for k, (_, end) in enumerate(chunks[:-1]):  # resuming at any recorded offset reads the rest
+            rest = pd.concat([c for c, _ in batch.iter_csv_chunks(str(path), chunksize, start=end)], ignore_index=True)
+            pd.testing.assert_frame_equal(rest, want.iloc[sum(len(c) for c, _ in chunks[:k + 1]):].reset_index(drop=True))
+        skipped = pd.concat([c for c, _ in batch.iter_csv_chunks(str(path), chunksize, skip=3)], ignore_index=True)
+        pd.testing.assert_frame_equal(skipped, want.iloc[3:].reset_index(drop=True))
+
+def test_run_batch_reads_na_cells_like_read_csv(tmp_path, synth_data, expected):
+    """"NA", "null" and "N/A" cells are missing values, as on the Batch page."""
+    df = pd.read_csv(synth_data["test"], dtype=str, keep_default_na=False)
+    df.loc[::7, "item1"], df.loc[::11, "item2"], df.loc[::13, "item3"] = "NA", "null", "N/A"
+    df.loc[::17, "CUSTOMER_ID"], df.loc[::19, "STORE_NUMBER"] = "NA", "N/A"
+    path = tmp_path / "carts.csv"
+    df.to_csv(path, index=False)
+    art = load_model_artifact()
+    want = batch_predict(pd.read_csv(path, dtype=str), None, art["item_type"], art["top_by_type"],
+                         art["item_feat"], art["known_items_lower"], art["lower_to_orig"], DEFAULT_BLACKLIST,
+                         model=SmartCartModel.from_artifact(art), matcher=art["matcher"], use_customer=True)
+    out = tmp_path / "out.csv"
+    batch.run_batch(str(path), str(out), chunksize=70, use_customer=True, log=io.StringIO())
+    assert out.read_text() == want.to_csv(index=False)
+    assert "NA" not in pd.read_csv(out, dtype=str, keep_default_na=False)["item1"].tolist()
+
+@pytest.mark.parametrize("legacy_record", [False, True])
+def test_run_batch_resumes(tmp_path, monkeypatch, synth_data, expected, legacy_record):
+    out = tmp_path / "out.csv"
+    predict, calls = batch.predict_chunk, []
+    def flaky(*args):
+        calls.append(1)
+        if len(calls) == 3:
+            raise KeyboardInterrupt
+        return predict(*args)
+    monkeypatch.setattr(batch, "predict_chunk", flaky)
+    with pytest.raises(KeyboardInterrupt):
+        batch.run_batch(synth_data["test"], str(out), chunksize=70, log=io.StringIO())
+    progress_path = str(out) + batch.PROGRESS_SUFFIX
+    progress = json.loads(open(progress_path).read())
+    assert progress["rows"] == 140 and progress["input_bytes"] > 0
+    if legacy_record:  # written before input offsets were recorded
+        del progress["input_bytes"]
+        with open(progress_path, "w") as f:
+            json.dump(progress, f)
+    monkeypatch.setattr(batch, "predict_chunk", predict)
+    summary = batch.run_batch(synth_data["test"], str(out), chunksize=70, log=io.StringIO())
+    assert (summary["rows"], summary["total_rows"]) == (160, 300)
+    assert out.read_text() == expected
@@ -0,0 +1,28 @@
+"""Benchmark suite: synthetic data shape and the serving stages on a small build."""
+import pandas as pd
+
+from artifact_store import publish_version
+from bench import run, synth
+from data_loader import extract_item_names
+
+def test_synth_is_reproducible_and_in_schema(tmp_path):
+    a = synth.generate(str(tmp_path / "a"), n_orders=300, n_items=30, n_stores=4, n_test=50, chunk=100)
+    b = synth.generate(str(tmp_path / "b"), n_orders=300, n_items=30, n_stores=4, n_test=50, chunk=100)
+    for table in ("order", "customer", "store", "test"):
+        assert open(a[table], "rb").read() == open(b[table], "rb").read(), table
+    orders = pd.read_csv(a["order"], dtype=str)
+    assert len(orders) == 300 and {"CUSTOMER_ID", "STORE_NUMBER", "ORDERS"} <= set(orders.columns)
+    names = {n for payload in orders["ORDERS"] for n in extract_item_names(payload)}
+    assert set(synth.menu(30)["main"]) & names
+    assert len(pd.read_csv(a["test"])) == 50
+
+def test_serving_stages_report_timings(full_build):
+    publish_version("full")
+    opts = {"carts": 200, "batch_rows": 500, "repeats": 2}
+    latency = run.recommend_latency(opts)
+    assert latency["SmartCartModel.recommend"]["n"] == latency["enhanced_recommend"]["n"] == 200
+    assert 0 < latency["SmartCartModel.recommend"]["p50_us"] <= latency["SmartCartModel.recommend"]["p99_us"]
+    batch = run.batch_predict(opts)
+    assert batch["rows"] == 500 and batch["rows_per_s"] > 0
+    load = run.artifact_load(opts)
+    assert all(load[k] >= 0 for k in ("open_mmap_s", "load_model_artifact_s", "compile_model_s"))
@@ -0,0 +1,50 @@
+"""Background build jobs: progress counters and cancellation of a pooled count."""
+import pytest
+
+import build_jobs
+import data_loader
+import instrument
+from data_loader import stream_order_counts
+
+def run(name, fn, *args):
+    job = build_jobs.submit(name, fn, *args)
+    job._thread.join(60)
+    assert not job.active
+    return job
+
+def test_job_counts_progress(order_df):
+    job = run("progress", lambda: build_jobs.step("Counting orders") or stream_order_counts(workers=1, chunksize=700))
+    assert job.state == "done" and job.result.n_orders == len(order_df)
+    snap = job.snapshot()
+    assert snap["step"] == "Counting orders"
+    assert snap["orders_parsed"] == snap["orders_counted"] == len(order_df)
+
+def test_cancel_stops_a_pooled_count(monkeypatch, order_df):
+    monkeypatch.setattr(data_loader, "SHARD_BYTES", 16 << 10)  # many more shards than workers
+    seen = []
+
+    def count_until_cancelled():
+        build_jobs.step("Counting orders")
+        job = build_jobs.current("cancel")
+
+        def on_stage(rec):  # the build's own stage hook: cancel once the first shard is absorbed
+            seen.append(rec["stage"])
+            if rec["stage"] == "pair_counting":
+                job.cancel()
+                build_jobs.step("Counting orders")  # raises BuildCancelled, as the job's listener does
+        with instrument.listen(on_stage):
+            return stream_order_counts(workers=2, chunksize=200)
+
+    job = run("cancel", count_until_cancelled)
+    assert job.state == "cancelled" and job.result is None and job.error is None
+    assert job.snapshot()["cancel_requested"]
+    assert "merge" not in seen and seen.count("pair_counting") == 1
+    # a new build of the same name starts once the cancelled one is finished
+    again = run("cancel", lambda: stream_order_counts(workers=1, chunksize=700))
+    assert again is not job and again.state == "done"
+
+def test_failed_build_keeps_the_error():
+    job = run("failing", lambda: stream_order_counts(path="/nonexistent/orders.csv"))
+    assert job.state == "failed" and job.error.startswith("FileNotFoundError")
+    with pytest.raises(FileNotFoundError):
+        stream_order_counts(path="/nonexistent/orders.csv")
@@ -0,0 +1,92 @@
+"""Counting and parsing against the original per-order loops."""
+from collections import Counter, defaultdict
+
+import numpy as np
+import pytest
+
+import data_loader
+import instrument
+from data_loader import (
+    OrderParser, build_items_and_tags, build_normalized_comatrix, clean_item_list, comatrix_from_counts,
+    extract_item_names, items_and_tags_from_counts, parse_orders, stream_order_counts
+)
+
+def reference_lists(order_df):
+    return [clean_item_list(extract_item_names(p)) for p in order_df["ORDERS"]]
+
+def reference_comatrix(lists):
+    """The original ``build_normalized_comatrix`` loop."""
+    item_count = defaultdict(int)
+    pair_count = defaultdict(lambda: defaultdict(int))
+    for items in lists:
+        uniq = list(set(items))
+        for i in uniq:
+            item_count[i] += 1
+        for a in uniq:
+            for b in uniq:
+                if a != b:
+                    pair_count[a][b] += 1
+    return {a: {b: c / (item_count[a] or 1) for b, c in row.items()} for a, row in pair_count.items()}
+
+def reference_top_by_type(lists):
+    """The original ``build_items_and_tags`` frequency ranking."""
+    all_items = {it for row in lists for it in row}
+    item_type = {it: data_loader.tag_item_type(it) for it in all_items}
+    top = defaultdict(list)
+    for item, c in Counter(it for row in lists for it in row).items():
+        if item_type[item] in ["main", "side", "dip", "drink"]:
+            top[item_type[item]].append((item, c))
+    for t in top:
+        top[t].sort(key=lambda x: -x[1])
+    return dict(top)
+
+def test_parser_matches_per_row_extraction(order_df):
+    parsed = OrderParser().parse(order_df["ORDERS"])
+    got = [[] for _ in range(parsed.n_orders)]
+    for o, i in zip(parsed.order_idx.tolist(), parsed.item_ids.tolist()):
+        got[o].append(parsed.items[i])
+    assert got == reference_lists(order_df)
+
+def test_comatrix_matches_reference(order_df):
+    assert build_normalized_comatrix(order_df) == reference_comatrix(reference_lists(order_df))
+
+def test_sampled_comatrix_matches_reference(order_df):
+    sample = order_df.sample(n=1_000, random_state=42)
+    assert build_normalized_comatrix(parse_orders(order_df), sample_n=1_000) == \
+        reference_comatrix(reference_lists(sample))
+
+def test_items_and_tags_match_reference(order_df):
+    lists = reference_lists(order_df)
+    item_type, item_feat, top_by_type, all_items = build_items_and_tags(order_df)
+    assert all_items == sorted({it for row in lists for it in row})
+    assert item_feat == {it: data_loader.extract_item_features(it) for it in all_items}
+    assert dict(top_by_type) == reference_top_by_type(lists)
+
+def _assert_counts_equal(a, b):
+    assert a.items == b.items
+    assert (a.n_orders, a.n_occurrences, a.segments) == (b.n_orders, b.n_occurrences, b.segments)
+    for field in ("freq", "item_count", "pair_count", "first_seen", "seg_orders", "seg_item_count",
+                  "seg_pair_count", "triple_keys", "triple_counts"):
+        np.testing.assert_array_equal(getattr(a, field), getattr(b, field), err_msg=field)
+
+@pytest.mark.parametrize("segments, pair_context", [(False, False), (True, True)])
+def test_sharded_counts_match_serial(monkeypatch, segments, pair_context):
+    serial = stream_order_counts(workers=1, chunksize=700, segments=segments, pair_context=pair_context)
+    monkeypatch.setattr(data_loader, "SHARD_BYTES", 64 << 10)  # several shards per worker
+    sharded = stream_order_counts(workers=2, chunksize=700, segments=segments, pair_context=pair_context)
+    _assert_counts_equal(serial, sharded)
+
+def test_pooled_counts_report_progress_per_shard(order_df):
+    seen = []
+    with instrument.listen(lambda rec: seen.append((rec["stage"], rec.get("rows") or 0))):
+        stream_order_counts(workers=2, chunksize=700)
+    counted = [rows for name, rows in seen if name == "pair_counting"]
+    assert sum(counted) == len(order_df)
+    assert len(counted) >= 2 * data_loader.SHARDS_PER_WORKER  # one or more per shard
+    assert seen[-1][0] == "merge"
+
+def test_streamed_build_matches_reference(order_df):
+    lists = reference_lists(order_df)
+    counts = stream_order_counts(workers=1, chunksize=900)
+    assert comatrix_from_counts(counts) == reference_comatrix(lists)
+    assert dict(items_and_tags_from_counts(counts)[2]) == reference_top_by_type(lists)
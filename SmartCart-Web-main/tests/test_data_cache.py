@@ -0,0 +1,50 @@
+"""Columnar data cache: every table reads back as ``pd.read_csv`` reads the CSV."""
+from functools import partial
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import data_cache
+from data_cache import build_data_cache, load_columns, row_counts
+from paths import csv_paths
+
+def assert_frame_matches(got, want):
+    assert list(got.columns) == list(want.columns) and len(got) == len(want)
+    for col in want:
+        g, w = pd.Series(got[col]), want[col]
+        if "DATE" in col.upper():
+            w = pd.to_datetime(w, errors="coerce").to_numpy(dtype="datetime64[s]")
+            np.testing.assert_array_equal(g.to_numpy(dtype="datetime64[s]"), w, err_msg=col)
+        elif w.dtype.kind in "biuf":
+            np.testing.assert_array_equal(g.to_numpy(dtype=np.float64), w.to_numpy(dtype=np.float64), err_msg=col)
+        else:
+            assert [None if pd.isna(x) else x for x in g] == [None if pd.isna(x) else x for x in w], col
+
+@pytest.mark.parametrize("table", ["order", "customer", "store", "test"])
+def test_cache_round_trip(monkeypatch, table):
+    monkeypatch.setattr(data_cache, "convert_csv", partial(data_cache.convert_csv, chunksize=700))  # several chunks
+    build_data_cache(force=True)
+    assert row_counts()[table] == len(pd.read_csv(csv_paths()[table]))
+    assert_frame_matches(load_columns(table), pd.read_csv(csv_paths()[table]))
+
+def test_kind_is_not_taken_from_the_first_chunk_alone(monkeypatch, tmp_path):
+    rows = 60
+    df = pd.DataFrame({
+        "CODE": [str(i) for i in range(rows - 5)] + ["A1", "B2", "", "C3", "7"],  # text only at the end
+        "NOTE": ["x"] * 10 + [str(i) if i % 3 else "" for i in range(rows - 10)],  # numbers (and blanks) later
+        "ID": range(rows),
+        "EMPTY_START": [""] * 30 + ["late"] * 30,
+    })
+    path = tmp_path / "mixed.csv"
+    df.to_csv(path, index=False)
+    monkeypatch.setattr(data_cache, "csv_paths", lambda: {"mixed": str(path)})
+    monkeypatch.setattr(data_cache, "cache_dir", lambda: str(tmp_path / "cache"))
+    monkeypatch.setattr(data_cache, "convert_csv", partial(data_cache.convert_csv, chunksize=20))
+    meta = build_data_cache(force=True)
+    kinds = {col: c["kind"] for col, c in meta["tables"]["mixed"]["columns"].items()}
+    assert kinds == {"CODE": "category", "NOTE": "category", "ID": "numeric", "EMPTY_START": "category"}
+    got = load_columns("mixed")
+    want = pd.read_csv(path, dtype={"CODE": str, "NOTE": str, "EMPTY_START": str})
+    assert_frame_matches(got, want)
+    assert got["CODE"].iloc[-5:].tolist()[:2] == ["A1", "B2"] and got["NOTE"].iloc[11] == "1"
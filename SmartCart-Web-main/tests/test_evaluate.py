@@ -0,0 +1,50 @@
+"""Offline evaluation: loading, the time split, holdout carts and the report."""
+import numpy as np
+import pytest
+
+from data_loader import clean_item_list, extract_item_names
+from evaluate import evaluate, load_orders, make_holdout_carts, time_split
+
+BAD_ROWS = slice(1, None, 50)
+
+@pytest.fixture(scope="module")
+def orders(synth_data):
+    dates, parsed = load_orders(synth_data["order"], chunksize=700)
+    dates.iloc[BAD_ROWS] = "not a date"
+    return dates, parsed
+
+def test_load_orders_matches_per_row_extraction(orders, order_df):
+    dates, parsed = orders
+    assert len(dates) == parsed.n_orders == len(order_df)
+    got = [[] for _ in range(parsed.n_orders)]
+    for o, i in zip(parsed.order_idx.tolist(), parsed.item_ids.tolist()):
+        got[o].append(parsed.items[i])
+    assert got == [clean_item_list(extract_item_names(p)) for p in order_df["ORDERS"]]
+
+def test_time_split_leaves_out_undated_orders(orders):
+    dates, _ = orders
+    train, holdout, undated = time_split(dates, holdout_frac=0.2)
+    assert undated == len(dates.iloc[BAD_ROWS])
+    assert len(train) + len(holdout) + undated == len(dates)
+    assert not dates.iloc[holdout].eq("not a date").any()
+
+def test_holdout_carts_split_each_order(orders):
+    _, parsed = orders
+    item_id = {it: i for i, it in enumerate(sorted(parsed.items))}
+    codes, hidden = make_holdout_carts(parsed, item_id)
+    lists = [set() for _ in range(parsed.n_orders)]
+    for o, i in zip(parsed.order_idx.tolist(), parsed.item_ids.tolist()):
+        lists[o].add(item_id[parsed.items[i]])
+    carts = [ids for ids in lists if len(ids) >= 2]
+    assert len(codes) == len(carts)
+    for row, h, ids in zip(codes, hidden, carts):
+        visible = set(row[row >= 0].tolist())
+        assert len(visible) == min(3, len(ids) - 1)
+        assert visible | set(np.flatnonzero(h).tolist()) == ids and not visible & set(np.flatnonzero(h).tolist())
+
+def test_evaluate_reports_grid(orders):
+    report = evaluate(*orders, boost_factors=(1.0, 1.2), max_per_types=(1,), holdout_frac=0.2, workers=1)
+    assert report["undated_orders"] == len(orders[0].iloc[BAD_ROWS])
+    assert report["evaluated_carts"] > 0 and len(report["grid"]) == 2
+    for res in report["grid"]:
+        assert 0 <= res["recall@3"] <= 1 and 0 <= res["coverage"] <= 1
@@ -0,0 +1,34 @@
+"""Stage records: per-stage memory peaks, worker records and listeners."""
+import time
+
+import numpy as np
+
+import instrument
+
+def test_stage_peak_is_per_stage():
+    with instrument.stage("big") as big:
+        block = np.ones(32 << 20)  # 256 MB, touched
+        time.sleep(3 * instrument.RSS_SAMPLE_S)
+    del block
+    with instrument.stage("small") as small:
+        np.ones(1 << 16).sum()
+    assert big["peak_rss_mb"] >= small["peak_rss_mb"] + 200
+    assert small["peak_rss_mb"] >= small["rss_mb"]
+
+def test_sampler_raises_peak_of_open_stages():
+    with instrument.stage("outer") as outer:
+        with instrument.stage("spike") as spike:
+            block = np.ones(32 << 20)  # 256 MB
+            time.sleep(3 * instrument.RSS_SAMPLE_S)
+            del block
+        assert spike["peak_rss_mb"] >= spike["rss_mb"] + 200  # freed before the stage ended
+    assert outer["peak_rss_mb"] >= spike["peak_rss_mb"]
+
+def test_absorbed_records_reach_listener():
+    seen = []
+    with instrument.capture() as recs:
+        with instrument.stage("worker", rows=3):
+            pass
+    with instrument.listen(seen.append):
+        instrument.absorb(recs)
+    assert [(r["stage"], r["rows"]) for r in seen] == [("worker", 3)]
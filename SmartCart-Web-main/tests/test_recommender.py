@@ -0,0 +1,107 @@
+"""Compiled and batched recommenders against ``enhanced_recommend``."""
+from concurrent.futures import ThreadPoolExecutor
+from difflib import get_close_matches
+
+import numpy as np
+import pytest
+
+from item_matcher import ItemMatcher
+from reco_cache import RecommendationCache
+from recommender import SmartCartModel, batch_predict, enhanced_recommend, normalize_user_items
+
+def random_carts(items, n=300, seed=0):
+    """Carts of 1-3 items, some with an unknown name or a repeated item."""
+    rng = np.random.default_rng(seed)
+    carts = []
+    for _ in range(n):
+        cart = [items[i] for i in rng.choice(len(items), size=rng.integers(1, 4))]
+        if rng.random() < 0.1:
+            cart.append("Mystery Item")
+        carts.append(cart)
+    return carts
+
+def reference(art, cart, **kw):
+    return enhanced_recommend(cart, art["co_norm"], art["item_type"], art["top_by_type"], art["item_feat"], **kw)
+
+@pytest.fixture(scope="module")
+def art(full_build):
+    return full_build["art"]
+
+@pytest.fixture(scope="module")
+def model(art):
+    return SmartCartModel.from_artifact(art, pair_context=False)
+
+@pytest.mark.parametrize("boost_factor, max_per_type", [(1.2, 1), (1.0, 2), (1.5, 1)])
+def test_model_matches_enhanced_recommend(art, model, boost_factor, max_per_type):
+    for cart in random_carts(model.items):
+        kw = dict(boost_factor=boost_factor, max_per_type=max_per_type)
+        assert model.recommend(cart, **kw) == reference(art, cart, **kw), cart
+
+def test_catalog_path_matches_tag_sets(art, model):
+    for cart in random_carts(model.items, 100, seed=1):
+        assert reference(art, cart, catalog=art["catalog"]) == reference(art, cart)
+
+def test_context_segments_match(art, model):
+    occasions = sorted({sg.partition("=")[2] for sg in art["segment_co"] if sg.startswith("occasion=")})
+    assert occasions
+    for k, cart in enumerate(random_carts(model.items, 150, seed=2)):
+        ctx = {"occasion": occasions[k % len(occasions)]}
+        assert model.recommend(cart, context=ctx) == reference(art, cart, context=ctx, segment_co=art["segment_co"])
+
+def test_pair_context_matches(art):
+    assert SmartCartModel.from_artifact(art).pair_row is None  # opt-in
+    pair_model = SmartCartModel.from_artifact(art, pair_context=True)
+    assert pair_model.pair_row is not None
+    for cart in random_carts(pair_model.items, seed=3):
+        assert pair_model.recommend(cart) == reference(art, cart, pair_co=art["pair_co"])
+
+def test_customer_rerank_matches(art, model):
+    history = art["customer_history"]
+    customers = np.asarray(history.ids[:50]).tolist()
+    for cid, cart in zip(customers, random_carts(model.items, len(customers), seed=4)):
+        assert model.recommend(cart, customer_id=cid) == reference(art, cart, customer_id=cid, history=history)
+
+def test_recommend_batch_matches_recommend(art, model):
+    carts = [c for c in random_carts(model.items, seed=5) if "Mystery Item" not in c]
+    codes = np.full((len(carts), 3), model.EMPTY, dtype=np.int64)
+    for r, cart in enumerate(carts):
+        codes[r, :len(cart)] = [model.item_id[x] for x in cart]
+    rec, score = model.recommend_batch(codes)
+    for r, cart in enumerate(carts):
+        got = [(model.items[i], round(float(s), 4)) for i, s in zip(rec[r], score[r]) if i >= 0]
+        assert got == model.recommend(cart), cart
+
+def test_batch_predict_matches_per_row(art, model, test_df):
+    out = batch_predict(test_df, None, art["item_type"], art["top_by_type"], art["item_feat"],
+                        art["known_items_lower"], art["lower_to_orig"], model=model, matcher=art["matcher"])
+    for r, row in enumerate(test_df[["item1", "item2", "item3"]].itertuples(index=False)):
+        cart = normalize_user_items([x for x in row if x], art["known_items_lower"], art["lower_to_orig"],
+                                    matcher=art["matcher"])
+        want = [it for it, _ in reference(art, cart)]
+        got = [x for x in out.loc[r, ["RECOMMENDATION 1", "RECOMMENDATION 2", "RECOMMENDATION 3"]] if x]
+        assert got == want
+
+def test_matcher_matches_difflib(art):
+    lower_to_orig = art["lower_to_orig"]
+    matcher = ItemMatcher(lower_to_orig)
+    names = list(lower_to_orig)
+    raws = [nm[:-2] for nm in names] + [nm.replace("a", "e") for nm in names] + ["zzz", "wings", ""]
+    for raw in raws:
+        m = get_close_matches(raw.lower(), names, n=1, cutoff=matcher.cutoff)
+        assert matcher.match(raw) == (lower_to_orig[m[0]] if m else None), raw
+
+def test_cache_matches_model(art, model):
+    cache = RecommendationCache(model, art["version"], maxsize=20)
+    carts = random_carts(model.items, 200, seed=6)
+    for cart in carts + carts:
+        assert cache.recommend(cart) == model.recommend(sorted(cart))
+    assert cache.evictions > 0 and cache.hits + cache.misses == 2 * len(carts)
+
+def test_cache_shared_across_threads(art, model):
+    cache = RecommendationCache(model, art["version"], maxsize=30)
+    carts = random_carts(model.items, 400, seed=7)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        got = list(pool.map(cache.recommend, carts * 3))
+    assert got == [model.recommend(sorted(c)) for c in carts * 3]
+    stats = cache.stats()
+    assert stats["hits"] + stats["misses"] == 3 * len(carts) and stats["size"] <= 30
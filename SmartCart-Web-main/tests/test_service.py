@@ -0,0 +1,63 @@
+"""HTTP service: micro-batched requests over a real socket."""
+import asyncio, json
+
+import numpy as np
+import pytest
+
+from artifact_store import publish_version
+from recommender import enhanced_recommend
+from service import RecommendationService, ServingState
+
+async def _request(port, path, body):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    data = body if isinstance(body, bytes) else json.dumps(body).encode()
+    writer.write(f"POST {path} HTTP/1.1\r\nContent-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode() + data)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    raw = await reader.read()
+    writer.close()
+    return status, json.loads(raw.split(b"\r\n\r\n", 1)[1])
+
+async def _serve(svc, requests):
+    """Run the batcher and a server on a free port, send ``requests`` concurrently."""
+    svc.queue, svc._reload_lock = asyncio.Queue(), asyncio.Lock()
+    batcher = asyncio.create_task(svc.run_batcher())
+    server = await asyncio.start_server(svc.handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    try:
+        return await asyncio.gather(*(_request(port, path, body) for path, body in requests))
+    finally:
+        server.close()
+        batcher.cancel()
+
+@pytest.fixture(scope="module")
+def svc(full_build):
+    publish_version("full")
+    return RecommendationService(max_wait=0.05)
+
+def test_micro_batched_requests_match_enhanced_recommend(svc, full_build):
+    art = full_build["art"]
+    items, rng = svc.state.model.items, np.random.default_rng(7)
+    carts = [[items[i] for i in rng.choice(len(items), size=rng.integers(1, 4))] for _ in range(40)]
+    replies = asyncio.run(_serve(svc, [("/recommend", {"items": c}) for c in carts]))
+    assert svc.batches < len(carts) and svc.batched_requests == len(carts)
+    for cart, (status, payload) in zip(carts, replies):
+        want = enhanced_recommend(cart, art["co_norm"], art["item_type"], art["top_by_type"], art["item_feat"])
+        assert status == 200 and payload["version"] == svc.state.version
+        assert [(r["item"], r["score"]) for r in payload["recommendations"]] == want
+
+@pytest.mark.parametrize("path, body", [("/recommend", {"items": "not a list"}),
+                                        ("/recommend", {"items": [], "top_n": "many"}),
+                                        ("/recommend/batch", {"carts": [["x"]], "context": "evening"}),
+                                        ("/recommend", b"{not json")])
+def test_bad_input_is_a_400(svc, path, body):
+    [(status, payload)] = asyncio.run(_serve(svc, [(path, body)]))
+    assert status == 400 and payload["error"]
+
+def test_scoring_error_is_a_500(svc, monkeypatch):
+    class Broken(ServingState):
+        def score(self, *args):
+            raise RuntimeError("matrix went away")
+    monkeypatch.setattr(svc, "state", Broken(**vars(svc.state)))
+    replies = asyncio.run(_serve(svc, [("/recommend", {"items": ["x"]}), ("/recommend/batch", {"carts": [["x"]]})]))
+    assert [(status, payload["error"]) for status, payload in replies] == [(500, "RuntimeError: matrix went away")] * 2